@@ -1,14 +1,20 @@
+import os
 import traceback
 import logging
-import urllib.request, urllib.parse, urllib.error
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
 from django.utils import timezone
 from django.utils.timezone import datetime
-from bs4 import BeautifulSoup
 import pytz
 
 from utils.date_utils import dates_overlap
+from utils.game_history_index import GameHistoryIndex
+from utils.page_cache import PageCache, DEFAULT_MAX_BYTES as DEFAULT_CACHE_MAX_BYTES
+from utils.scraper_http import get_default_client
+from utils.stats_page_parser import DEFAULT_BACKEND as DEFAULT_PARSER_BACKEND, parse_game_history_rows, \
+    parse_player_rows
 
 LOG = logging.getLogger("roster-tracker")
 LOG.setLevel(logging.DEBUG)
@@ -22,9 +28,18 @@ LOG.setLevel(logging.DEBUG)
 
 MINIMUM_ATTENDANCE_NUMBER = 5
 
+# Upper bound on event pages fetched and parsed at the same time.
+MAX_CONCURRENT_PAGE_LOADS = 4
+
 BASE_SERVER_SCRAPE_URL = "http://arma3.swec.se"
 CNTO_SERVER_SCRAPE_URL = BASE_SERVER_SCRAPE_URL + "/server/data/375393"
 
+_EVENT_PAGE_CACHE = None
+_EVENT_PAGE_CACHE_LOCK = threading.Lock()
+
+_GAME_HISTORY_INDEX = None
+_GAME_HISTORY_INDEX_LOCK = threading.Lock()
+
 
 class ScrapeThread(threading.Thread):
     def __init__(self, viewer, start_dt, end_dt):
@@ -51,6 +66,14 @@ class ScrapeThread(threading.Thread):
         self._viewer.busy_signal.emit(False)
 
 
+def get_parser_backend():
+    """
+
+    :return: name of the stats page parser backend, "lxml" unless SCRAPER_PARSER_BACKEND says otherwise.
+    """
+    return getattr(settings, "SCRAPER_PARSER_BACKEND", DEFAULT_PARSER_BACKEND)
+
+
 def get_url_for_event_page(page_number=1):
     """
     """
@@ -63,54 +86,18 @@ def complete_event_url(partial_event_url):
     return BASE_SERVER_SCRAPE_URL + partial_event_url
 
 
-def get_all_events_for_page(page_number=1):
+def get_events_from_history_page(page_content):
     """
-    """
-    event_url = get_url_for_event_page(page_number)
-    LOG.info("Loading all events for page %s...", event_url)
-    page_file = urllib.request.urlopen(event_url)
-    # page_file = open("temp.html", "r") 
-    soup = BeautifulSoup(page_file, "lxml")
-
-    if soup is None:
-        raise ValueError("No soup!")
-
-    def full_table(tag):
-        """
-        """
-        if tag.name.lower() != "table":
-            return False
-
-        if not tag.has_attr("class"):
-            return False
-
-        if "full" not in [class_name.lower() for class_name in tag["class"]]:
-            return False
-
-        for child in tag.parent.parent.children:
-            if child.name == "h2":
-                if child.text.lower() == "game history":
-                    return True
-
-        return False
-
-    found_full_table = soup.find_all(full_table)[0]
 
+    :param page_content:
+    :return: {start_dt: event dict} of the events listed on a game history page.
+    """
     all_event_dicts = {}
 
-    event_rows = found_full_table("tr")
-    for event_row in event_rows:
-        if len(event_row("th")) > 0:
-            continue
-
-        column_values = event_row("td")
-
-        event_url = column_values[0]("a")[0]["href"]
-        players_string = column_values[1].text
-        start_dt_string = column_values[3].text
+    event_rows = parse_game_history_rows(page_content, get_parser_backend())
+    for event_url, players_string, start_dt_string, end_dt_string in event_rows:
         current_start_dt = timezone.make_aware(datetime.strptime(start_dt_string, "%Y-%m-%d %H:%M"),
                                                pytz.utc)
-        end_dt_string = column_values[4].text
         try:
             current_end_dt = timezone.make_aware(datetime.strptime(end_dt_string, "%Y-%m-%d %H:%M"),
                                                  pytz.utc)
@@ -120,27 +107,72 @@ def get_all_events_for_page(page_number=1):
         all_event_dicts[current_start_dt] = {
             "player_count": int(players_string.split("/")[0]),
             "event_url": complete_event_url(event_url),
-            "end_dt": current_end_dt
+            "end_dt": current_end_dt,
+            "finished": current_end_dt is not None,
         }
 
     return all_event_dicts
 
 
-def get_all_events_from_start_to_end(start_dt, end_dt):
+def get_all_events_for_page(page_number=1):
     """
     """
+    event_url = get_url_for_event_page(page_number)
+    LOG.info("Loading all events for page %s...", event_url)
+    page_content = get_default_client().get_content(event_url)
+    # page_content = open("temp.html", "r")
+
+    return get_events_from_history_page(page_content)
+
+
+def get_game_history_index():
+    """
+
+    :return: the shared game history index, or None when no SCRAPER_CACHE_DIR is configured.
+    """
+    global _GAME_HISTORY_INDEX
+
+    cache_dir = getattr(settings, "SCRAPER_CACHE_DIR", None)
+    if cache_dir is None:
+        return None
+
+    with _GAME_HISTORY_INDEX_LOCK:
+        if _GAME_HISTORY_INDEX is None:
+            _GAME_HISTORY_INDEX = GameHistoryIndex(os.path.join(cache_dir, "game-history-index.json"),
+                                                   get_all_events_for_page)
+
+        return _GAME_HISTORY_INDEX
 
+
+def get_all_events_back_to(start_dt, load_page=get_all_events_for_page):
+    """Page through the game history without an index until it reaches back to start_dt.
+
+    :param start_dt:
+    :param load_page: callable returning the {start_dt: event dict} of a history page number.
+    :return: events of all loaded pages.
+    """
     current_page = 1
 
     all_event_dicts = {}
 
     while len(all_event_dicts) == 0 or min(all_event_dicts) > start_dt:
-        page_events = get_all_events_for_page(current_page)
+        page_events = load_page(current_page)
 
         all_event_dicts.update(page_events)
 
         current_page += 1
 
+    return all_event_dicts
+
+
+def get_relevant_events(all_event_dicts, start_dt, end_dt):
+    """
+
+    :param all_event_dicts:
+    :param start_dt:
+    :param end_dt:
+    :return: events overlapping the period with enough players, clipped to the period.
+    """
     sorted_start_dts = sorted(all_event_dicts.keys())
 
     relevant_events = {}
@@ -161,48 +193,94 @@ def get_all_events_from_start_to_end(start_dt, end_dt):
     return relevant_events
 
 
-def get_attendance_rates_from_event_url(event_url):
+def get_all_events_from_start_to_end(start_dt, end_dt):
     """
     """
-    LOG.info("Loading event attendance rates from %s...", event_url)
-    page_file = urllib.request.urlopen(event_url)
-    # page_file = open("event.html", "r") 
-    soup = BeautifulSoup(page_file, "lxml")
+    history_index = get_game_history_index()
+
+    if history_index is not None:
+        all_event_dicts = history_index.get_events_between(start_dt, end_dt)
+    else:
+        all_event_dicts = get_all_events_back_to(start_dt)
+
+    return get_relevant_events(all_event_dicts, start_dt, end_dt)
 
-    if soup is None:
-        raise ValueError("No soup!")
 
-    def full_table(tag):
-        """
-        """
-        if tag.name.lower() != "table":
-            return False
+def get_event_page_cache():
+    """
+
+    :return: the shared cache of event pages, or None when no SCRAPER_CACHE_DIR is configured.
+    """
+    global _EVENT_PAGE_CACHE
 
-        if not tag.has_attr("class"):
-            return False
+    cache_dir = getattr(settings, "SCRAPER_CACHE_DIR", None)
+    if cache_dir is None:
+        return None
 
-        if "full" not in [class_name.lower() for class_name in tag["class"]]:
-            return False
+    with _EVENT_PAGE_CACHE_LOCK:
+        if _EVENT_PAGE_CACHE is None:
+            _EVENT_PAGE_CACHE = PageCache(os.path.join(cache_dir, "event-pages"),
+                                          max_bytes=getattr(settings, "SCRAPER_CACHE_MAX_BYTES",
+                                                            DEFAULT_CACHE_MAX_BYTES))
 
-        for child in tag.parent.children:
-            if child.name == "h2":
-                if child.text.lower() == "players":
-                    return True
+        return _EVENT_PAGE_CACHE
 
-        return False
 
-    found_full_table = soup.find_all(full_table)[0]
+def load_event_page(event_url, event_finished=False):
+    """Load an event page, going through the page cache when one is configured.
 
-    all_player_attendances = {}
+    Pages of finished events never change and are served from the cache without a request. Pages of running events
+    are revalidated with a conditional request.
 
-    player_rows = found_full_table("tr")
-    for player_row in player_rows:
-        if len(player_row("th")) > 0:
-            continue
+    :param event_url:
+    :param event_finished:
+    :return: page content.
+    """
+    client = get_default_client()
+    page_cache = get_event_page_cache()
+    if page_cache is None:
+        return client.get_content(event_url)
+
+    cached_page = page_cache.get(event_url)
+    if cached_page is not None and cached_page["finished"]:
+        page_cache.count("hits")
+        return cached_page["content"]
+
+    request_headers = {}
+    if cached_page is not None:
+        if cached_page["etag"] is not None:
+            request_headers["If-None-Match"] = cached_page["etag"]
+        if cached_page["last_modified"] is not None:
+            request_headers["If-Modified-Since"] = cached_page["last_modified"]
+
+    response = client.get(event_url, headers=request_headers)
+
+    if response.status_code == 304 and cached_page is not None:
+        page_cache.count("revalidated")
+        page_content = cached_page["content"]
+        if event_finished:
+            page_cache.put(event_url, page_content, True, etag=cached_page["etag"],
+                           last_modified=cached_page["last_modified"])
+        return page_content
+
+    page_cache.count("misses")
+    page_content = response.content
+    page_cache.put(event_url, page_content, event_finished, etag=response.headers.get("ETag"),
+                   last_modified=response.headers.get("Last-Modified"))
+
+    return page_content
+
+
+def get_attendance_rates_from_event_url(event_url, event_finished=False):
+    """
+    """
+    LOG.info("Loading event attendance rates from %s...", event_url)
+    page_content = load_event_page(event_url, event_finished)
+    # page_content = open("event.html", "r")
+    all_player_attendances = {}
 
-        column_values = player_row("td")
-        player_name = column_values[0].text
-        attendance_style = column_values[3]("div")[0]["style"]
+    player_rows = parse_player_rows(page_content, get_parser_backend())
+    for player_name, attendance_style in player_rows:
         attendance_parts = [part.strip() for part in attendance_style.split(";")]
         attendance_parts_dict = {}
         for part in attendance_parts:
@@ -227,7 +305,37 @@ def get_attendance_rates_from_event_url(event_url):
     return all_player_attendances
 
 
-def get_all_event_attendances_between(start_dt, end_dt):
+def get_attendance_rates_for_events(events, max_concurrent_page_loads=MAX_CONCURRENT_PAGE_LOADS,
+                                    progress_callback=None):
+    """Fetch and parse the pages of the given events using a bounded pool of workers.
+
+    :param events: event dicts as returned by get_all_events_for_page.
+    :param max_concurrent_page_loads: maximum number of pages loaded at the same time, 1 loads them one by one.
+    :param progress_callback: optional callable receiving the number of parsed and total event pages.
+    :return: list of attendance rate dicts in the same order as events.
+    """
+    def get_attendance_rates_for_event(event):
+        return get_attendance_rates_from_event_url(event["event_url"], event_finished=event["finished"])
+
+    def collect(attendance_rates_iterator):
+        all_event_attendances = []
+        for event_attendances in attendance_rates_iterator:
+            all_event_attendances.append(event_attendances)
+            if progress_callback is not None:
+                progress_callback(len(all_event_attendances), len(events))
+
+        return all_event_attendances
+
+    if max_concurrent_page_loads <= 1 or len(events) <= 1:
+        return collect(get_attendance_rates_for_event(event) for event in events)
+
+    worker_count = min(max_concurrent_page_loads, len(events))
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        return collect(executor.map(get_attendance_rates_for_event, events))
+
+
+def get_all_event_attendances_between(start_dt, end_dt, max_concurrent_page_loads=MAX_CONCURRENT_PAGE_LOADS,
+                                      progress_callback=None):
     """
     """
     events = get_all_events_from_start_to_end(start_dt, end_dt)
@@ -235,11 +343,18 @@ def get_all_event_attendances_between(start_dt, end_dt):
     if len(events) == 0:
         raise ValueError("No events took place in specified time frame!")
 
+    if progress_callback is not None:
+        progress_callback(0, len(events))
+
+    sorted_event_start_dts = sorted(events)
+    all_event_attendances = get_attendance_rates_for_events(
+        [events[event_start_dt] for event_start_dt in sorted_event_start_dts],
+        max_concurrent_page_loads=max_concurrent_page_loads, progress_callback=progress_callback)
+
     overall_attendances = {}
     total_events_minutes = 0
-    for event_start_dt in sorted(events):
+    for event_start_dt, event_attendances in zip(sorted_event_start_dts, all_event_attendances):
         event = events[event_start_dt]
-        event_url = event["event_url"]
         event_end_dt = event["end_dt"]
         if event_end_dt is None:
             LOG.critical("Assuming end of search date is relevant as event is still ongoing.")
@@ -247,11 +362,9 @@ def get_all_event_attendances_between(start_dt, end_dt):
         event_minutes = ((event_end_dt - event_start_dt).total_seconds()) / 60.0
         total_events_minutes += event_minutes
 
-        LOG.info("Getting attendance rates from %s to %s with duration %s...", event_start_dt, event_end_dt,
+        LOG.info("Adding attendance rates from %s to %s with duration %s...", event_start_dt, event_end_dt,
                  event_minutes)
 
-        event_attendances = get_attendance_rates_from_event_url(event_url)
-
         for player_name in event_attendances:
             if player_name not in overall_attendances:
                 overall_attendances[player_name] = 0
@@ -265,6 +378,11 @@ def get_all_event_attendances_between(start_dt, end_dt):
 
     average_attendance /= len(overall_attendances)
 
+    LOG.info("Scraper HTTP stats: %s", get_default_client().get_stats())
+    page_cache = get_event_page_cache()
+    if page_cache is not None:
+        LOG.info("Scraper page cache stats: %s", page_cache.get_stats())
+
     if total_events_minutes <= 0:
         raise ValueError("No events took place in specified time frame!")
 
@@ -0,0 +1,121 @@
+"""Local stand-in for the A2S query port of the game server, answering player list requests.
+
+It speaks the challenge and A2S_PLAYER exchange of the Source server query protocol, which is all the attendance
+poller uses, so the poller can be tested and run without a game server:
+
+    python libs/utils/fake_a2s_server.py --port 2303 "Spartak [CNTO-Gnt]" "Chypsa [CNTO-Gnt]"
+"""
+import argparse
+import random
+import socket
+import struct
+import threading
+
+A2S_PACKET_HEADER = struct.pack("<l", -1)
+A2S_PLAYER_REQUEST = 0x55
+S2C_CHALLENGE_RESPONSE = 0x41
+A2S_PLAYER_RESPONSE = 0x44
+
+# Longest packet the valve client reads.
+MAX_PACKET_BYTES = 1400
+
+
+class FakeA2SServer(object):
+    """UDP server reporting a settable list of players, served from a background thread.
+
+    """
+
+    def __init__(self, player_names=(), host="127.0.0.1", port=0):
+        """
+
+        :param player_names: names of the players reported as present.
+        :param host:
+        :param port: 0 picks a free port, see address.
+        """
+        self._lock = threading.Lock()
+        self._player_names = list(player_names)
+        self._challenge = random.randint(1, 2 ** 31 - 1)
+        self._thread = None
+        self.player_request_count = 0
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        # Lets serve() notice a stop request.
+        self._socket.settimeout(0.1)
+        self._stopped = threading.Event()
+
+        self.address = self._socket.getsockname()
+
+    def set_player_names(self, player_names):
+        with self._lock:
+            self._player_names = list(player_names)
+
+    def _encode_players(self):
+        with self._lock:
+            player_names = list(self._player_names)
+
+        payload = struct.pack("<B", len(player_names))
+        for index, player_name in enumerate(player_names):
+            payload += struct.pack("<B", index) + player_name.encode("utf-8") + b"\x00" + struct.pack("<lf", 0, 60.0)
+
+        return payload
+
+    def handle(self, request):
+        """
+
+        :param request: received packet.
+        :return: response packet, or None for requests other than A2S_PLAYER.
+        """
+        if len(request) < 9 or request[:4] != A2S_PACKET_HEADER or request[4] != A2S_PLAYER_REQUEST:
+            return None
+
+        challenge = struct.unpack("<l", request[5:9])[0]
+        if challenge != self._challenge:
+            return A2S_PACKET_HEADER + struct.pack("<Bl", S2C_CHALLENGE_RESPONSE, self._challenge)
+
+        with self._lock:
+            self.player_request_count += 1
+
+        return (A2S_PACKET_HEADER + struct.pack("<B", A2S_PLAYER_RESPONSE) + self._encode_players())[:MAX_PACKET_BYTES]
+
+    def serve(self):
+        while not self._stopped.is_set():
+            try:
+                request, client_address = self._socket.recvfrom(MAX_PACKET_BYTES)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            response = self.handle(request)
+            if response is not None:
+                self._socket.sendto(response, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self._socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer A2S player list requests with the given player names.")
+    parser.add_argument("player_names", nargs="*")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2303)
+    arguments = parser.parse_args()
+
+    server = FakeA2SServer(arguments.player_names, host=arguments.host, port=arguments.port)
+    print("Serving %s players on %s:%s..." % (len(arguments.player_names), server.address[0], server.address[1]))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
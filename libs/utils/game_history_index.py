@@ -0,0 +1,188 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import pytz
+from django.utils import timezone
+from django.utils.timezone import datetime
+
+LOG = logging.getLogger("roster-tracker")
+
+INDEX_DT_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def _dt_to_string(dt):
+    if dt is None:
+        return None
+
+    return dt.astimezone(pytz.utc).strftime(INDEX_DT_FORMAT)
+
+
+def _string_to_dt(dt_string):
+    if dt_string is None:
+        return None
+
+    return timezone.make_aware(datetime.strptime(dt_string, INDEX_DT_FORMAT), pytz.utc)
+
+
+class GameHistoryIndex(object):
+    """Persisted index of the paged game history of the server stats site.
+
+    The history lists the newest events first, so new events push older ones to later pages. The index stays
+    contiguous from the newest known event back to the oldest one: refresh() only walks from page 1 until it meets
+    events that are already indexed and finished, and extend_to() continues from the page that follows the oldest
+    indexed event. Every history page is therefore only downloaded again while it still holds new or running events.
+    """
+
+    def __init__(self, index_path, load_page):
+        """
+
+        :param index_path: JSON file the index is persisted to.
+        :param load_page: callable returning the {start_dt: event dict} of a history page number.
+        """
+        self.index_path = index_path
+        self._load_page = load_page
+        self._lock = threading.Lock()
+
+        self._events = {}
+        self._sorted_start_dts = []
+        self._page_size = None
+        self._reached_last_page = False
+
+        self._read()
+
+    def _read(self):
+        try:
+            with open(self.index_path, "r") as index_file:
+                index_data = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return
+
+        self._page_size = index_data["page_size"]
+        self._reached_last_page = index_data["reached_last_page"]
+        for event_data in index_data["events"]:
+            self._events[_string_to_dt(event_data["start_dt"])] = {
+                "player_count": event_data["player_count"],
+                "event_url": event_data["event_url"],
+                "end_dt": _string_to_dt(event_data["end_dt"]),
+                "finished": event_data["finished"],
+            }
+        self._sorted_start_dts = sorted(self._events)
+
+    def _write(self):
+        index_data = {
+            "page_size": self._page_size,
+            "reached_last_page": self._reached_last_page,
+            "events": [{
+                "start_dt": _dt_to_string(start_dt),
+                "player_count": self._events[start_dt]["player_count"],
+                "event_url": self._events[start_dt]["event_url"],
+                "end_dt": _dt_to_string(self._events[start_dt]["end_dt"]),
+                "finished": self._events[start_dt]["finished"],
+            } for start_dt in self._sorted_start_dts],
+        }
+
+        index_dir = os.path.dirname(self.index_path)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+
+        file_descriptor, temp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w") as temp_file:
+                json.dump(index_data, temp_file)
+            os.replace(temp_path, self.index_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _merge_page(self, page_events):
+        """
+
+        :param page_events:
+        :return: number of new events and number of events on the page that were already indexed as finished.
+        """
+        new_event_count = 0
+        known_finished_count = 0
+        for start_dt, event in page_events.items():
+            known_event = self._events.get(start_dt)
+            if known_event is None:
+                new_event_count += 1
+            elif known_event["finished"]:
+                known_finished_count += 1
+
+            self._events[start_dt] = {
+                "player_count": event["player_count"],
+                "event_url": event["event_url"],
+                "end_dt": event["end_dt"],
+                "finished": event["finished"],
+            }
+
+        if len(page_events) > 0:
+            self._page_size = max(self._page_size or 0, len(page_events))
+            self._sorted_start_dts = sorted(self._events)
+
+        return new_event_count, known_finished_count
+
+    def refresh(self):
+        """Index new and still running events, walking from page 1 until already known finished events are found.
+
+        :return:
+        """
+        page_number = 1
+        while True:
+            page_events = self._load_page(page_number)
+            if len(page_events) == 0:
+                self._reached_last_page = True
+                break
+
+            had_events = len(self._events) > 0
+            _, known_finished_count = self._merge_page(page_events)
+
+            if not had_events or known_finished_count > 0:
+                break
+
+            page_number += 1
+
+        LOG.info("Game history index refreshed up to page %s, %s events indexed.", page_number, len(self._events))
+
+    def extend_to(self, start_dt):
+        """Index older events until the index reaches back to start_dt.
+
+        :param start_dt:
+        :return:
+        """
+        last_page_number = 0
+        while not self._reached_last_page and self._sorted_start_dts[0] > start_dt:
+            # Older events continue on the page that holds the event after the oldest indexed one.
+            page_number = max(len(self._events) // self._page_size + 1, last_page_number + 1)
+            page_events = self._load_page(page_number)
+            if len(page_events) == 0:
+                self._reached_last_page = True
+                break
+
+            self._merge_page(page_events)
+            last_page_number = page_number
+
+    def get_events_between(self, start_dt, end_dt):
+        """
+
+        :param start_dt:
+        :param end_dt:
+        :return: copies of the indexed events starting from the last one at or before start_dt up to end_dt.
+        """
+        with self._lock:
+            self.refresh()
+            self.extend_to(start_dt)
+            self._write()
+
+            first_index = max(0, bisect.bisect_right(self._sorted_start_dts, start_dt) - 1)
+            last_index = bisect.bisect_right(self._sorted_start_dts, end_dt)
+
+            return {
+                event_start_dt: dict(self._events[event_start_dt])
+                for event_start_dt in self._sorted_start_dts[first_index:last_index]
+            }
@@ -0,0 +1,75 @@
+import bisect
+
+
+class IntervalIndex(object):
+    """Closed intervals grouped by key, answering containment and overlap queries in logarithmic time.
+
+    The intervals of every key are merged into sorted, disjoint intervals, so a single bisection over their starts
+    finds the only interval that can contain a point or overlap a range. Intervals that end before they start contain
+    nothing and are left out.
+    """
+
+    def __init__(self, intervals=()):
+        """
+
+        :param intervals: iterable of (key, start, end) tuples, start and end included.
+        """
+        intervals_by_key = {}
+        for key, start, end in intervals:
+            if start <= end:
+                intervals_by_key.setdefault(key, []).append((start, end))
+
+        self._starts = {}
+        self._ends = {}
+        for key, key_intervals in intervals_by_key.items():
+            starts = []
+            ends = []
+            for start, end in sorted(key_intervals):
+                if len(ends) > 0 and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+
+            self._starts[key] = starts
+            self._ends[key] = ends
+
+    def _find_last_starting_at_or_before(self, key, point):
+        starts = self._starts.get(key)
+        if starts is None:
+            return None, None
+
+        index = bisect.bisect_right(starts, point) - 1
+        if index < 0:
+            return None, None
+
+        return starts[index], self._ends[key][index]
+
+    def contains(self, key, point):
+        """
+
+        :param key:
+        :param point:
+        :return: True if an interval of the key contains the point.
+        """
+        _, end = self._find_last_starting_at_or_before(key, point)
+        return end is not None and end >= point
+
+    def overlaps(self, key, start, end):
+        """
+
+        :param key:
+        :param start:
+        :param end:
+        :return: True if an interval of the key overlaps the range from start to end, both included.
+        """
+        _, interval_end = self._find_last_starting_at_or_before(key, end)
+        return interval_end is not None and interval_end >= start
+
+    def keys_containing(self, point):
+        """
+
+        :param point:
+        :return: set of the keys with an interval containing the point.
+        """
+        return set(key for key in self._starts if self.contains(key, point))
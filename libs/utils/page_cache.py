@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+LOG = logging.getLogger("roster-tracker")
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+class PageCache(object):
+    """Size bounded on-disk cache of downloaded pages, keyed by URL.
+
+    Every page is stored as a content file next to a small JSON metadata file. When the content files grow past
+    max_bytes the least recently used pages are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "revalidated": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _get_paths(self, url):
+        """
+
+        :param url:
+        :return: content and metadata file paths for the URL.
+        """
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base_path = os.path.join(self.cache_dir, key)
+        return base_path + ".html", base_path + ".json"
+
+    def get(self, url):
+        """
+
+        :param url:
+        :return: the metadata dict of the page with its "content" added, or None if not cached.
+        """
+        content_path, metadata_path = self._get_paths(url)
+        try:
+            with open(metadata_path, "r") as metadata_file:
+                entry = json.load(metadata_file)
+            with open(content_path, "rb") as content_file:
+                entry["content"] = content_file.read()
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Mark as recently used for the eviction policy.
+        try:
+            os.utime(content_path, None)
+        except OSError:
+            pass
+
+        return entry
+
+    def put(self, url, content, finished, etag=None, last_modified=None):
+        """
+
+        :param url:
+        :param content: page body as bytes.
+        :param finished: True if the page will never change again.
+        :param etag:
+        :param last_modified:
+        :return:
+        """
+        content_path, metadata_path = self._get_paths(url)
+        metadata = {
+            "url": url,
+            "finished": finished,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+
+        self._write_atomically(content_path, content)
+        self._write_atomically(metadata_path, json.dumps(metadata).encode("utf-8"))
+        self.count("stores")
+
+        self.evict()
+
+    def _write_atomically(self, path, data):
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """Remove least recently used pages until the cache fits in max_bytes.
+
+        :return:
+        """
+        with self._lock:
+            content_files = []
+            total_bytes = 0
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith(".html"):
+                    continue
+
+                content_path = os.path.join(self.cache_dir, file_name)
+                try:
+                    file_stat = os.stat(content_path)
+                except OSError:
+                    continue
+
+                content_files.append((file_stat.st_mtime, file_stat.st_size, content_path))
+                total_bytes += file_stat.st_size
+
+            if total_bytes <= self.max_bytes:
+                return
+
+            for _, file_size, content_path in sorted(content_files):
+                if total_bytes <= self.max_bytes:
+                    break
+
+                metadata_path = content_path[:-len(".html")] + ".json"
+                for path in (metadata_path, content_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+                total_bytes -= file_size
+                self._counters["evictions"] += 1
+
+    def count(self, counter_name):
+        with self._lock:
+            self._counters[counter_name] += 1
+
+    def get_stats(self):
+        """
+
+        :return: hit, miss, revalidation, store and eviction counts since the cache was created.
+        """
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,135 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+LOG = logging.getLogger("roster-tracker")
+
+DEFAULT_TIMEOUT_SECONDS = (5, 30)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_POOL_SIZE = 8
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
+class ScraperHttpClient(object):
+    """Shared HTTP client for the server stats pages.
+
+    Keeps connections alive between page loads, asks for compressed transfers, applies a timeout to every request
+    and retries failed requests with an exponential backoff.
+    """
+
+    def __init__(self, timeout_seconds=DEFAULT_TIMEOUT_SECONDS, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, pool_size=DEFAULT_POOL_SIZE):
+        self.timeout_seconds = timeout_seconds
+
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS_CODES)
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self._session = requests.Session()
+        self._session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._retry_count = 0
+        self._failure_count = 0
+        self._bytes_transferred = 0
+        self._bytes_decoded = 0
+
+    def get(self, url, headers=None):
+        """
+
+        :param url:
+        :param headers: extra request headers, e.g. for conditional requests.
+        :return: the response, after raising for error status codes.
+        """
+        try:
+            response = self._session.get(url, headers=headers, timeout=self.timeout_seconds)
+            response.raise_for_status()
+        except requests.RequestException:
+            # Raised once the retries are used up, or right away for error status codes that are not retried.
+            with self._lock:
+                self._failure_count += 1
+            raise
+
+        # Reading the content here makes sure the connection goes back to the pool.
+        content = response.content
+        raw_retries = getattr(response.raw, "retries", None)
+        with self._lock:
+            self._request_count += 1
+            self._bytes_transferred += response.raw.tell()
+            self._bytes_decoded += len(content)
+            if raw_retries is not None:
+                self._retry_count += len(raw_retries.history)
+
+        return response
+
+    def get_content(self, url):
+        """
+
+        :param url:
+        :return: decoded body of the page.
+        """
+        return self.get(url).content
+
+    def _get_connection_counts(self):
+        """
+
+        :return: connections opened and requests made by all pools of the session.
+        """
+        connections_opened = 0
+        pool_requests = 0
+
+        pools = self._adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+
+            connections_opened += pool.num_connections
+            pool_requests += pool.num_requests
+
+        return connections_opened, pool_requests
+
+    def get_stats(self):
+        """
+
+        :return: request, retry, failure, transfer and connection counters since the client was created.
+        """
+        connections_opened, pool_requests = self._get_connection_counts()
+        with self._lock:
+            return {
+                "requests": self._request_count,
+                "retries": self._retry_count,
+                "failures": self._failure_count,
+                "bytes_transferred": self._bytes_transferred,
+                "bytes_decoded": self._bytes_decoded,
+                "connections_opened": connections_opened,
+                "connections_reused": max(0, pool_requests - connections_opened),
+            }
+
+    def close(self):
+        self._session.close()
+
+
+_DEFAULT_CLIENT = None
+_DEFAULT_CLIENT_LOCK = threading.Lock()
+
+
+def get_default_client():
+    """
+
+    :return: the process wide client shared by all scraper page loads.
+    """
+    global _DEFAULT_CLIENT
+
+    with _DEFAULT_CLIENT_LOCK:
+        if _DEFAULT_CLIENT is None:
+            _DEFAULT_CLIENT = ScraperHttpClient()
+
+        return _DEFAULT_CLIENT
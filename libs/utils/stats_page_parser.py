@@ -0,0 +1,152 @@
+"""Extraction of the table rows the attendance scraper needs from server stats pages.
+
+Two interchangeable backends are available: "lxml" evaluates compiled XPath expressions on an lxml tree and only
+touches the relevant table, "bs4" is the original BeautifulSoup search. Both return the raw cell values, the
+attendance scraper interprets them.
+"""
+from bs4 import BeautifulSoup
+from lxml import etree, html
+
+LXML_BACKEND = "lxml"
+BS4_BACKEND = "bs4"
+DEFAULT_BACKEND = LXML_BACKEND
+
+_UPPER_CASE = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_LOWER_CASE = "abcdefghijklmnopqrstuvwxyz"
+
+
+def _full_table_xpath(header_path, header_text):
+    """
+
+    :param header_path: path from the table to its sibling h2 header.
+    :param header_text: lower case text of the header.
+    :return: XPath selecting tables with the "full" class under the given header.
+    """
+    return (
+        "//table[contains(concat(' ', normalize-space(translate(@class, '%(upper)s', '%(lower)s')), ' '), ' full ')]"
+        "[%(header_path)s[translate(string(.), '%(upper)s', '%(lower)s') = '%(header_text)s']]" % {
+            "upper": _UPPER_CASE,
+            "lower": _LOWER_CASE,
+            "header_path": header_path,
+            "header_text": header_text,
+        })
+
+
+_GAME_HISTORY_TABLE = etree.XPath(_full_table_xpath("../../h2", "game history"))
+_PLAYERS_TABLE = etree.XPath(_full_table_xpath("../h2", "players"))
+_ROWS = etree.XPath(".//tr")
+_HEADER_CELLS = etree.XPath(".//th")
+_CELLS = etree.XPath(".//td")
+_LINKS = etree.XPath(".//a")
+_DIVS = etree.XPath(".//div")
+
+
+def _parse_lxml_tree(page_content):
+    if isinstance(page_content, bytes):
+        try:
+            page_content = page_content.decode("utf-8")
+        except UnicodeDecodeError:
+            # Leave the encoding detection to lxml.
+            pass
+
+    return html.document_fromstring(page_content)
+
+
+def _lxml_data_rows(table):
+    for row in _ROWS(table):
+        if len(_HEADER_CELLS(row)) > 0:
+            continue
+
+        yield _CELLS(row)
+
+
+def _bs4_data_rows(table):
+    for row in table("tr"):
+        if len(row("th")) > 0:
+            continue
+
+        yield row("td")
+
+
+def _bs4_full_table_under_header(soup, header_text, levels_up):
+    def full_table(tag):
+        """
+        """
+        if tag.name.lower() != "table":
+            return False
+
+        if not tag.has_attr("class"):
+            return False
+
+        if "full" not in [class_name.lower() for class_name in tag["class"]]:
+            return False
+
+        header_parent = tag.parent
+        for _ in range(levels_up - 1):
+            header_parent = header_parent.parent
+
+        for child in header_parent.children:
+            if child.name == "h2":
+                if child.text.lower() == header_text:
+                    return True
+
+        return False
+
+    return soup.find_all(full_table)[0]
+
+
+def _make_soup(page_content):
+    soup = BeautifulSoup(page_content, "lxml")
+
+    if soup is None:
+        raise ValueError("No soup!")
+
+    return soup
+
+
+def parse_game_history_rows(page_content, backend=DEFAULT_BACKEND):
+    """
+
+    :param page_content: game history page.
+    :param backend: "lxml" or "bs4".
+    :return: list of (event href, players, start time, end time) string tuples.
+    """
+    event_rows = []
+
+    if backend == LXML_BACKEND:
+        table = _GAME_HISTORY_TABLE(_parse_lxml_tree(page_content))[0]
+        for column_values in _lxml_data_rows(table):
+            event_rows.append((_LINKS(column_values[0])[0].get("href"), str(column_values[1].text_content()),
+                               str(column_values[3].text_content()), str(column_values[4].text_content())))
+    elif backend == BS4_BACKEND:
+        table = _bs4_full_table_under_header(_make_soup(page_content), "game history", 2)
+        for column_values in _bs4_data_rows(table):
+            event_rows.append((column_values[0]("a")[0]["href"], column_values[1].text, column_values[3].text,
+                               column_values[4].text))
+    else:
+        raise ValueError("Unknown stats page parser backend %s!" % (backend,))
+
+    return event_rows
+
+
+def parse_player_rows(page_content, backend=DEFAULT_BACKEND):
+    """
+
+    :param page_content: event players page.
+    :param backend: "lxml" or "bs4".
+    :return: list of (player name, attendance bar style) string tuples.
+    """
+    player_rows = []
+
+    if backend == LXML_BACKEND:
+        table = _PLAYERS_TABLE(_parse_lxml_tree(page_content))[0]
+        for column_values in _lxml_data_rows(table):
+            player_rows.append((str(column_values[0].text_content()), _DIVS(column_values[3])[0].get("style")))
+    elif backend == BS4_BACKEND:
+        table = _bs4_full_table_under_header(_make_soup(page_content), "players", 1)
+        for column_values in _bs4_data_rows(table):
+            player_rows.append((column_values[0].text, column_values[3]("div")[0]["style"]))
+    else:
+        raise ValueError("Unknown stats page parser backend %s!" % (backend,))
+
+    return player_rows
@@ -1 +1,3 @@
 RECRUIT_RANK = "rct"
+
+default_app_config = "cnto.apps.CntoConfig"
@@ -0,0 +1,135 @@
+import numpy
+
+from .models import Event, Attendance
+
+
+class AttendanceMatrix(object):
+    """Attendances of a set of members to a set of events as dense arrays.
+
+    Rows are members and columns are events, in the order they were given. Ratios and adequacy follow
+    Attendance.get_attendance_ratio and Attendance.was_adequate, but are computed for all attendances at once
+    instead of dereferencing the event and event type of every attendance.
+    """
+
+    def __init__(self, members, events):
+        """
+
+        :param members:
+        :param events: events with their event type loaded.
+        """
+        self.members = list(members)
+        self.events = list(events)
+
+        self.member_indices = {member.pk: index for index, member in enumerate(self.members)}
+        self.event_indices = {event.pk: index for index, event in enumerate(self.events)}
+
+        self.attendance_seconds = numpy.zeros((len(self.members), len(self.events)), dtype=numpy.float64)
+        self.attended = numpy.zeros((len(self.members), len(self.events)), dtype=bool)
+
+        self.event_duration_seconds = numpy.array(
+            [(event.end_dt - event.start_dt).total_seconds() for event in self.events], dtype=numpy.float64)
+        self.minimum_required_ratios = numpy.array(
+            [event.event_type.minimum_required_attendance_ratio for event in self.events], dtype=numpy.float64)
+
+        if len(self.members) > 0 and len(self.events) > 0:
+            attendances = Attendance.objects.filter(member__in=list(self.member_indices),
+                                                    event__in=list(self.event_indices))
+            for member_pk, event_pk, attendance_seconds in attendances.values_list(
+                    "member_id", "event_id", "attendance_seconds").iterator():
+                member_index = self.member_indices[member_pk]
+                event_index = self.event_indices[event_pk]
+                self.attendance_seconds[member_index, event_index] = attendance_seconds
+                self.attended[member_index, event_index] = True
+
+        self._adequacy = None
+
+    @staticmethod
+    def for_period(members, start_dt, end_dt):
+        """
+
+        :param members:
+        :param start_dt:
+        :param end_dt:
+        :return: matrix of the members and the events of the period in chronological order.
+        """
+        events = Event.all_for_time_period(start_dt, end_dt).order_by("start_dt").select_related("event_type")
+        return AttendanceMatrix(members, events)
+
+    def get_attendance_ratios(self):
+        """
+
+        :return: members by events array of attendance ratios, 0 where a member did not attend.
+        """
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            attendance_ratios = numpy.minimum(1.0, self.attendance_seconds / self.event_duration_seconds)
+
+        # Events without duration have a ratio of 0, as in Attendance.calculate_attendance_ratio.
+        return numpy.where(self.attended & (self.event_duration_seconds > 0), attendance_ratios, 0.0)
+
+    def get_adequacy(self):
+        """
+
+        :return: members by events boolean array of adequate attendances.
+        """
+        if self._adequacy is None:
+            self._adequacy = self.attended & (self.get_attendance_ratios() > self.minimum_required_ratios)
+
+        return self._adequacy
+
+    def get_adequate_counts(self):
+        """
+
+        :return: number of adequately attended events per member.
+        """
+        return self.get_adequacy().sum(axis=1)
+
+    def get_adequate_counts_within(self, start_dts, end_dts):
+        """
+
+        :param start_dts: start of the counted period of every member, in member order.
+        :param end_dts: end of the counted period of every member, in member order, included.
+        :return: number of adequately attended events per member, counting only the events starting in its period.
+        """
+        event_start_timestamps = numpy.array([event.start_dt.timestamp() for event in self.events],
+                                             dtype=numpy.float64)
+        start_timestamps = numpy.array([start_dt.timestamp() for start_dt in start_dts], dtype=numpy.float64)
+        end_timestamps = numpy.array([end_dt.timestamp() for end_dt in end_dts], dtype=numpy.float64)
+
+        within_periods = ((event_start_timestamps >= start_timestamps[:, numpy.newaxis]) &
+                          (event_start_timestamps <= end_timestamps[:, numpy.newaxis]))
+
+        return (self.get_adequacy() & within_periods).sum(axis=1)
+
+    def get_attended_counts(self):
+        """
+
+        :return: number of attended events per member.
+        """
+        return self.attended.sum(axis=1)
+
+    def get_event_attendance_counts(self):
+        """
+
+        :return: number of attending members per event.
+        """
+        return self.attended.sum(axis=0)
+
+    def get_event_average_ratios(self):
+        """
+
+        :return: average attendance ratio of the attending members per event, 0 for events nobody attended.
+        """
+        attendance_counts = self.get_event_attendance_counts()
+        ratio_sums = self.get_attendance_ratios().sum(axis=0)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(attendance_counts > 0, ratio_sums / attendance_counts, 0.0)
+
+    def has_attended(self, member, event):
+        return bool(self.attended[self.member_indices[member.pk], self.event_indices[event.pk]])
+
+    def was_adequate(self, member, event):
+        return bool(self.get_adequacy()[self.member_indices[member.pk], self.event_indices[event.pk]])
+
+    def get_adequate_count(self, member):
+        return int(self.get_adequacy()[self.member_indices[member.pk]].sum())
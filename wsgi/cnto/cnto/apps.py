@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class CntoConfig(AppConfig):
+    name = "cnto"
+
+    def ready(self):
+        # Connect the report cache invalidation receivers.
+        from . import signals
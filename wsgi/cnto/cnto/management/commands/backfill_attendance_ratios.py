@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from cnto.models import Attendance, Event
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored attendance ratio and adequacy of all attendances."
+
+    def handle(self, *args, **options):
+        event_count = 0
+        for event in Event.objects.all().select_related("event_type").iterator():
+            Attendance.update_attendance_ratios_for_event(event)
+            event_count += 1
+
+        self.stdout.write("Updated the attendances of %s events." % (event_count,))
@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from cnto.models import Event, ReportSnapshot
+from cnto.reports import freeze_report_for_month, is_frozen_month
+
+
+class Command(BaseCommand):
+    help = "Build the report snapshots of all frozen months since the first event."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", default=False,
+                            help="Rebuild snapshots that are already up to date as well.")
+
+    def handle(self, *args, **options):
+        first_event_dt = Event.objects.all().aggregate(Min("start_dt"))["start_dt__min"]
+        if first_event_dt is None:
+            self.stdout.write("No events to report.")
+            return
+
+        first_event_dt = timezone.localtime(first_event_dt, timezone.get_default_timezone())
+        up_to_date_months = set(ReportSnapshot.objects.filter(stale=False).values_list("month", flat=True))
+
+        year, month = first_event_dt.year, first_event_dt.month
+        frozen_count = 0
+        while is_frozen_month(year, month):
+            if options["force"] or date(year, month, 1) not in up_to_date_months:
+                freeze_report_for_month(year, month)
+                frozen_count += 1
+                self.stdout.write("Froze report of %04d-%02d." % (year, month))
+
+            month += 1
+            if month > 12:
+                year += 1
+                month = 1
+
+        self.stdout.write("Froze %s reports." % (frozen_count,))
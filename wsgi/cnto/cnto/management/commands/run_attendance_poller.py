@@ -0,0 +1,119 @@
+import time
+import traceback
+from datetime import datetime
+
+import valve.source.a2s
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cnto.views.scrape import ARMA3_SERVER_MONITOR, add_attendance_seconds, list_present_players_on_server, \
+    update_current_event
+
+
+class AttendancePoller(object):
+    """Samples the players on the game server and keeps their presence in memory until it is flushed to the
+    attendances of the current event.
+
+    """
+
+    def __init__(self, server_address, sample_interval_seconds, event_type_name, event_start_hour):
+        self.server_address = server_address
+        self.sample_interval_seconds = sample_interval_seconds
+        self.event_type_name = event_type_name
+        self.event_start_hour = event_start_hour
+
+        self._server = None
+        self.presence_seconds = {}
+        self.last_sample_dt = None
+
+    def sample(self):
+        """Query the players on the server once and count them present for one sample interval.
+
+        :return: number of players found.
+        """
+        if self._server is None:
+            self._server = valve.source.a2s.ServerQuerier(self.server_address)
+
+        try:
+            players = list_present_players_on_server(self._server)
+        except Exception:
+            # Open a fresh socket on the next sample.
+            self._server = None
+            raise
+
+        self.last_sample_dt = datetime.now()
+        for raw_username in set(players):
+            self.presence_seconds[raw_username] = self.presence_seconds.get(raw_username, 0) + \
+                                                  self.sample_interval_seconds
+
+        return len(players)
+
+    def flush(self):
+        """Write the accumulated presence to the current event in a single transaction.
+
+        :return: number of players written.
+        """
+        if len(self.presence_seconds) == 0:
+            return 0
+
+        close_old_connections()
+
+        event = update_current_event(self.sample_interval_seconds, event_type_name=self.event_type_name,
+                                     event_start_hour=self.event_start_hour, dt=self.last_sample_dt)
+        add_attendance_seconds(event, self.presence_seconds)
+
+        player_count = len(self.presence_seconds)
+        self.presence_seconds = {}
+
+        return player_count
+
+
+class Command(BaseCommand):
+    help = "Continuously sample the players on the game server and record them as attendances of the current event."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sample-interval", type=int, default=30,
+                            help="Seconds between two player samples.")
+        parser.add_argument("--flush-interval", type=int, default=300,
+                            help="Seconds between two writes of the sampled presence to the database.")
+        parser.add_argument("--weekdays", default="1,4",
+                            help="Comma separated weekdays (Monday is 0) on which events are monitored.")
+        parser.add_argument("--event-start-hour", type=int, default=20)
+        parser.add_argument("--event-type", default="Unknown",
+                            help="Type of events created by the poller.")
+        parser.add_argument("--server", default="%s:%s" % ARMA3_SERVER_MONITOR,
+                            help="Address of the game server query port as host:port.")
+
+    def handle(self, *args, **options):
+        host, port = options["server"].rsplit(":", 1)
+        weekdays_to_monitor = [int(weekday) for weekday in options["weekdays"].split(",")]
+        sample_interval_seconds = options["sample_interval"]
+        flush_interval_seconds = options["flush_interval"]
+
+        poller = AttendancePoller((host, int(port)), sample_interval_seconds, options["event_type"],
+                                  options["event_start_hour"])
+
+        last_flush_time = time.time()
+        while True:
+            sample_start_time = time.time()
+
+            dt = datetime.now()
+            monitoring = dt.weekday() in weekdays_to_monitor and dt.hour >= options["event_start_hour"]
+
+            if monitoring:
+                try:
+                    poller.sample()
+                except Exception:
+                    self.stderr.write("Sampling players failed:\n%s" % (traceback.format_exc(),))
+
+            if not monitoring or time.time() - last_flush_time >= flush_interval_seconds:
+                try:
+                    flushed_count = poller.flush()
+                    if flushed_count > 0:
+                        self.stdout.write("Recorded presence of %s players at %s." % (flushed_count, dt))
+                except Exception:
+                    self.stderr.write("Recording attendances failed:\n%s" % (traceback.format_exc(),))
+
+                last_flush_time = time.time()
+
+            time.sleep(max(0.0, sample_interval_seconds - (time.time() - sample_start_time)))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cnto.models import ScrapeJob
+from cnto.views.scrape import run_scrape_job
+
+
+class Command(BaseCommand):
+    help = "Process queued scrape jobs of the server stats site."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", default=False,
+                            help="Exit once no queued jobs are left instead of waiting for new ones.")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to wait between checks for new jobs.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = ScrapeJob.claim_next()
+
+            if job is None:
+                if options["once"]:
+                    break
+
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write("Running scrape job %s for %s to %s..." % (job.pk, job.start_dt, job.end_dt))
+            run_scrape_job(job)
+            self.stdout.write("Scrape job %s %s." % (job.pk, job.status))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cnto', '0046_new_rank_cpl'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('status', models.TextField(default='queued', db_index=True)),
+                ('events_done', models.IntegerField(default=0)),
+                ('events_total', models.IntegerField(default=0)),
+                ('result', models.TextField(default=None, null=True)),
+                ('error', models.TextField(default=None, null=True)),
+                ('event_type', models.ForeignKey(to='cnto.EventType')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
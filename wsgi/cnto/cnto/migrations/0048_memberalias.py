@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+def add_aliases_for_active_members(apps, schema_editor):
+
+    Member = apps.get_model("cnto", "Member")
+    MemberAlias = apps.get_model("cnto", "MemberAlias")
+
+    members_by_key = {}
+    for member in Member.objects.filter(discharged=False, deleted=False):
+        key = member.name.strip().lower()
+        if len(key) > 0:
+            members_by_key.setdefault(key, []).append(member)
+
+    # Ambiguous names are left to the name lookup, which reports them.
+    MemberAlias.objects.bulk_create([
+        MemberAlias(member=members[0], key=key) for key, members in members_by_key.items() if len(members) == 1
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cnto', '0047_scrapejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberAlias',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('key', models.TextField(unique=True)),
+                ('member', models.ForeignKey(related_name='aliases', to='cnto.Member')),
+            ],
+        ),
+        migrations.RunPython(add_aliases_for_active_members, migrations.RunPython.noop),
+    ]
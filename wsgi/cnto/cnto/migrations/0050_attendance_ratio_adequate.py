@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+def backfill_attendance_ratios(apps, schema_editor):
+
+    Event = apps.get_model("cnto", "Event")
+    Attendance = apps.get_model("cnto", "Attendance")
+
+    for event in Event.objects.all().select_related("event_type"):
+        event_duration_seconds = float((event.end_dt - event.start_dt).total_seconds())
+        for attendance in Attendance.objects.filter(event=event):
+            if event_duration_seconds <= 0:
+                attendance_ratio = 0.0
+            else:
+                attendance_ratio = min(1.0, float(attendance.attendance_seconds) / event_duration_seconds)
+
+            attendance.attendance_ratio = attendance_ratio
+            attendance.adequate = attendance_ratio > event.event_type.minimum_required_attendance_ratio
+            attendance.save(update_fields=["attendance_ratio", "adequate"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cnto', '0049_reportsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='adequate',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='attendance',
+            name='attendance_ratio',
+            field=models.FloatField(default=0.0, db_index=True),
+        ),
+        migrations.RunPython(backfill_attendance_ratios, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cnto', '0050_attendance_ratio_adequate'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='absence',
+            index_together=set([('member', 'start_date', 'end_date')]),
+        ),
+    ]
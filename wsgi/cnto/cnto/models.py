@@ -2,9 +2,10 @@ from django.core.urlresolvers import reverse
 from django.db import models
 from django.utils import timezone
 from django.utils.timezone import timedelta
-from django.db.models import Q
+from django.db.models import Case, Count, F, Q, Sum, Value, When
 
 from cnto import RECRUIT_RANK
+from utils.interval_index import IntervalIndex
 
 
 class CreatedModifiedMixin(models.Model):
@@ -104,6 +105,48 @@ class Member(models.Model):
     def recruits():
         return Member.active_members(include_recruits=True).filter(rank__name__iexact=RECRUIT_RANK)
 
+    @staticmethod
+    def active_members_named(names):
+        """
+
+        :param names:
+        :return: active members whose name matches one of the names case insensitively.
+        """
+        names = set(names)
+        if len(names) == 0:
+            return Member.objects.none()
+
+        names_query = Q()
+        for name in names:
+            names_query |= Q(name__iexact=name)
+
+        return Member.active_members().filter(names_query)
+
+    @staticmethod
+    def with_recruit_status(members):
+        """Load members with the inputs of their recruit status precomputed.
+
+        The adequate event count is annotated in SQL and the total days absent of all members come from one query,
+        so events_attended, the deadlines, the due days and ready_for_promotion need no further queries.
+
+        :param members: members queryset.
+        :return: list of the members.
+        """
+        members = list(members.annotate(adequate_event_count=Sum(Case(
+            When(attendances__adequate=True, then=Value(1)), default=Value(0), output_field=models.IntegerField()))))
+
+        # Summed here rather than annotated, Django cannot subtract date fields in an aggregate and a second join to
+        # the absences would multiply the adequate event count.
+        total_days_absent = {}
+        for member_pk, start_date, end_date in Absence.objects.filter(
+                member__in=[member.pk for member in members]).values_list("member_id", "start_date", "end_date"):
+            total_days_absent[member_pk] = total_days_absent.get(member_pk, 0) + (end_date - start_date).days
+
+        for member in members:
+            member.total_days_absent = total_days_absent.get(member.pk, 0)
+
+        return members
+
     @staticmethod
     def active_members_after_dt(dt):
         members = Member.active_members()
@@ -168,6 +211,11 @@ class Member(models.Model):
                 attendance.member = self
                 attendance.save()
 
+        # Future imports of the merged away name resolve to this member
+        MemberAlias.objects.filter(member=from_member).update(member=self)
+        MemberAlias.record(self, from_member.name)
+        MemberAlias.record(self, self.name)
+
         from_member.deleted = True
         from_member.save()
 
@@ -183,8 +231,11 @@ class Member(models.Model):
 
         :return:
         """
-        attendances = self.attendances.all()
-        return sum([1 if attendance.was_adequate() else 0 for attendance in attendances])
+        if hasattr(self, "adequate_event_count"):
+            # Annotated by Member.with_recruit_status.
+            return self.adequate_event_count
+
+        return self.attendances.filter(adequate=True).count()
 
     def mod_due_days(self):
         """
@@ -196,7 +247,26 @@ class Member(models.Model):
         else:
             return (self.get_mod_assessment_deadline_date() - timezone.now().date()).days
 
+    @staticmethod
+    def attach_absence_status(members):
+        """Mark every member as currently absent or not with a single query, for is_absent to read.
+
+        :param members: list of members.
+        :return:
+        """
+        current_date = timezone.now().date()
+        absent_member_pks = set(Absence.objects.filter(
+            member__in=[member.pk for member in members], deleted=False, concluded=False,
+            start_date__lte=current_date, end_date__gte=current_date).values_list("member_id", flat=True))
+
+        for member in members:
+            member.currently_absent = member.pk in absent_member_pks
+
     def is_absent(self):
+        if hasattr(self, "currently_absent"):
+            # Precomputed by Member.attach_absence_status.
+            return self.currently_absent
+
         current_dt = timezone.now()
         absences = self.absences.filter(deleted=False, concluded=False,
                                           start_date__lte=current_dt.date(),
@@ -208,6 +278,10 @@ class Member(models.Model):
         return RECRUIT_RANK in self.rank.name.lower()
 
     def get_total_days_absent(self):
+        if hasattr(self, "total_days_absent"):
+            # Precomputed by Member.with_recruit_status.
+            return self.total_days_absent
+
         absences = Absence.objects.filter(member=self)
         total_absent_duration_days = 0
         for absence in absences:
@@ -287,6 +361,37 @@ class Member(models.Model):
         return self.name.lower()
 
 
+class MemberAlias(models.Model):
+    """In-game name known to belong to a member, stored as a normalized lookup key.
+
+    """
+    member = models.ForeignKey(Member, null=False, related_name="aliases")
+    key = models.TextField(null=False, unique=True)
+
+    @staticmethod
+    def key_for_name(name):
+        return name.strip().lower()
+
+    @staticmethod
+    def record(member, name):
+        """Point the alias of a name to the member, creating it if needed.
+
+        :param member:
+        :param name:
+        :return:
+        """
+        key = MemberAlias.key_for_name(name)
+        if len(key) == 0:
+            return
+
+        updated = MemberAlias.objects.filter(key=key).update(member=member)
+        if not updated:
+            MemberAlias(member=member, key=key).save()
+
+    def __str__(self):
+        return self.key
+
+
 class EventType(models.Model):
     name = models.TextField(null=False)
     default_start_hour = models.IntegerField()
@@ -313,16 +418,15 @@ class Event(models.Model):
     duration_minutes = models.IntegerField(null=False)
 
     def get_stats(self):
-        attendances = self.attendees.all()
-        if len(attendances) > 0:
-            average_attendance = sum([attendance.get_attendance_ratio() for attendance in attendances]) / len(
-                attendances)
+        attendance_ratios = list(self.attendees.values_list("attendance_ratio", flat=True))
+        if len(attendance_ratios) > 0:
+            average_attendance = sum(attendance_ratios) / len(attendance_ratios)
         else:
             average_attendance = 0
 
         return {
             "duration_minutes": self.duration_minutes, "average_attendance": average_attendance,
-            "player_count": len(attendances)
+            "player_count": len(attendance_ratios)
         }
 
     def lowered_name(self):
@@ -347,6 +451,23 @@ class Absence(models.Model):
     concluded = models.BooleanField(default=False, null=False)
     deleted = models.BooleanField(default=False, null=False)
 
+    class Meta:
+        index_together = [
+            ["member", "start_date", "end_date"],
+        ]
+
+    @staticmethod
+    def build_index(absences=None):
+        """
+
+        :param absences: absences queryset to index, all absences that are not deleted by default.
+        :return: IntervalIndex of the absence dates per member pk.
+        """
+        if absences is None:
+            absences = Absence.objects.filter(deleted=False)
+
+        return IntervalIndex(absences.values_list("member_id", "start_date", "end_date").iterator())
+
     @staticmethod
     def get_absence_for_event(event, member):
         absence = Absence.objects.get(member=member, start_date__lte=event.start_dt.date(),
@@ -365,9 +486,74 @@ class Attendance(models.Model):
     member = models.ForeignKey(Member, null=False, related_name="attendances")
     attendance_seconds = models.IntegerField(null=False)
 
+    # Derived from attendance_seconds, the event times and the event type, kept in sync so they can be counted in SQL.
+    attendance_ratio = models.FloatField(null=False, default=0.0, db_index=True)
+    adequate = models.BooleanField(null=False, default=False, db_index=True)
+
     class Meta:
         unique_together = ('event', 'member',)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        attendance = super(Attendance, cls).from_db(db, field_names, values)
+        # Lets the report invalidation skip looking up the stored event unless the attendance was moved to another one.
+        attendance._stored_event_id = attendance.__dict__.get("event_id")
+
+        return attendance
+
+    @staticmethod
+    def calculate_attendance_ratio(attendance_seconds, event):
+        """
+
+        :param attendance_seconds:
+        :param event:
+        :return: part of the event attended, 0 for events without duration.
+        """
+        event_duration_seconds = float((event.end_dt - event.start_dt).total_seconds())
+        if event_duration_seconds <= 0:
+            return 0.0
+
+        return min(1.0, float(attendance_seconds) / event_duration_seconds)
+
+    @staticmethod
+    def update_attendance_ratios_for_event(event):
+        """Recompute the stored ratio and adequacy of all attendances of an event with a single UPDATE.
+
+        :param event:
+        :return:
+        """
+        minimum_required_attendance_ratio = event.event_type.minimum_required_attendance_ratio
+
+        attendance_ratios = {}
+        adequate_attendance_pks = []
+        for attendance_pk, attendance_seconds in Attendance.objects.filter(event=event).values_list(
+                "pk", "attendance_seconds"):
+            attendance_ratio = Attendance.calculate_attendance_ratio(attendance_seconds, event)
+            attendance_ratios[attendance_pk] = attendance_ratio
+            if attendance_ratio > minimum_required_attendance_ratio:
+                adequate_attendance_pks.append(attendance_pk)
+
+        if len(attendance_ratios) == 0:
+            return
+
+        Attendance.objects.filter(pk__in=list(attendance_ratios)).update(
+            attendance_ratio=Case(*[When(pk=attendance_pk, then=Value(attendance_ratio))
+                                    for attendance_pk, attendance_ratio in attendance_ratios.items()],
+                                  output_field=models.FloatField()),
+            adequate=Case(When(pk__in=adequate_attendance_pks, then=Value(True)), default=Value(False),
+                          output_field=models.BooleanField()))
+
+    @staticmethod
+    def update_adequacy_for_event_type(event_type):
+        """Recompute the stored adequacy of all attendances to events of a type with a single UPDATE.
+
+        :param event_type:
+        :return:
+        """
+        Attendance.objects.filter(event__event_type=event_type).update(
+            adequate=Case(When(attendance_ratio__gt=event_type.minimum_required_attendance_ratio, then=Value(True)),
+                          default=Value(False), output_field=models.BooleanField()))
+
     @staticmethod
     def was_adequate_for_period(member, events, start_dt, end_dt, min_total_events=1, adequate_if_absent=False):
         """
@@ -400,19 +586,12 @@ class Attendance(models.Model):
             if absent_days > 0:
                 return True, "Was marked absent during period."
 
-        attendances_for_period = Attendance.objects.filter(member=member, event__in=events)
-
-        attended_training = 0
-        attended_other = 0
+        adequate_attendances_for_period = Attendance.objects.filter(member=member, event__in=events, adequate=True)
 
         training_event_type = EventType.objects.get(name__iexact="training")
 
-        for attendance in attendances_for_period:
-            if attendance.was_adequate():
-                if attendance.event.event_type == training_event_type:
-                    attended_training += 1
-                else:
-                    attended_other += 1
+        attended_training = adequate_attendances_for_period.filter(event__event_type=training_event_type).count()
+        attended_other = adequate_attendances_for_period.exclude(event__event_type=training_event_type).count()
 
         attended_total = attended_training + attended_other
 
@@ -427,13 +606,81 @@ class Attendance(models.Model):
 
         return True, "No attendance issues."
 
+    @staticmethod
+    def was_adequate_for_period_batch(members, events, start_dt, end_dt, min_total_events=1,
+                                      adequate_if_absent=False):
+        """Same results as was_adequate_for_period for many members, with a constant number of queries.
+
+        :param members:
+        :param events:
+        :param start_dt:
+        :param end_dt:
+        :param min_total_events:
+        :param adequate_if_absent:
+        :return: dict of (adequate, reason) per member pk.
+        """
+        results = {}
+
+        remaining_members = []
+        for member in members:
+            if adequate_if_absent and member.join_date > start_dt.date():
+                results[member.pk] = (True, "Was not a member for entire period.")
+            else:
+                remaining_members.append(member)
+
+        if adequate_if_absent and len(remaining_members) > 0:
+            start_date = start_dt.date()
+            end_date = end_dt.date()
+            absent_member_pks = set(Absence.objects.filter(
+                Q(start_date__lte=start_date, end_date__gte=start_date) |
+                Q(start_date__lte=end_date, end_date__gte=end_date) |
+                Q(start_date__gte=start_date, end_date__lte=end_date) |
+                Q(start_date__lte=start_date, end_date__gte=end_date),
+                member__in=[member.pk for member in remaining_members]).values_list("member_id", flat=True))
+
+            for member in remaining_members:
+                if member.pk in absent_member_pks:
+                    results[member.pk] = (True, "Was marked absent during period.")
+
+            remaining_members = [member for member in remaining_members if member.pk not in absent_member_pks]
+
+        if len(remaining_members) == 0:
+            return results
+
+        training_event_type = EventType.objects.get(name__iexact="training")
+
+        attended_counts = {}
+        for member_pk, attended_total, attended_training in Attendance.objects.filter(
+                member__in=[member.pk for member in remaining_members], event__in=events,
+                adequate=True).values("member").annotate(
+                attended_total=Count("pk"), attended_training=Sum(Case(
+                    When(event__event_type=training_event_type, then=Value(1)), default=Value(0),
+                    output_field=models.IntegerField()))).values_list(
+                "member", "attended_total", "attended_training"):
+            attended_counts[member_pk] = (attended_total, attended_training)
+
+        min_trainings = 0
+
+        between_string = "between %s and %s" % (start_dt.strftime("%Y-%m-%d"), end_dt.strftime("%Y-%m-%d"))
+
+        for member in remaining_members:
+            attended_total, attended_training = attended_counts.get(member.pk, (0, 0))
+
+            if attended_total < min_total_events:
+                results[member.pk] = (False, "Did not attend enough events %s." % (between_string,))
+            elif attended_training < min_trainings:
+                results[member.pk] = (False, "Did not attend enough trainings %s." % (between_string,))
+            else:
+                results[member.pk] = (True, "No attendance issues.")
+
+        return results
+
     def get_attendance_ratio(self):
         """
 
         :return:
         """
-        event_duration_seconds = float((self.event.end_dt - self.event.start_dt).total_seconds())
-        return min(1.0, float(self.attendance_seconds) / event_duration_seconds)
+        return Attendance.calculate_attendance_ratio(self.attendance_seconds, self.event)
 
     def was_adequate(self):
         """
@@ -449,3 +696,100 @@ class Attendance(models.Model):
         #     base_required_attendance_ratio *= 2
 
         return attendance_ratio > base_required_attendance_ratio
+
+    def update_attendance_ratio(self):
+        self.attendance_ratio = self.get_attendance_ratio()
+        self.adequate = self.attendance_ratio > self.event.event_type.minimum_required_attendance_ratio
+
+    def save(self, *args, **kwargs):
+        # Uses the event and event type of the instance, which take a query each unless they were loaded with it,
+        # e.g. through select_related("event__event_type").
+        self.update_attendance_ratio()
+
+        super(Attendance, self).save(*args, **kwargs)
+
+        self._stored_event_id = self.event_id
+
+
+class ScrapeJob(CreatedModifiedMixin):
+    """Queued scrape of the server stats site, processed outside of the web request by the scrape worker.
+
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+    # Running jobs save their progress after every event page, a job that stays silent for longer lost its worker.
+    RUNNING_TIMEOUT = timedelta(minutes=15)
+
+    event_type = models.ForeignKey(EventType, null=False)
+    start_dt = models.DateTimeField(null=False)
+    end_dt = models.DateTimeField(null=False)
+
+    status = models.TextField(null=False, default=QUEUED, db_index=True)
+    events_done = models.IntegerField(null=False, default=0)
+    events_total = models.IntegerField(null=False, default=0)
+    result = models.TextField(null=True, default=None)
+    error = models.TextField(null=True, default=None)
+
+    @staticmethod
+    def fail_stale_jobs():
+        """Mark running jobs whose worker stopped reporting progress as failed.
+
+        :return: number of failed jobs.
+        """
+        now = timezone.now()
+        return ScrapeJob.objects.filter(status=ScrapeJob.RUNNING, modified__lt=now - ScrapeJob.RUNNING_TIMEOUT).update(
+            status=ScrapeJob.FAILED, modified=now,
+            error="The scrape job made no progress for %s minutes, its worker was probably stopped." % (
+                int(ScrapeJob.RUNNING_TIMEOUT.total_seconds() // 60),))
+
+    @staticmethod
+    def claim_next():
+        """Mark the oldest queued job as running, safe against several workers claiming the same job.
+
+        Stale running jobs are failed first, so a job lost by a stopped worker does not stay running forever.
+
+        :return: the claimed job or None if no job is queued.
+        """
+        ScrapeJob.fail_stale_jobs()
+
+        for job_pk in ScrapeJob.objects.filter(status=ScrapeJob.QUEUED).order_by("pk").values_list("pk", flat=True):
+            claimed = ScrapeJob.objects.filter(pk=job_pk, status=ScrapeJob.QUEUED).update(status=ScrapeJob.RUNNING,
+                                                                                          modified=timezone.now())
+            if claimed:
+                return ScrapeJob.objects.get(pk=job_pk)
+
+        return None
+
+    def update_progress(self, events_done, events_total):
+        self.events_done = events_done
+        self.events_total = events_total
+        self.save()
+
+    def is_done(self):
+        return self.status in (ScrapeJob.FINISHED, ScrapeJob.FAILED)
+
+
+class ReportSnapshot(CreatedModifiedMixin):
+    """Report context of a closed month, frozen so the report viewer does not compute it again.
+
+    """
+    month = models.DateField(null=False, unique=True)
+    context = models.TextField(null=False, blank=True, default="")
+    stale = models.BooleanField(null=False, default=True)
+    # Incremented by every invalidation, so a freeze that raced with an edit does not clear the stale flag.
+    version = models.IntegerField(null=False, default=0)
+
+    @staticmethod
+    def mark_stale(month_dates):
+        ReportSnapshot.objects.filter(month__in=month_dates).update(stale=True, version=F("version") + 1,
+                                                                    modified=timezone.now())
+
+    @staticmethod
+    def mark_all_stale():
+        ReportSnapshot.objects.update(stale=True, version=F("version") + 1, modified=timezone.now())
+
+    def __str__(self):
+        return "Report snapshot of %s" % (self.month.strftime("%Y-%m"),)
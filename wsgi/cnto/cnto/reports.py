@@ -0,0 +1,543 @@
+import calendar
+import hashlib
+import json
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Avg, Case, Count, IntegerField, Max, Min, Sum, Value, When
+from django.utils import timezone
+from django.utils.timezone import datetime, timedelta
+
+from utils.interval_index import IntervalIndex
+
+from .analytics import AttendanceMatrix
+from .models import MemberGroup, Event, Member, Attendance, Absence, ReportSnapshot
+
+REPORT_CACHE_KEY_PREFIX = "cnto-report"
+ALL_REPORTS_VERSION_NAME = "all"
+
+CALENDAR_DT_FORMAT = "%Y-%m-%d %H:%M"
+
+
+class AttendanceReport(object):
+    """Member by event presence matrix of a reporting period.
+
+    All events, members, attendances and absences of the period are loaded with a handful of queries up front and
+    the matrix is built in memory, instead of querying per member and per event.
+    """
+
+    def __init__(self, start_dt, end_dt):
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+
+        self.events = list(Event.all_for_time_period(start_dt, end_dt).order_by("start_dt").select_related(
+            "event_type"))
+        self.groups = list(MemberGroup.objects.all().order_by("name"))
+        self.members = list(Member.active_members().filter(member_group__isnull=False).order_by("name").select_related(
+            "rank"))
+
+        member_pks = [member.pk for member in self.members]
+
+        self.attendance_matrix = AttendanceMatrix(self.members, self.events)
+
+        if len(member_pks) > 0 and len(self.events) > 0:
+            event_dates = [event.start_dt.date() for event in self.events]
+            self.absence_index = Absence.build_index(Absence.objects.filter(
+                member__in=member_pks, start_date__lte=max(event_dates), end_date__gte=min(event_dates),
+                deleted=False))
+        else:
+            self.absence_index = IntervalIndex()
+
+        self.period_adequacy = Attendance.was_adequate_for_period_batch(self.members, self.events, start_dt, end_dt,
+                                                                        adequate_if_absent=True)
+
+    def get_presence_marker(self, member, event):
+        if member.is_recruit() and not member.mods_assessed:
+            absence_type = "-"
+        elif member.join_date > event.start_dt.date():
+            absence_type = "-"
+        elif self.absence_index.contains(member.pk, event.start_dt.date()):
+            absence_type = "LOA"
+        else:
+            absence_type = None
+
+        if not self.attendance_matrix.has_attended(member, event):
+            presence_marker = " "
+        elif self.attendance_matrix.was_adequate(member, event):
+            presence_marker = "X"
+        else:
+            presence_marker = "?"
+
+        if absence_type is not None:
+            presence_marker = absence_type + " " + presence_marker
+
+        return presence_marker
+
+    def get_context(self):
+        """
+
+        :return: the report context as served to the report viewer.
+        """
+        context = {
+            "event_count": len(self.events),
+            "events": {
+                "start_dates": [event.start_dt.strftime("%Y-%m-%d") for event in self.events],
+                "css_classes": [event.event_type.css_class_name for event in self.events]
+            }
+        }
+
+        members_by_group_pk = {}
+        for member in self.members:
+            members_by_group_pk.setdefault(member.member_group_id, []).append(member)
+
+        attendance_dict = {}
+        group_members = {}
+        for group in self.groups:
+            attendance_dict[group.name] = {}
+            for member in members_by_group_pk.get(group.pk, []):
+                attendance_dict[group.name][member.name] = {
+                    "attendance_adequate": self.period_adequacy[member.pk][0],
+                    "attendances": [self.get_presence_marker(member, event) for event in self.events]
+                }
+
+                if group.name not in group_members:
+                    group_members[group.name] = []
+
+                group_members[group.name].append(member.name)
+
+        context["attendances"] = attendance_dict
+
+        context["group_names"] = sorted(group_members.keys())
+        context["group_members"] = group_members
+        context["start_dt"] = self.start_dt.strftime("%Y-%m-%d")
+        context["end_dt"] = self.end_dt.strftime("%Y-%m-%d")
+
+        return context
+
+
+def get_report_cache():
+    return caches[settings.REPORT_CACHE_ALIAS]
+
+
+def _get_version_key(version_name):
+    return "%s:version:%s" % (REPORT_CACHE_KEY_PREFIX, version_name)
+
+
+def _get_counter_key(counter_name):
+    return "%s:counter:%s" % (REPORT_CACHE_KEY_PREFIX, counter_name)
+
+
+def _new_version():
+    # Versions start from the current time rather than 0, so a version that was evicted from the cache can not
+    # come back with a value that still matches stale entries.
+    return int(time.time() * 1000)
+
+
+def _get_month_dates(first_date, last_date):
+    """
+
+    :param first_date:
+    :param last_date:
+    :return: first day of every month from first_date up to and including last_date.
+    """
+    month_dates = []
+    year, month = first_date.year, first_date.month
+    while (year, month) <= (last_date.year, last_date.month):
+        month_dates.append(date(year, month, 1))
+
+        month += 1
+        if month > 12:
+            year += 1
+            month = 1
+
+    return month_dates
+
+
+def _get_month_version_names(first_date, last_date):
+    return [month_date.strftime("%Y-%m") for month_date in _get_month_dates(first_date, last_date)]
+
+
+def _get_local_date(dt):
+    return timezone.localtime(dt, timezone.get_default_timezone()).date()
+
+
+def _get_versions(cache, version_names):
+    """
+
+    :param cache:
+    :param version_names:
+    :return: dict of the current version per version name.
+    """
+    version_keys = {version_name: _get_version_key(version_name) for version_name in version_names}
+    versions = cache.get_many(list(version_keys.values()))
+    for version_key in version_keys.values():
+        if version_key not in versions:
+            cache.add(version_key, _new_version(), None)
+            versions[version_key] = cache.get(version_key)
+
+    return {version_name: versions[version_key] for version_name, version_key in version_keys.items()}
+
+
+def _bump_versions(version_names):
+    cache = get_report_cache()
+    for version_name in version_names:
+        version_key = _get_version_key(version_name)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            cache.set(version_key, _new_version(), None)
+
+
+def _bump_versions_on_commit(version_names):
+    """Bump the versions once the current transaction commits, right away outside of a transaction.
+
+    A report computed before the commit would otherwise be cached under the new versions with the old data.
+
+    :param version_names:
+    :return:
+    """
+    connection.on_commit(lambda: _bump_versions(version_names))
+
+
+def _count(cache, counter_name):
+    counter_key = _get_counter_key(counter_name)
+    cache.add(counter_key, 0, None)
+    try:
+        cache.incr(counter_key)
+    except ValueError:
+        # Evicted between add and incr.
+        cache.set(counter_key, 1, None)
+
+
+def invalidate_reports_between(first_date, last_date):
+    """Invalidate the cached reports and snapshots of every month from first_date up to and including last_date.
+
+    :param first_date:
+    :param last_date:
+    :return:
+    """
+    # Snapshots are marked in the transaction, and unmarked again if it is rolled back.
+    ReportSnapshot.mark_stale(_get_month_dates(first_date, last_date))
+    _bump_versions_on_commit(_get_month_version_names(first_date, last_date))
+
+
+def invalidate_reports_for_dt(dt):
+    """Invalidate the cached reports that include an event starting at dt.
+
+    :param dt:
+    :return:
+    """
+    local_date = _get_local_date(dt)
+    invalidate_reports_between(local_date, local_date)
+
+
+def invalidate_reports_for_absence_dates(start_date, end_date):
+    """Invalidate the cached reports an absence between the dates shows up in.
+
+    Absences are matched against event dates in UTC while reports are split in local months, so a day of margin is
+    invalidated on both sides.
+
+    :param start_date:
+    :param end_date:
+    :return:
+    """
+    invalidate_reports_between(start_date - timedelta(days=1), end_date + timedelta(days=1))
+
+
+def invalidate_all_reports():
+    """Invalidate the cached reports and snapshots of every month, e.g. after a roster or event type change.
+
+    :return:
+    """
+    ReportSnapshot.mark_all_stale()
+    _bump_versions_on_commit([ALL_REPORTS_VERSION_NAME])
+
+
+def get_cached_report_context(start_dt, end_dt):
+    """
+
+    :param start_dt:
+    :param end_dt:
+    :return: the report context of the period, from the report cache if it is still valid.
+    """
+    cache = get_report_cache()
+
+    version_names = [ALL_REPORTS_VERSION_NAME] + _get_month_version_names(_get_local_date(start_dt),
+                                                                          _get_local_date(end_dt))
+    versions = _get_versions(cache, version_names)
+    versions = [versions[version_name] for version_name in version_names]
+    context_key = "%s:context:%s" % (REPORT_CACHE_KEY_PREFIX, hashlib.sha1(
+        repr((start_dt.isoformat(), end_dt.isoformat(), versions)).encode("utf-8")).hexdigest())
+
+    context = cache.get(context_key)
+    if context is None:
+        _count(cache, "misses")
+        context = AttendanceReport(start_dt, end_dt).get_context()
+        cache.set(context_key, context, settings.REPORT_CACHE_TIMEOUT)
+    else:
+        _count(cache, "hits")
+
+    return context
+
+
+def get_report_cache_counters():
+    """
+
+    :return: report cache hit and miss counts.
+    """
+    cache = get_report_cache()
+    counter_names = ["hits", "misses"]
+    counters = cache.get_many([_get_counter_key(counter_name) for counter_name in counter_names])
+
+    return {
+        counter_name: counters.get(_get_counter_key(counter_name), 0) for counter_name in counter_names
+    }
+
+
+def get_month_date_range(year, month):
+    """
+
+    :param year:
+    :param month:
+    :return: local start and end of the month as reported.
+    """
+    return (
+        timezone.make_aware(datetime(year, month, 1, 0, 0), timezone.get_default_timezone()),
+        timezone.make_aware(datetime(year, month, calendar.monthrange(year, month)[1], 23, 59),
+                            timezone.get_default_timezone()))
+
+
+def is_frozen_month(year, month):
+    """
+
+    :param year:
+    :param month:
+    :return: True if the report of the month is older than the snapshot cutoff.
+    """
+    today = _get_local_date(timezone.now())
+    cutoff_year, cutoff_month = today.year, today.month - settings.REPORT_SNAPSHOT_CUTOFF_MONTHS
+    while cutoff_month < 1:
+        cutoff_year -= 1
+        cutoff_month += 12
+
+    return (year, month) < (cutoff_year, cutoff_month)
+
+
+def freeze_report_for_month(year, month):
+    """Compute the report of a month and store it as its snapshot.
+
+    :param year:
+    :param month:
+    :return: the report context.
+    """
+    snapshot, _ = ReportSnapshot.objects.get_or_create(month=date(year, month, 1))
+
+    context = AttendanceReport(*get_month_date_range(year, month)).get_context()
+
+    # Left stale if the month was edited while the report was computed.
+    ReportSnapshot.objects.filter(pk=snapshot.pk, version=snapshot.version).update(
+        context=json.dumps(context), stale=False, modified=timezone.now())
+
+    return context
+
+
+def get_report_context_for_month(year, month):
+    """
+
+    :param year:
+    :param month:
+    :return: the report context of the month, from its snapshot if the month is frozen and was not edited since.
+    """
+    if not is_frozen_month(year, month):
+        return get_cached_report_context(*get_month_date_range(year, month))
+
+    snapshot = ReportSnapshot.objects.filter(month=date(year, month, 1), stale=False).first()
+    if snapshot is not None:
+        return json.loads(snapshot.context)
+
+    return freeze_report_for_month(year, month)
+
+
+def _get_week_summary(week_start_dt, week_end_dt, attendance_counts):
+    return {
+        "week_start_dt": week_start_dt.strftime("%Y-%m-%d"),
+        "week_end_dt": week_end_dt.strftime("%Y-%m-%d"),
+        "week_max": max(attendance_counts) if len(attendance_counts) > 0 else 0,
+        "week_avg": float(sum(attendance_counts)) / len(attendance_counts) if len(attendance_counts) > 0 else 0
+    }
+
+
+def get_weekly_attendance_summary(from_dt=None, to_dt=None):
+    """Maximum and average attendance of the events of every week, counting members that are not deleted.
+
+    Weeks run from the Sunday before the first event, at the time of day of the first event. Only events that end
+    within a week count for it. All events of the requested weeks are counted with a single grouped query, and the
+    summaries of completed weeks are cached until an edit touches their months.
+
+    :param from_dt: only weeks ending after from_dt.
+    :param to_dt: only weeks starting before to_dt.
+    :return: list of week summaries.
+    """
+    event_dt_range = Event.objects.all().aggregate(Min("start_dt"), Max("start_dt"))
+    first_event_dt = event_dt_range["start_dt__min"]
+    last_event_dt = event_dt_range["start_dt__max"]
+    if first_event_dt is None:
+        return []
+
+    first_event_sunday = first_event_dt
+    while first_event_sunday.weekday() != 6:
+        first_event_sunday = first_event_sunday - timedelta(days=1)
+
+    week_start_dts = []
+    week_start_dt = first_event_sunday
+    while week_start_dt < last_event_dt:
+        week_end_dt = week_start_dt + timedelta(days=7)
+        if (from_dt is None or week_end_dt > from_dt) and (to_dt is None or week_start_dt < to_dt):
+            week_start_dts.append(week_start_dt)
+
+        week_start_dt = week_end_dt
+
+    if len(week_start_dts) == 0:
+        return []
+
+    cache = get_report_cache()
+    now = timezone.now()
+
+    completed_week_version_names = {}
+    for week_start_dt in week_start_dts:
+        week_end_dt = week_start_dt + timedelta(days=7)
+        if week_end_dt <= now:
+            completed_week_version_names[week_start_dt] = [ALL_REPORTS_VERSION_NAME] + _get_month_version_names(
+                _get_local_date(week_start_dt), _get_local_date(week_end_dt))
+
+    versions = _get_versions(cache, set(version_name for version_names in completed_week_version_names.values()
+                                        for version_name in version_names))
+    week_keys = {
+        week_start_dt: "%s:week:%s:%s" % (REPORT_CACHE_KEY_PREFIX, week_start_dt.strftime("%Y%m%d%H%M%S"),
+                                          "-".join(str(versions[version_name]) for version_name in version_names))
+        for week_start_dt, version_names in completed_week_version_names.items()
+    }
+    cached_summaries = cache.get_many(list(week_keys.values()))
+
+    week_summaries = {}
+    for week_start_dt, week_key in week_keys.items():
+        if week_key in cached_summaries:
+            week_summaries[week_start_dt] = cached_summaries[week_key]
+
+    missing_week_start_dts = [week_start_dt for week_start_dt in week_start_dts if week_start_dt not in week_summaries]
+    if len(missing_week_start_dts) > 0:
+        events = Event.objects.filter(
+            start_dt__gte=missing_week_start_dts[0],
+            start_dt__lt=missing_week_start_dts[-1] + timedelta(days=7)).annotate(attendance_count=Sum(Case(
+                When(attendees__member__deleted=False, then=Value(1)), default=Value(0),
+                output_field=IntegerField())))
+
+        attendance_counts_by_week = {week_start_dt: [] for week_start_dt in missing_week_start_dts}
+        for start_dt, end_dt, attendance_count in events.values_list("start_dt", "end_dt", "attendance_count"):
+            week_index = int((start_dt - first_event_sunday).total_seconds() // timedelta(days=7).total_seconds())
+            week_start_dt = first_event_sunday + timedelta(days=7 * week_index)
+            if week_start_dt in attendance_counts_by_week and end_dt < week_start_dt + timedelta(days=7):
+                attendance_counts_by_week[week_start_dt].append(attendance_count)
+
+        completed_week_summaries = {}
+        for week_start_dt, attendance_counts in attendance_counts_by_week.items():
+            week_summaries[week_start_dt] = _get_week_summary(week_start_dt, week_start_dt + timedelta(days=7),
+                                                              attendance_counts)
+            if week_start_dt in week_keys:
+                completed_week_summaries[week_keys[week_start_dt]] = week_summaries[week_start_dt]
+
+        cache.set_many(completed_week_summaries, settings.REPORT_CACHE_TIMEOUT)
+
+    return [week_summaries[week_start_dt] for week_start_dt in week_start_dts]
+
+
+def _get_month_start_dt(month_date):
+    return timezone.make_aware(datetime(month_date.year, month_date.month, 1, 0, 0), timezone.get_default_timezone())
+
+
+def _get_calendar_events_for_month(month_date):
+    """
+
+    :param month_date: first day of the month.
+    :return: calendar entries of the events starting in the local month, with their stats aggregated in SQL.
+    """
+    next_month_date = _get_month_dates(month_date, month_date + timedelta(days=31))[1]
+    events = Event.objects.filter(
+        start_dt__gte=_get_month_start_dt(month_date), start_dt__lt=_get_month_start_dt(next_month_date)
+    ).order_by("start_dt").select_related("event_type").annotate(
+        player_count=Count("attendees"), average_attendance=Avg("attendees__attendance_ratio"))
+
+    local_timezone = timezone.get_default_timezone()
+    calendar_events = []
+    for event in events:
+        average_attendance = event.average_attendance if event.average_attendance is not None else 0
+        calendar_events.append({
+            "title": "\n%s minutes\n%.2f %% attendance\n%s players" % (
+                event.duration_minutes, average_attendance * 100.0, event.player_count),
+            "start": event.start_dt.astimezone(local_timezone).strftime(CALENDAR_DT_FORMAT),
+            "end": event.end_dt.astimezone(local_timezone).strftime(CALENDAR_DT_FORMAT),
+            "className": event.event_type.css_class_name,
+            "allDay": False,
+        })
+
+    return calendar_events
+
+
+def get_calendar_events(start_dt, end_dt):
+    """Calendar entries of the event browser for a window of time.
+
+    Entries are computed and cached per local month. Months that have ended are cached without expiry, they only
+    drop out of the cache when an edit bumps their version.
+
+    :param start_dt:
+    :param end_dt: exclusive end of the window.
+    :return: calendar entries of the events starting within the window, ordered by start.
+    """
+    if end_dt <= start_dt:
+        return []
+
+    cache = get_report_cache()
+    month_dates = _get_month_dates(_get_local_date(start_dt), _get_local_date(end_dt - timedelta(microseconds=1)))
+    versions = _get_versions(cache, [ALL_REPORTS_VERSION_NAME] + [
+        month_date.strftime("%Y-%m") for month_date in month_dates])
+    month_keys = {
+        month_date: "%s:calendar:%s:%s-%s" % (REPORT_CACHE_KEY_PREFIX, month_date.strftime("%Y-%m"),
+                                              versions[ALL_REPORTS_VERSION_NAME],
+                                              versions[month_date.strftime("%Y-%m")])
+        for month_date in month_dates
+    }
+    cached_months = cache.get_many(list(month_keys.values()))
+
+    current_month_start_dt = _get_month_start_dt(_get_local_date(timezone.now()))
+    closed_months = {}
+    open_months = {}
+    calendar_events = []
+    for month_date in month_dates:
+        month_key = month_keys[month_date]
+        if month_key in cached_months:
+            month_events = cached_months[month_key]
+        else:
+            month_events = _get_calendar_events_for_month(month_date)
+            if _get_month_start_dt(month_date) < current_month_start_dt:
+                closed_months[month_key] = month_events
+            else:
+                open_months[month_key] = month_events
+
+        calendar_events.extend(month_events)
+
+    if len(closed_months) > 0:
+        cache.set_many(closed_months, None)
+    if len(open_months) > 0:
+        cache.set_many(open_months, settings.REPORT_CACHE_TIMEOUT)
+
+    # Window bounds are local midnights, which never fall in a daylight saving transition, so the local start
+    # strings compare in time order.
+    local_timezone = timezone.get_default_timezone()
+    start_string = start_dt.astimezone(local_timezone).strftime(CALENDAR_DT_FORMAT)
+    end_string = end_dt.astimezone(local_timezone).strftime(CALENDAR_DT_FORMAT)
+
+    return [calendar_event for calendar_event in calendar_events
+            if start_string <= calendar_event["start"] < end_string]
@@ -153,12 +153,13 @@ except ImportError:
     POSTGRES_DB_URL = None
     POSTGRES_DB_NAME = None
 
+# The transaction_hooks backends add connection.on_commit, which the report cache invalidation runs on.
 DATABASES = {}
 if 'OPENSHIFT_MYSQL_DB_URL' in os.environ:
     url = urllib.parse.urlparse(os.environ.get('OPENSHIFT_MYSQL_DB_URL'))
 
     DATABASES['default'] = {
-        'ENGINE' : 'django.db.backends.mysql',
+        'ENGINE' : 'transaction_hooks.backends.mysql',
         'NAME': os.environ['OPENSHIFT_APP_NAME'],
         'USER': url.username,
         'PASSWORD': url.password,
@@ -170,7 +171,7 @@ elif 'OPENSHIFT_POSTGRESQL_DB_URL' in os.environ:
     url = urllib.parse.urlparse(os.environ.get('OPENSHIFT_POSTGRESQL_DB_URL'))
 
     DATABASES['default'] = {
-        'ENGINE' : 'django.db.backends.postgresql_psycopg2',
+        'ENGINE' : 'transaction_hooks.backends.postgresql_psycopg2',
         'NAME': os.environ['OPENSHIFT_APP_NAME'],
         'USER': url.username,
         'PASSWORD': url.password,
@@ -181,7 +182,7 @@ elif POSTGRES_DB_URL is not None:
     url = urllib.parse.urlparse(POSTGRES_DB_URL)
 
     DATABASES['default'] = {
-        'ENGINE' : 'django.db.backends.postgresql_psycopg2',
+        'ENGINE' : 'transaction_hooks.backends.postgresql_psycopg2',
         'NAME': 'django-roster',
         'USER': 'django',
         'PASSWORD': 'django;',
@@ -192,7 +193,7 @@ elif POSTGRES_DB_URL is not None:
 
 else:
     DATABASES['default'] = {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'transaction_hooks.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'dev.db'),
         'USER': '',
         'PASSWORD': '',
@@ -223,3 +224,32 @@ STATIC_ROOT = os.path.join(WSGI_DIR, 'static')
 STATICFILES_DIRS = (
     os.path.join(BASE_DIR, "cnto", "static"),
 )
+
+# Attendance scraper
+# Pages of finished events on the server stats site never change, so they are kept on disk between scrapes.
+
+SCRAPER_CACHE_DIR = os.path.join(DATA_DIR, 'scraper-cache')
+SCRAPER_CACHE_MAX_BYTES = 50 * 1024 * 1024
+# "lxml" (compiled XPath) or "bs4" (the original BeautifulSoup search).
+SCRAPER_PARSER_BACKEND = 'lxml'
+
+# Reports
+# Computed report contexts are cached per date range. The cache is shared on disk so that edits made by the
+# background commands invalidate the reports served by the web processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DATA_DIR, 'report-cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+REPORT_CACHE_ALIAS = 'reports'
+REPORT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+# Reports of months before the last REPORT_SNAPSHOT_CUTOFF_MONTHS months are frozen and served from snapshots.
+REPORT_SNAPSHOT_CUTOFF_MONTHS = 2
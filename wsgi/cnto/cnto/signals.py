@@ -0,0 +1,124 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Rank, MemberGroup, Member, EventType, Event, Absence, Attendance
+from .reports import invalidate_reports_for_dt, invalidate_reports_for_absence_dates, invalidate_all_reports
+
+
+@receiver(post_save, sender=Event)
+def update_attendance_ratios(sender, instance, **kwargs):
+    # Event times and type decide the ratios and adequacy stored on the attendances.
+    Attendance.update_attendance_ratios_for_event(instance)
+
+
+@receiver(post_save, sender=EventType)
+def update_attendance_adequacy(sender, instance, **kwargs):
+    Attendance.update_adequacy_for_event_type(instance)
+
+
+def _get_stored_event_start_dt(sender, pk):
+    """
+
+    :param sender: Event or Attendance.
+    :param pk:
+    :return: start of the event as stored in the database, None if the instance is not stored.
+    """
+    if pk is None:
+        return None
+
+    if sender is Event:
+        start_dts = Event.objects.filter(pk=pk).values_list("start_dt", flat=True)
+    else:
+        start_dts = Attendance.objects.filter(pk=pk).values_list("event__start_dt", flat=True)
+
+    return start_dts.first()
+
+
+def _get_stored_absence_dates(pk):
+    if pk is None:
+        return None
+
+    return Absence.objects.filter(pk=pk).values_list("start_date", "end_date").first()
+
+
+@receiver(pre_save, sender=Event)
+@receiver(pre_delete, sender=Event)
+@receiver(pre_delete, sender=Attendance)
+def remember_stored_event_start_dt(sender, instance, **kwargs):
+    instance._reports_stored_start_dt = _get_stored_event_start_dt(sender, instance.pk)
+
+
+@receiver(pre_save, sender=Attendance)
+def remember_stored_attendance_event_start_dt(sender, instance, **kwargs):
+    # The month of the current event is invalidated after the save, the stored event only has to be looked up when
+    # the attendance may have been moved from another one.
+    if instance.pk is not None and instance.event_id == getattr(instance, "_stored_event_id", None):
+        instance._reports_stored_start_dt = None
+    else:
+        instance._reports_stored_start_dt = _get_stored_event_start_dt(sender, instance.pk)
+
+
+def _invalidate_stored_event_reports(instance):
+    stored_start_dt = getattr(instance, "_reports_stored_start_dt", None)
+    if stored_start_dt is not None:
+        invalidate_reports_for_dt(stored_start_dt)
+
+    return stored_start_dt
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=Attendance)
+def invalidate_saved_event_reports(sender, instance, **kwargs):
+    stored_start_dt = _invalidate_stored_event_reports(instance)
+
+    # The attendance event was already loaded by Attendance.save.
+    start_dt = instance.start_dt if sender is Event else instance.event.start_dt
+    if start_dt != stored_start_dt:
+        invalidate_reports_for_dt(start_dt)
+
+
+@receiver(post_delete, sender=Event)
+@receiver(post_delete, sender=Attendance)
+def invalidate_deleted_event_reports(sender, instance, **kwargs):
+    _invalidate_stored_event_reports(instance)
+
+
+@receiver(pre_save, sender=Absence)
+@receiver(pre_delete, sender=Absence)
+def remember_stored_absence_dates(sender, instance, **kwargs):
+    instance._reports_stored_dates = _get_stored_absence_dates(instance.pk)
+
+
+def _invalidate_stored_absence_reports(instance):
+    stored_dates = getattr(instance, "_reports_stored_dates", None)
+    if stored_dates is not None:
+        invalidate_reports_for_absence_dates(*stored_dates)
+
+    return stored_dates
+
+
+@receiver(post_save, sender=Absence)
+def invalidate_saved_absence_reports(sender, instance, **kwargs):
+    stored_dates = _invalidate_stored_absence_reports(instance)
+
+    dates = (instance.start_date, instance.end_date)
+    if dates != stored_dates:
+        invalidate_reports_for_absence_dates(*dates)
+
+
+@receiver(post_delete, sender=Absence)
+def invalidate_deleted_absence_reports(sender, instance, **kwargs):
+    _invalidate_stored_absence_reports(instance)
+
+
+@receiver(post_save, sender=Rank)
+@receiver(post_save, sender=MemberGroup)
+@receiver(post_save, sender=Member)
+@receiver(post_save, sender=EventType)
+@receiver(post_delete, sender=Rank)
+@receiver(post_delete, sender=MemberGroup)
+@receiver(post_delete, sender=Member)
+@receiver(post_delete, sender=EventType)
+def invalidate_roster_reports(sender, instance, **kwargs):
+    # Members and groups show up in the report of every period.
+    invalidate_all_reports()
@@ -2,7 +2,6 @@ from django import template
 from django.contrib.auth.models import Group, Permission
 from django.utils import timezone
 from cnto_contributions.models import Contribution
-from cnto_notes.models import Note
 
 register = template.Library()
 
@@ -13,22 +12,34 @@ def value_of(value, arg):
     return func()
 
 
+NOTE_MESSAGE_LENGTH_LIMIT = 70
+
+
+def get_note_excerpt(note_message):
+    if len(note_message) > NOTE_MESSAGE_LENGTH_LIMIT:
+        return note_message[0:NOTE_MESSAGE_LENGTH_LIMIT - 3] + "..."
+    else:
+        return note_message
+
+
 @register.filter(name='active_note_message')
 def active_note_message(member):
-    try:
-        member_note = member.notes.get(active=True)
-        note_message = member_note.message
-        message_length_limit = 70
-        if len(note_message) > message_length_limit:
-            return note_message[0:message_length_limit - 3] + "..."
-        else:
-            return note_message
-    except Note.DoesNotExist:
+    if hasattr(member, "active_note_excerpt"):
+        return member.active_note_excerpt
+
+    # The latest of several active notes, as chosen by attach_member_list_annotations.
+    member_note = member.notes.filter(active=True).order_by("-dt", "-id").first()
+    if member_note is None:
         return ""
 
+    return get_note_excerpt(member_note.message)
+
 
 @register.filter(name='contribution_level')
 def contribution_level(member):
+    if hasattr(member, "contribution_type_name"):
+        return member.contribution_type_name
+
     contributions = Contribution.objects.filter(member=member, end_date__gte=timezone.now().date())
 
     if contributions.count() == 0:
@@ -42,13 +53,28 @@ def has_group(user, group_name):
     return user.groups.filter(name__iexact=group_name).exists()
 
 
+def get_group_permission_codenames(user):
+    """
+
+    :param user:
+    :return: frozenset of the codenames of the permissions of the groups of the user, empty for anonymous users.
+    """
+    if not user.is_authenticated():
+        return frozenset()
+
+    # The user object lives as long as the request, so the permissions are only queried once per request.
+    permission_codenames = getattr(user, "_cnto_permission_codenames", None)
+    if permission_codenames is None:
+        permission_codenames = frozenset(
+            Permission.objects.filter(group__user=user).values_list("codename", flat=True))
+        user._cnto_permission_codenames = permission_codenames
+
+    return permission_codenames
+
+
 @register.filter(name='has_permission')
 def has_permission(user, permission_name):
     if user.is_superuser:
         return True
 
-    for group in user.groups.all():
-        if group.permissions.all().filter(codename=permission_name).exists():
-            return True
-
-    return False
+    return permission_name in get_group_permission_codenames(user)
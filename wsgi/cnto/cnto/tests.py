@@ -0,0 +1,1587 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.contrib.auth.models import AnonymousUser, Group, Permission, User
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.timezone import datetime, timedelta
+import pytz
+from requests.exceptions import RequestException
+
+from cnto_contributions.models import Contribution, ContributionType
+from cnto_notes.models import Note
+from utils import attendance_scraper
+from utils.fake_a2s_server import FakeA2SServer
+from utils.game_history_index import GameHistoryIndex
+from utils.interval_index import IntervalIndex
+from utils.page_cache import PageCache
+from utils.scraper_http import ScraperHttpClient
+from utils.stats_page_parser import BS4_BACKEND, LXML_BACKEND, parse_game_history_rows, parse_player_rows
+
+from .analytics import AttendanceMatrix
+from .management.commands.run_attendance_poller import AttendancePoller
+from .models import Absence, AbsenceType, Attendance, Event, EventType, Member, MemberAlias, MemberGroup, Rank, \
+    ReportSnapshot, ScrapeJob
+from .reports import ALL_REPORTS_VERSION_NAME, AttendanceReport, _get_versions, get_calendar_events, \
+    get_report_cache, get_report_context_for_month
+from .templatetags.cnto_tags import active_note_message, contribution_level, has_permission
+from .views.manage import attach_member_list_annotations
+from .views.scrape import add_attendance_seconds, import_scraped_attendances, resolve_members_for_raw_usernames, \
+    update_current_event
+
+STATS_PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "stats_pages")
+
+
+def create_event_type(name="Training", minimum_required_attendance_ratio=0.5):
+    return EventType.objects.create(name=name, default_start_hour=20, default_end_hour=23,
+                                    minimum_required_attendance_ratio=minimum_required_attendance_ratio,
+                                    css_class_name=name.lower())
+
+
+def get_report_context_per_member(start_dt, end_dt):
+    """The report context as built before AttendanceReport, with queries per member and per event.
+
+    :param start_dt:
+    :param end_dt:
+    :return:
+    """
+    context = {}
+
+    events = Event.all_for_time_period(start_dt, end_dt).order_by("start_dt")
+    context["event_count"] = events.count()
+
+    context["events"] = {
+        "start_dates": [event.start_dt.strftime("%Y-%m-%d") for event in events],
+        "css_classes": [event.event_type.css_class_name for event in events]
+    }
+
+    groups = MemberGroup.objects.all().order_by("name")
+    all_members = Member.active_members()
+
+    attendance_dict = {}
+    group_members = {}
+    for group in groups:
+        attendance_dict[group.name] = {}
+        for member in all_members.filter(member_group=group).order_by("name"):
+            period_attendance_adequate, reason = Attendance.was_adequate_for_period(member, events, start_dt, end_dt,
+                                                                                    adequate_if_absent=True)
+            attendance_dict[group.name][member.name] = {
+                "attendance_adequate": period_attendance_adequate,
+                "attendances": []
+            }
+            group_members.setdefault(group.name, []).append(member.name)
+
+            for event in events:
+                try:
+                    if member.is_recruit() and not member.mods_assessed:
+                        absence_type = "-"
+                    elif member.join_date > event.start_dt.date():
+                        absence_type = "-"
+                    else:
+                        Absence.get_absence_for_event(event, member)
+                        absence_type = "LOA"
+                except Absence.DoesNotExist:
+                    absence_type = None
+
+                try:
+                    if Attendance.objects.get(member=member, event=event).was_adequate():
+                        presence_marker = "X"
+                    else:
+                        presence_marker = "?"
+                except Attendance.DoesNotExist:
+                    presence_marker = " "
+
+                if absence_type is not None:
+                    presence_marker = absence_type + " " + presence_marker
+
+                attendance_dict[group.name][member.name]["attendances"].append(presence_marker)
+
+    context["attendances"] = attendance_dict
+
+    context["group_names"] = sorted(group_members.keys())
+    context["group_members"] = group_members
+    context["start_dt"] = start_dt.strftime("%Y-%m-%d")
+    context["end_dt"] = end_dt.strftime("%Y-%m-%d")
+
+    return context
+
+
+class StatsPageParserTests(TestCase):
+    """The lxml and BeautifulSoup backends must extract the same rows from the recorded stats pages.
+
+    """
+
+    def get_recorded_pages(self, pattern):
+        page_paths = sorted(glob.glob(os.path.join(STATS_PAGES_DIR, pattern)))
+        self.assertTrue(len(page_paths) > 0)
+
+        for page_path in page_paths:
+            with open(page_path, "rb") as page_file:
+                yield page_path, page_file.read()
+
+    def test_game_history_rows_match(self):
+        for page_path, page_content in self.get_recorded_pages("game-history-*.html"):
+            lxml_rows = parse_game_history_rows(page_content, LXML_BACKEND)
+
+            self.assertTrue(len(lxml_rows) > 0, page_path)
+            self.assertEqual(lxml_rows, parse_game_history_rows(page_content, BS4_BACKEND), page_path)
+
+    def test_player_rows_match(self):
+        for page_path, page_content in self.get_recorded_pages("event-*.html"):
+            lxml_rows = parse_player_rows(page_content, LXML_BACKEND)
+
+            self.assertTrue(len(lxml_rows) > 0, page_path)
+            self.assertEqual(lxml_rows, parse_player_rows(page_content, BS4_BACKEND), page_path)
+
+    def test_text_content_matches(self):
+        for page_path, page_content in self.get_recorded_pages("event-*.html"):
+            # Pages passed as text skip the byte decoding of the lxml backend.
+            page_text = page_content.decode("utf-8")
+
+            self.assertEqual(parse_player_rows(page_text, LXML_BACKEND), parse_player_rows(page_text, BS4_BACKEND),
+                             page_path)
+
+    def test_unknown_backend(self):
+        for _, page_content in self.get_recorded_pages("game-history-1.html"):
+            with self.assertRaises(ValueError):
+                parse_game_history_rows(page_content, "html5lib")
+
+
+class ScriptedStatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status_code = self.server.next_status_code(self.headers)
+
+        self.send_response(status_code)
+        self.send_header("ETag", self.server.etag)
+        if status_code == 304:
+            self.end_headers()
+            return
+
+        content = ("Status %s" % (status_code,)).encode("utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScriptedStatusServer(HTTPServer):
+    """Local HTTP server answering every request with the next status code of a script, 200 once it runs out.
+
+    """
+
+    def __init__(self, status_codes):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), ScriptedStatusHandler)
+        self.status_codes = list(status_codes)
+        self.request_count = 0
+        self.request_headers = []
+        self.etag = '"v1"'
+        self.url = "http://127.0.0.1:%s/server/data/375393" % (self.server_address[1],)
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def next_status_code(self, request_headers):
+        self.request_count += 1
+        self.request_headers.append(dict(request_headers))
+        if len(self.status_codes) == 0:
+            return 200
+
+        return self.status_codes.pop(0)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ScraperHttpClientTests(TestCase):
+    def get_client_and_server(self, status_codes):
+        server = ScriptedStatusServer(status_codes)
+        self.addCleanup(server.stop)
+
+        client = ScraperHttpClient(max_retries=2, backoff_factor=0)
+        self.addCleanup(client.close)
+
+        return client, server
+
+    def assertCounters(self, client, requests, retries, failures):
+        stats = client.get_stats()
+        self.assertEqual((stats["requests"], stats["retries"], stats["failures"]), (requests, retries, failures))
+
+    def test_server_error_succeeds_on_retry(self):
+        client, server = self.get_client_and_server([503, 502])
+
+        self.assertEqual(client.get_content(server.url), b"Status 200")
+        self.assertEqual(server.request_count, 3)
+        self.assertCounters(client, 1, 2, 0)
+
+        self.assertEqual(client.get_content(server.url), b"Status 200")
+        self.assertEqual(server.request_count, 4)
+        self.assertCounters(client, 2, 2, 0)
+
+    def test_permanent_failure(self):
+        client, server = self.get_client_and_server([500, 503, 504, 500])
+
+        with self.assertRaises(RequestException):
+            client.get_content(server.url)
+
+        # The first request and both retries reached the server.
+        self.assertEqual(server.request_count, 3)
+        self.assertCounters(client, 0, 0, 1)
+
+    def test_client_error_is_not_retried(self):
+        client, server = self.get_client_and_server([404])
+
+        with self.assertRaises(RequestException):
+            client.get_content(server.url)
+
+        self.assertEqual(server.request_count, 1)
+        self.assertCounters(client, 0, 0, 1)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def set_last_used(self, page_cache, url, timestamp):
+        content_path, _ = page_cache._get_paths(url)
+        os.utime(content_path, (timestamp, timestamp))
+
+    def get_cached_urls(self, page_cache, urls):
+        return [url for url in urls if page_cache.get(url) is not None]
+
+    def test_round_trip(self):
+        page_cache = PageCache(self.cache_dir)
+        page_cache.put("http://stats/event/1", b"<html>1</html>", True, etag='"v1"', last_modified="Tue, 07 Mar 2017")
+
+        self.assertEqual(page_cache.get("http://stats/event/1"), {
+            "url": "http://stats/event/1", "finished": True, "etag": '"v1"', "last_modified": "Tue, 07 Mar 2017",
+            "content": b"<html>1</html>"})
+        self.assertIsNone(page_cache.get("http://stats/event/2"))
+
+    def test_least_recently_used_pages_are_evicted(self):
+        urls = ["http://stats/event/%s" % (index,) for index in range(4)]
+        page_cache = PageCache(self.cache_dir, max_bytes=30)
+
+        for index, url in enumerate(urls[:3]):
+            page_cache.put(url, b"0123456789", True)
+            self.set_last_used(page_cache, url, 1000000 + index)
+        self.assertEqual(page_cache.get_stats()["evictions"], 0)
+
+        # Reading a page marks it as used, so the second oldest page goes instead.
+        self.assertIsNotNone(page_cache.get(urls[0]))
+        page_cache.put(urls[3], b"0123456789", True)
+
+        self.assertEqual(self.get_cached_urls(page_cache, urls), [urls[0], urls[2], urls[3]])
+        self.assertEqual(page_cache.get_stats()["evictions"], 1)
+
+        # A page larger than the rest evicts as many of the least recently used pages as it needs.
+        for index, url in enumerate([urls[0], urls[2], urls[3]]):
+            self.set_last_used(page_cache, url, 1000000 + index)
+        page_cache.put(urls[1], b"0123456789" * 2, True)
+
+        self.assertEqual(self.get_cached_urls(page_cache, urls), [urls[1], urls[3]])
+        self.assertEqual(page_cache.get_stats()["evictions"], 3)
+
+    def test_corrupt_and_partial_files_are_misses(self):
+        page_cache = PageCache(self.cache_dir)
+        for index in range(3):
+            page_cache.put("http://stats/event/%s" % (index,), b"<html></html>", True)
+
+        content_path, metadata_path = page_cache._get_paths("http://stats/event/0")
+        with open(metadata_path, "w") as metadata_file:
+            metadata_file.write('{"url": "http://st')
+
+        content_path, metadata_path = page_cache._get_paths("http://stats/event/1")
+        os.remove(content_path)
+
+        content_path, metadata_path = page_cache._get_paths("http://stats/event/2")
+        os.remove(metadata_path)
+
+        # Leftovers of an interrupted write are not counted as cached pages.
+        with open(os.path.join(self.cache_dir, "leftover.tmp"), "wb") as temp_file:
+            temp_file.write(b"0123456789" * 10)
+        page_cache.max_bytes = 3 * len(b"<html></html>")
+        page_cache.evict()
+
+        for index in range(3):
+            self.assertIsNone(page_cache.get("http://stats/event/%s" % (index,)))
+        self.assertEqual(page_cache.get_stats()["evictions"], 0)
+
+        # Storing the page again replaces the broken files.
+        page_cache.put("http://stats/event/0", b"<html>0</html>", True)
+        self.assertEqual(page_cache.get("http://stats/event/0")["content"], b"<html>0</html>")
+
+    def test_running_event_pages_are_revalidated(self):
+        server = ScriptedStatusServer([200, 304, 304])
+        self.addCleanup(server.stop)
+
+        def reset_event_page_cache():
+            attendance_scraper._EVENT_PAGE_CACHE = None
+
+        reset_event_page_cache()
+        self.addCleanup(reset_event_page_cache)
+
+        with self.settings(SCRAPER_CACHE_DIR=self.cache_dir):
+            self.assertEqual(attendance_scraper.load_event_page(server.url), b"Status 200")
+            self.assertEqual(attendance_scraper.load_event_page(server.url), b"Status 200")
+            # Once the event is over the revalidated page is kept as finished and no longer requested.
+            self.assertEqual(attendance_scraper.load_event_page(server.url, event_finished=True), b"Status 200")
+            self.assertEqual(attendance_scraper.load_event_page(server.url, event_finished=True), b"Status 200")
+
+            page_cache = attendance_scraper.get_event_page_cache()
+
+        self.assertEqual(server.request_count, 3)
+        self.assertNotIn("If-None-Match", server.request_headers[0])
+        self.assertEqual([request_headers["If-None-Match"] for request_headers in server.request_headers[1:]],
+                         ['"v1"', '"v1"'])
+        self.assertTrue(page_cache.get(server.url)["finished"])
+        self.assertEqual(page_cache.get_stats(), {"hits": 1, "misses": 1, "revalidated": 2, "stores": 2,
+                                                  "evictions": 0})
+
+
+class RecordedGameHistory(object):
+    """Paged game history of the events on the recorded pages, newest first.
+
+    Leaving out the newest events and marking one as running gives the history as it looked some time before.
+    """
+
+    def __init__(self):
+        self.events = {}
+        self.page_size = 0
+        for page_path in sorted(glob.glob(os.path.join(STATS_PAGES_DIR, "game-history-*.html"))):
+            with open(page_path, "rb") as page_file:
+                page_events = attendance_scraper.get_events_from_history_page(page_file.read())
+
+            self.events.update(page_events)
+            self.page_size = max(self.page_size, len(page_events))
+
+        self.start_dts = sorted(self.events, reverse=True)
+        self.unlisted_count = 0
+        self.running_start_dt = None
+        self.loaded_page_numbers = []
+
+    def load_page(self, page_number):
+        self.loaded_page_numbers.append(page_number)
+
+        listed_start_dts = self.start_dts[self.unlisted_count:]
+        page_start_dts = listed_start_dts[(page_number - 1) * self.page_size:page_number * self.page_size]
+
+        page_events = {}
+        for start_dt in page_start_dts:
+            page_events[start_dt] = dict(self.events[start_dt])
+            if start_dt == self.running_start_dt:
+                page_events[start_dt].update({"end_dt": None, "finished": False})
+
+        return page_events
+
+    def pop_loaded_page_numbers(self):
+        loaded_page_numbers = self.loaded_page_numbers
+        self.loaded_page_numbers = []
+        return loaded_page_numbers
+
+
+class GameHistoryIndexTests(TestCase):
+    """Events found through the index must match the ones of the former scrape paging through the whole history.
+
+    """
+
+    def setUp(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        self.index_path = os.path.join(index_dir, "game-history-index.json")
+
+        self.history = RecordedGameHistory()
+
+    def get_dt(self, *dt_args):
+        return timezone.make_aware(datetime(*dt_args), pytz.utc)
+
+    def get_events_through_index(self, history_index, start_dt, end_dt):
+        """Find the events of the period through the index, and through the former scrape to compare.
+
+        :return: events of the period and history pages loaded by the index.
+        """
+        relevant_events = attendance_scraper.get_relevant_events(
+            history_index.get_events_between(start_dt, end_dt), start_dt, end_dt)
+        loaded_page_numbers = self.history.pop_loaded_page_numbers()
+
+        self.assertTrue(len(relevant_events) > 0)
+        self.assertEqual(relevant_events, attendance_scraper.get_relevant_events(
+            attendance_scraper.get_all_events_back_to(start_dt, self.history.load_page), start_dt, end_dt))
+        self.history.pop_loaded_page_numbers()
+
+        return relevant_events, loaded_page_numbers
+
+    def test_fresh_index(self):
+        for start_dt, end_dt, page_numbers in [
+                (self.get_dt(2017, 3, 5, 12, 0), self.get_dt(2017, 3, 13, 0, 0), [1, 2]),
+                (self.get_dt(2017, 3, 12, 18, 30), self.get_dt(2017, 3, 12, 21, 0), [1]),
+                (self.get_dt(2017, 3, 4, 0, 0), self.get_dt(2017, 3, 6, 0, 0), [1, 2])]:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+
+            _, loaded_page_numbers = self.get_events_through_index(
+                GameHistoryIndex(self.index_path, self.history.load_page), start_dt, end_dt)
+            self.assertEqual(loaded_page_numbers, page_numbers)
+
+    def test_new_events_between_runs(self):
+        start_dt = self.get_dt(2017, 3, 5, 12, 0)
+        end_dt = self.get_dt(2017, 3, 13, 0, 0)
+
+        # The two newest events have not happened yet, the one before is still running.
+        self.history.unlisted_count = 2
+        self.history.running_start_dt = self.history.start_dts[2]
+        _, loaded_page_numbers = self.get_events_through_index(
+            GameHistoryIndex(self.index_path, self.history.load_page), start_dt, end_dt)
+        self.assertEqual(loaded_page_numbers, [1, 2])
+
+        # The next run reads the persisted index and only loads the first page, which now holds the new events.
+        self.history.unlisted_count = 0
+        self.history.running_start_dt = None
+        history_index = GameHistoryIndex(self.index_path, self.history.load_page)
+        relevant_events, loaded_page_numbers = self.get_events_through_index(history_index, start_dt, end_dt)
+        self.assertEqual(loaded_page_numbers, [1])
+
+        # The event with too few players is left out.
+        self.assertEqual(len(relevant_events), 6)
+        self.assertTrue(all(event["finished"] for event in relevant_events.values()))
+
+    def test_extend_to_older_date(self):
+        history_index = GameHistoryIndex(self.index_path, self.history.load_page)
+
+        _, loaded_page_numbers = self.get_events_through_index(history_index, self.get_dt(2017, 3, 12, 18, 30),
+                                                               self.get_dt(2017, 3, 12, 21, 0))
+        self.assertEqual(loaded_page_numbers, [1])
+
+        _, loaded_page_numbers = self.get_events_through_index(history_index, self.get_dt(2017, 3, 5, 12, 0),
+                                                               self.get_dt(2017, 3, 13, 0, 0))
+        self.assertEqual(loaded_page_numbers, [1, 2])
+
+        # Reaching back beyond the oldest event stops at the empty page after the last one, once.
+        events = history_index.get_events_between(self.get_dt(2017, 1, 1, 0, 0), self.get_dt(2017, 3, 13, 0, 0))
+        self.assertEqual(sorted(events), sorted(self.history.start_dts))
+        self.assertEqual(self.history.pop_loaded_page_numbers(), [1, 3])
+
+        history_index = GameHistoryIndex(self.index_path, self.history.load_page)
+        history_index.get_events_between(self.get_dt(2017, 1, 1, 0, 0), self.get_dt(2017, 3, 13, 0, 0))
+        self.assertEqual(self.history.pop_loaded_page_numbers(), [1])
+
+
+class ScrapeJobTests(TestCase):
+    def setUp(self):
+        self.event_type = create_event_type()
+
+    def create_job(self, status, idle_time=timedelta()):
+        now = timezone.now()
+        job = ScrapeJob.objects.create(event_type=self.event_type, start_dt=now, end_dt=now, status=status)
+        ScrapeJob.objects.filter(pk=job.pk).update(modified=now - idle_time)
+
+        return job
+
+    def test_claim_next_claims_oldest_queued_job(self):
+        first_job = self.create_job(ScrapeJob.QUEUED)
+        second_job = self.create_job(ScrapeJob.QUEUED)
+
+        self.assertEqual(ScrapeJob.claim_next().pk, first_job.pk)
+        self.assertEqual(ScrapeJob.claim_next().pk, second_job.pk)
+        self.assertIsNone(ScrapeJob.claim_next())
+        self.assertEqual(ScrapeJob.objects.get(pk=first_job.pk).status, ScrapeJob.RUNNING)
+
+    def test_claim_next_fails_stale_running_jobs(self):
+        stale_job = self.create_job(ScrapeJob.RUNNING, ScrapeJob.RUNNING_TIMEOUT + timedelta(minutes=1))
+        active_job = self.create_job(ScrapeJob.RUNNING, ScrapeJob.RUNNING_TIMEOUT - timedelta(minutes=1))
+        old_finished_job = self.create_job(ScrapeJob.FINISHED, ScrapeJob.RUNNING_TIMEOUT * 2)
+
+        self.assertIsNone(ScrapeJob.claim_next())
+
+        stale_job = ScrapeJob.objects.get(pk=stale_job.pk)
+        self.assertEqual(stale_job.status, ScrapeJob.FAILED)
+        self.assertTrue(stale_job.is_done())
+        self.assertIsNotNone(stale_job.error)
+        self.assertEqual(ScrapeJob.objects.get(pk=active_job.pk).status, ScrapeJob.RUNNING)
+        self.assertEqual(ScrapeJob.objects.get(pk=old_finished_job.pk).status, ScrapeJob.FINISHED)
+
+
+class ScrapeImportTests(TestCase):
+    def setUp(self):
+        self.event_type = create_event_type()
+        self.recruit_rank = Rank.objects.create(name="Rct")
+        self.gnt_rank = Rank.objects.create(name="Gnt")
+
+    def import_attendances(self, day, raw_usernames):
+        start_dt = timezone.make_aware(datetime(2017, 3, day, 20, 0), timezone.get_default_timezone())
+        scrape_result = {raw_username: 0.5 for raw_username in raw_usernames}
+
+        return import_scraped_attendances(self.event_type, start_dt, start_dt + timedelta(hours=2), scrape_result,
+                                          {"minutes": 120, "average_attendance": 0.5})
+
+    def test_resolve_members_matches_names_case_insensitively(self):
+        member = Member.objects.create(name="Spartak", rank=self.gnt_rank)
+        Member.objects.create(name="Chypsa", rank=self.gnt_rank, discharged=True)
+
+        members = resolve_members_for_raw_usernames(["Spartak [CNTO-Gnt]", "spartak", "Chypsa [CNTO-Gnt]", " "])
+
+        self.assertEqual(members["Spartak [CNTO-Gnt]"].pk, member.pk)
+        self.assertEqual(members["spartak"].pk, member.pk)
+        self.assertNotIn(" ", members)
+
+        # Discharged members are not matched, a new recruit takes their name.
+        recruit = members["Chypsa [CNTO-Gnt]"]
+        self.assertEqual(recruit.rank_id, self.recruit_rank.pk)
+        self.assertFalse(recruit.discharged)
+
+        self.assertEqual(MemberAlias.objects.get(key="spartak").member_id, member.pk)
+        self.assertEqual(MemberAlias.objects.get(key="chypsa").member_id, recruit.pk)
+
+    def test_merged_names_resolve_to_merged_member(self):
+        member = Member.objects.create(name="Spartak", rank=self.gnt_rank, join_date=date(2017, 1, 1))
+        duplicate = resolve_members_for_raw_usernames(["Sparta [CNTO-Rct]"])["Sparta [CNTO-Rct]"]
+
+        member.merge_from(duplicate)
+
+        members = resolve_members_for_raw_usernames(["Sparta [CNTO-Rct]", "SPARTAK"])
+        self.assertEqual(members["Sparta [CNTO-Rct]"].pk, member.pk)
+        self.assertEqual(members["SPARTAK"].pk, member.pk)
+        self.assertEqual(Member.objects.filter(name__iexact="sparta", deleted=False).count(), 0)
+
+    def test_import_query_count_is_constant(self):
+        def raw_usernames(first_index, last_index):
+            return ["Player%03d [CNTO-Rct]" % (index,) for index in range(first_index, last_index)]
+
+        for index in range(20):
+            Member.objects.create(name="player%03d" % (index,), rank=self.gnt_rank)
+
+        # Both imports match some existing members by name and create recruits for the others.
+        with CaptureQueriesContext(connection) as few_names_queries:
+            self.import_attendances(1, raw_usernames(18, 23))
+
+        with self.assertNumQueries(len(few_names_queries)):
+            self.import_attendances(2, raw_usernames(0, 40))
+
+        # All names are known aliases now.
+        with CaptureQueriesContext(connection) as few_aliased_names_queries:
+            self.import_attendances(3, raw_usernames(18, 23))
+
+        with self.assertNumQueries(len(few_aliased_names_queries)):
+            self.import_attendances(4, raw_usernames(0, 40))
+
+        self.assertEqual(Member.objects.filter(name__istartswith="player").count(), 40)
+        self.assertEqual(Attendance.objects.filter(event__start_dt__day=4).count(), 40)
+
+
+class AttendancePollerTests(TransactionTestCase):
+    """Samples players from a local fake A2S server.
+
+    The poller closes stale database connections before flushing, which a TestCase transaction does not survive.
+    """
+
+    def setUp(self):
+        create_event_type("Unknown")
+        Rank.objects.create(name="Rct")
+        self.gnt_rank = Rank.objects.create(name="Gnt")
+
+        self.server = FakeA2SServer(["Spartak [CNTO-Gnt]", "Chypsa [CNTO-Gnt]"]).start()
+        self.poller = AttendancePoller(self.server.address, 30, "Unknown", 20)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def flush_at(self, dt):
+        self.poller.last_sample_dt = dt
+        return self.poller.flush()
+
+    def test_samples_are_accumulated_and_flushed(self):
+        spartak = Member.objects.create(name="Spartak", rank=self.gnt_rank)
+
+        self.assertEqual(self.poller.sample(), 2)
+        self.assertEqual(self.poller.sample(), 2)
+        self.server.set_player_names(["Spartak [CNTO-Gnt]"])
+        self.assertEqual(self.poller.sample(), 1)
+
+        self.assertEqual(self.poller.presence_seconds, {"Spartak [CNTO-Gnt]": 90, "Chypsa [CNTO-Gnt]": 60})
+        # The querier is reused, every sample sends one player list request after the first challenge.
+        self.assertEqual(self.server.player_request_count, 3)
+
+        self.assertEqual(self.flush_at(datetime(2017, 3, 7, 20, 30)), 2)
+        self.assertEqual(self.poller.presence_seconds, {})
+        self.assertEqual(self.flush_at(datetime(2017, 3, 7, 20, 31)), 0)
+
+        self.poller.sample()
+        self.assertEqual(self.flush_at(datetime(2017, 3, 7, 20, 45)), 1)
+
+        event = Event.objects.get()
+        self.assertEqual(event.duration_minutes, 45)
+        self.assertEqual(Attendance.objects.get(event=event, member=spartak).attendance_seconds, 120)
+        self.assertEqual(Attendance.objects.get(event=event, member__name="Chypsa").attendance_seconds, 60)
+
+    def test_failed_sample_reopens_querier(self):
+        self.poller.sample()
+        failing_server = self.poller._server
+        self.server.stop()
+        failing_server.timeout = 0.2
+
+        with self.assertRaises(Exception):
+            self.poller.sample()
+
+        self.assertIsNone(self.poller._server)
+        self.assertEqual(self.poller.presence_seconds, {"Spartak [CNTO-Gnt]": 30, "Chypsa [CNTO-Gnt]": 30})
+
+        self.server = FakeA2SServer(["Spartak [CNTO-Gnt]"], port=self.server.address[1]).start()
+        self.assertEqual(self.poller.sample(), 1)
+
+    def test_late_flush_does_not_shorten_event(self):
+        event = update_current_event(300, dt=datetime(2017, 3, 7, 21, 0))
+        self.assertEqual(event.duration_minutes, 65)
+
+        event = update_current_event(300, dt=datetime(2017, 3, 7, 20, 30))
+        self.assertEqual(event.duration_minutes, 65)
+        self.assertEqual(Event.objects.get(pk=event.pk).duration_minutes, 65)
+
+
+class ConcurrentAttendanceUpdateTests(TransactionTestCase):
+    def setUp(self):
+        create_event_type("Unknown")
+        Rank.objects.create(name="Rct")
+        gnt_rank = Rank.objects.create(name="Gnt")
+
+        for name in ["Spartak", "Chypsa"]:
+            Member.objects.create(name=name, rank=gnt_rank)
+
+    def add_attendance_seconds_concurrently(self, event, attendance_seconds_by_raw_username, call_count=2):
+        """Start the calls together, each from its own thread and database connection.
+
+        :return: exceptions raised by the calls.
+        """
+        start_barrier = threading.Barrier(call_count)
+        errors = []
+
+        def add_seconds():
+            try:
+                start_barrier.wait()
+                add_attendance_seconds(event, attendance_seconds_by_raw_username)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_seconds) for _ in range(call_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return errors
+
+    def test_overlapping_updates_add_up(self):
+        event = update_current_event(300, dt=datetime(2017, 3, 7, 21, 0))
+        attendance_seconds_by_raw_username = {"Spartak [CNTO-Gnt]": 300, "Chypsa [CNTO-Gnt]": 120}
+
+        # The first round inserts the attendances, the later rounds increment them.
+        for _ in range(3):
+            self.assertEqual(self.add_attendance_seconds_concurrently(event, attendance_seconds_by_raw_username), [])
+
+        self.assertEqual(Attendance.objects.filter(event=event).count(), 2)
+        self.assertEqual(Attendance.objects.get(event=event, member__name="Spartak").attendance_seconds, 6 * 300)
+        self.assertEqual(Attendance.objects.get(event=event, member__name="Chypsa").attendance_seconds, 6 * 120)
+
+
+class ReportInvalidationTests(TransactionTestCase):
+    """Report cache versions are bumped once the change is committed, snapshots are marked stale in its transaction.
+
+    """
+
+    def setUp(self):
+        self.event_type = create_event_type()
+        self.rank = Rank.objects.create(name="Gnt")
+        self.member = Member.objects.create(name="Spartak", rank=self.rank, join_date=date(2017, 1, 1))
+        self.snapshot = ReportSnapshot.objects.create(month=date(2017, 3, 1), stale=False)
+
+    def get_versions(self):
+        return _get_versions(get_report_cache(), [ALL_REPORTS_VERSION_NAME, "2017-02", "2017-03", "2017-04"])
+
+    def assert_bumped(self, versions_before, version_names):
+        versions = self.get_versions()
+        for version_name, version in versions.items():
+            if version_name in version_names:
+                self.assertGreater(version, versions_before[version_name], version_name)
+            else:
+                self.assertEqual(version, versions_before[version_name], version_name)
+
+    def is_snapshot_stale(self):
+        return ReportSnapshot.objects.get(pk=self.snapshot.pk).stale
+
+    def test_event_changes_bump_versions_after_commit(self):
+        start_dt = timezone.make_aware(datetime(2017, 3, 7, 20, 0), timezone.get_default_timezone())
+        versions = self.get_versions()
+
+        with transaction.atomic():
+            event = Event.objects.create(name="Training", event_type=self.event_type, start_dt=start_dt,
+                                         end_dt=start_dt + timedelta(hours=2), duration_minutes=120)
+            Attendance.objects.create(event=event, member=self.member, attendance_seconds=3600)
+
+            self.assert_bumped(versions, [])
+            self.assertTrue(self.is_snapshot_stale())
+
+        self.assert_bumped(versions, ["2017-03"])
+
+        # Moving the event invalidates the month it left and the month it moved to.
+        versions = self.get_versions()
+        event.start_dt = start_dt + timedelta(days=30)
+        event.end_dt = event.start_dt + timedelta(hours=2)
+        event.save()
+        self.assert_bumped(versions, ["2017-03", "2017-04"])
+
+        versions = self.get_versions()
+        event.delete()
+        self.assert_bumped(versions, ["2017-04"])
+
+    def test_rolled_back_changes_keep_versions(self):
+        versions = self.get_versions()
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Absence.objects.create(member=self.member, absence_type=AbsenceType.objects.create(name="LOA"),
+                                       start_date=date(2017, 3, 10), end_date=date(2017, 3, 12))
+                self.member.save()
+
+                raise ValueError()
+
+        self.assert_bumped(versions, [])
+        self.assertFalse(self.is_snapshot_stale())
+
+    def test_absence_changes_bump_versions(self):
+        absence_type = AbsenceType.objects.create(name="LOA")
+
+        versions = self.get_versions()
+        absence = Absence.objects.create(member=self.member, absence_type=absence_type, start_date=date(2017, 3, 10),
+                                         end_date=date(2017, 3, 12))
+        self.assert_bumped(versions, ["2017-03"])
+
+        # A day of margin reaches into the neighbouring month.
+        versions = self.get_versions()
+        absence.end_date = date(2017, 3, 31)
+        absence.save()
+        self.assert_bumped(versions, ["2017-03", "2017-04"])
+
+        versions = self.get_versions()
+        absence.delete()
+        self.assert_bumped(versions, ["2017-03", "2017-04"])
+
+    def test_attendance_save_queries(self):
+        timezone_info = timezone.get_default_timezone()
+        events = []
+        for event_start_dt in [datetime(2017, 3, 7, 20, 0), datetime(2017, 4, 7, 20, 0)]:
+            event_start_dt = timezone.make_aware(event_start_dt, timezone_info)
+            events.append(Event.objects.create(name="Training", event_type=self.event_type, start_dt=event_start_dt,
+                                               end_dt=event_start_dt + timedelta(hours=2), duration_minutes=120))
+        april_snapshot = ReportSnapshot.objects.create(month=date(2017, 4, 1), stale=False)
+        ReportSnapshot.objects.update(stale=False)
+
+        # The insert and the snapshots of the month.
+        versions = self.get_versions()
+        with self.assertNumQueries(2):
+            attendance = Attendance.objects.create(event=events[0], member=self.member, attendance_seconds=3600)
+        self.assert_bumped(versions, ["2017-03"])
+        self.assertTrue(self.is_snapshot_stale())
+        self.assertEqual((attendance.attendance_ratio, attendance.adequate), (0.5, False))
+
+        ReportSnapshot.objects.update(stale=False)
+        attendance = Attendance.objects.select_related("event__event_type").get(pk=attendance.pk)
+        attendance.attendance_seconds = 5400
+        versions = self.get_versions()
+        with self.assertNumQueries(2):
+            attendance.save()
+        self.assert_bumped(versions, ["2017-03"])
+        self.assertTrue(self.is_snapshot_stale())
+        self.assertEqual(Attendance.objects.filter(pk=attendance.pk, attendance_ratio=0.75, adequate=True).count(),
+                         1)
+
+        # Moving the attendance to another event looks up the event it was stored with.
+        ReportSnapshot.objects.update(stale=False)
+        attendance.event = events[1]
+        versions = self.get_versions()
+        with self.assertNumQueries(4):
+            attendance.save()
+        self.assert_bumped(versions, ["2017-03", "2017-04"])
+        self.assertTrue(self.is_snapshot_stale())
+        self.assertTrue(ReportSnapshot.objects.get(pk=april_snapshot.pk).stale)
+
+        ReportSnapshot.objects.update(stale=False)
+        with self.assertNumQueries(2):
+            attendance.save()
+        self.assertFalse(self.is_snapshot_stale())
+
+
+class FrozenMonthReportTests(TestCase):
+    """Snapshots of frozen months must follow roster and event type changes.
+
+    """
+
+    def setUp(self):
+        self.event_type = create_event_type("Training", 0.5)
+        self.rank = Rank.objects.create(name="Gnt")
+        self.group = MemberGroup.objects.create(name="Alpha")
+        self.member = Member.objects.create(name="Spartak", rank=self.rank, member_group=self.group,
+                                            join_date=date(2017, 1, 1))
+
+        start_dt = timezone.make_aware(datetime(2017, 3, 7, 20, 0), timezone.get_default_timezone())
+        event = Event.objects.create(name="Training", event_type=self.event_type, start_dt=start_dt,
+                                     end_dt=start_dt + timedelta(hours=2), duration_minutes=120)
+        Attendance.objects.create(event=event, member=self.member, attendance_seconds=4320)
+
+        # Freezes the month.
+        self.assertEqual(self.get_attendances(), {"Alpha": {"Spartak": ["X"]}})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_attendances(), {"Alpha": {"Spartak": ["X"]}})
+
+    def get_attendances(self):
+        context = get_report_context_for_month(2017, 3)
+        return {
+            group_name: {
+                member_name: member_attendances["attendances"]
+                for member_name, member_attendances in group_attendances.items()
+            } for group_name, group_attendances in context["attendances"].items()
+        }
+
+    def test_member_changes(self):
+        self.member.name = "Chypsa"
+        self.member.save()
+        self.assertEqual(self.get_attendances(), {"Alpha": {"Chypsa": ["X"]}})
+
+        self.member.member_group = MemberGroup.objects.create(name="Bravo")
+        self.member.save()
+        self.assertEqual(self.get_attendances(), {"Alpha": {}, "Bravo": {"Chypsa": ["X"]}})
+
+        self.group.delete()
+        self.assertEqual(self.get_attendances(), {"Bravo": {"Chypsa": ["X"]}})
+
+    def test_event_type_changes(self):
+        self.event_type.minimum_required_attendance_ratio = 0.75
+        self.event_type.save()
+
+        self.assertEqual(self.get_attendances(), {"Alpha": {"Spartak": ["?"]}})
+
+
+class CalendarEventTests(TestCase):
+    """Calendar entries must match the ones the event browser built from Event.get_stats of every event.
+
+    """
+
+    def setUp(self):
+        get_report_cache().clear()
+        self.timezone_info = timezone.get_default_timezone()
+
+        rank = Rank.objects.create(name="Gnt")
+        absence_type = AbsenceType.objects.create(name="LOA")
+        members = [
+            Member.objects.create(name="Spartak", rank=rank, join_date=date(2017, 1, 1)),
+            Member.objects.create(name="Deleted", rank=rank, join_date=date(2017, 1, 1), deleted=True),
+            Member.objects.create(name="Discharged", rank=rank, join_date=date(2017, 1, 1), discharged=True),
+            Member.objects.create(name="Absent", rank=rank, join_date=date(2017, 1, 1)),
+        ]
+        Absence.objects.create(member=members[3], absence_type=absence_type, start_date=date(2017, 2, 1),
+                               end_date=date(2017, 4, 30))
+
+        # Events around midnight at the ends of March, on another date or in another month in UTC.
+        event_types = [create_event_type("Training", 0.5), create_event_type("Campaign", 0.75)]
+        self.events = []
+        for index, (event_start_dt, attendance_seconds) in enumerate([
+                (datetime(2017, 2, 28, 23, 30), [7200, 3600]),
+                (datetime(2017, 3, 1, 0, 0), [7200, 7200, 1800, 0]),
+                (datetime(2017, 3, 15, 20, 0), []),
+                (datetime(2017, 3, 31, 23, 30), [3600, None, 5400, 7200]),
+                (datetime(2017, 4, 1, 0, 30), [None, 7200])]):
+            event_start_dt = timezone.make_aware(event_start_dt, self.timezone_info)
+            event = Event.objects.create(name="Event%s" % (index,), event_type=event_types[index % 2],
+                                         start_dt=event_start_dt, end_dt=event_start_dt + timedelta(hours=2),
+                                         duration_minutes=120)
+            self.events.append(event)
+
+            for member, seconds in zip(members, attendance_seconds):
+                if seconds is not None:
+                    Attendance.objects.create(event=event, member=member, attendance_seconds=seconds)
+
+    def get_dt(self, *dt_args):
+        return timezone.make_aware(datetime(*dt_args), self.timezone_info)
+
+    def get_calendar_events_per_event(self, events):
+        calendar_events = []
+        for event in events:
+            stats = event.get_stats()
+            calendar_events.append({
+                "title": "\n%s minutes\n%.2f %% attendance\n%s players" % (
+                    event.duration_minutes, stats["average_attendance"] * 100.0, stats["player_count"]),
+                "start": event.start_dt.astimezone(self.timezone_info).strftime("%Y-%m-%d %H:%M"),
+                "end": event.end_dt.astimezone(self.timezone_info).strftime("%Y-%m-%d %H:%M"),
+                "className": event.event_type.css_class_name,
+                "allDay": False,
+            })
+
+        return calendar_events
+
+    def test_entries_match_event_stats(self):
+        for start_dt, end_dt, event_indexes in [
+                (self.get_dt(2017, 3, 1), self.get_dt(2017, 4, 1), [1, 2, 3]),
+                # Week views of the calendar cross month boundaries.
+                (self.get_dt(2017, 2, 26), self.get_dt(2017, 3, 5), [0, 1]),
+                (self.get_dt(2017, 3, 26), self.get_dt(2017, 4, 2), [3, 4]),
+                (self.get_dt(2017, 2, 1), self.get_dt(2017, 5, 1), [0, 1, 2, 3, 4]),
+                (self.get_dt(2017, 3, 16), self.get_dt(2017, 3, 31), [])]:
+            self.assertEqual(get_calendar_events(start_dt, end_dt), self.get_calendar_events_per_event(
+                [self.events[event_index] for event_index in event_indexes]), (start_dt, end_dt))
+
+        # Attendances of deleted, discharged and absent members are counted.
+        self.assertEqual(get_calendar_events(self.get_dt(2017, 3, 1), self.get_dt(2017, 3, 2))[0]["title"],
+                         "\n120 minutes\n56.25 % attendance\n4 players")
+
+    def test_query_counts(self):
+        # One query per month of the window, none once the months are cached.
+        with self.assertNumQueries(2):
+            calendar_events = get_calendar_events(self.get_dt(2017, 3, 26), self.get_dt(2017, 4, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_calendar_events(self.get_dt(2017, 3, 26), self.get_dt(2017, 4, 2)), calendar_events)
+
+        with self.assertNumQueries(1):
+            get_calendar_events(self.get_dt(2017, 2, 26), self.get_dt(2017, 4, 2))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_calendar_events(self.get_dt(2017, 3, 1), self.get_dt(2017, 3, 1)), [])
+
+
+class SummaryDataTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+
+    def test_date_range(self):
+        response = self.client.get(reverse("get-summary-data"), {"from": "2017-03-01", "to": "2017-03-31"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("event-data", json.loads(response.content.decode("utf-8")))
+
+    def test_malformed_dates(self):
+        for parameters in [{"from": "2017-13-01"}, {"to": "yesterday"}, {"from": "2017-03-01", "to": ""}]:
+            response = self.client.get(reverse("get-summary-data"), parameters)
+
+            self.assertEqual(response.status_code, 400, parameters)
+            self.assertFalse(json.loads(response.content.decode("utf-8"))["success"])
+
+
+class MonthDownloadTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+
+        self.group = MemberGroup.objects.create(name="Alpha")
+
+    def test_event_browser_offers_downloads(self):
+        response = self.client.get(reverse("event-browser"))
+
+        self.assertContains(response, 'id="group-%s" class="download-selector"' % (self.group.pk,))
+        self.assertContains(response, 'class="download-all-selector"')
+
+    def test_downloads(self):
+        response = self.client.get(reverse("download-group-month-csv", args=["2017-03-01", self.group.pk]))
+        self.assertEqual(response["Content-Type"], "text/csv")
+
+        response = self.client.get(reverse("download-month-zip", args=["2017-03-01"]))
+        self.assertEqual(response["Content-Type"], "application/zip")
+
+
+class IntervalIndexTests(TestCase):
+    """IntervalIndex must answer like a scan over all intervals.
+
+    """
+
+    INTERVALS = [
+        ("single", 5, 5),
+        ("overlapping", 1, 4), ("overlapping", 3, 7), ("overlapping", 6, 6),
+        ("adjacent", 2, 3), ("adjacent", 4, 5), ("adjacent", 9, 12),
+        ("nested", 1, 12), ("nested", 3, 4),
+        ("gap", 1, 2), ("gap", 4, 5), ("gap", 8, 8),
+        ("reversed", 6, 3),
+    ]
+
+    def scan_contains(self, key, point):
+        return any(interval_key == key and start <= point <= end for interval_key, start, end in self.INTERVALS)
+
+    def scan_overlaps(self, key, start, end):
+        # Reversed intervals contain nothing, so they overlap nothing either.
+        return any(interval_key == key and interval_start <= interval_end and interval_start <= end and
+                   interval_end >= start for interval_key, interval_start, interval_end in self.INTERVALS)
+
+    def test_matches_scan(self):
+        interval_index = IntervalIndex(self.INTERVALS)
+        keys = set(key for key, _, _ in self.INTERVALS) | set(["missing"])
+
+        for key in keys:
+            for point in range(0, 14):
+                self.assertEqual(interval_index.contains(key, point), self.scan_contains(key, point), (key, point))
+
+                for end in range(point, 14):
+                    self.assertEqual(interval_index.overlaps(key, point, end), self.scan_overlaps(key, point, end),
+                                     (key, point, end))
+
+        for point in range(0, 14):
+            self.assertEqual(interval_index.keys_containing(point),
+                             set(key for key in keys if self.scan_contains(key, point)), point)
+
+    def test_empty(self):
+        interval_index = IntervalIndex()
+
+        self.assertFalse(interval_index.contains("single", 5))
+        self.assertFalse(interval_index.overlaps("single", 0, 10))
+        self.assertEqual(interval_index.keys_containing(5), set())
+
+
+class AbsenceIndexTests(TestCase):
+    """Absence.build_index must find the absences the date queries find.
+
+    """
+
+    def setUp(self):
+        rank = Rank.objects.create(name="Gnt")
+        absence_type = AbsenceType.objects.create(name="LOA")
+        self.members = []
+        for name, absence_dates in [
+                ("Single day", [(date(2017, 3, 10), date(2017, 3, 10), False)]),
+                ("Overlapping", [(date(2017, 3, 1), date(2017, 3, 10), False),
+                                 (date(2017, 3, 8), date(2017, 3, 15), False)]),
+                ("Adjacent", [(date(2017, 2, 27), date(2017, 3, 4), False),
+                              (date(2017, 3, 5), date(2017, 3, 5), False)]),
+                ("Deleted", [(date(2017, 3, 1), date(2017, 3, 20), True),
+                             (date(2017, 3, 12), date(2017, 3, 13), False)]),
+                ("Never absent", [])]:
+            member = Member.objects.create(name=name, rank=rank, join_date=date(2017, 1, 1))
+            self.members.append(member)
+
+            for start_date, end_date, deleted in absence_dates:
+                Absence.objects.create(member=member, absence_type=absence_type, start_date=start_date,
+                                       end_date=end_date, deleted=deleted)
+
+        self.dates = [date(2017, 2, 25) + timedelta(days=days) for days in range(25)]
+
+    def test_contains_matches_queries(self):
+        with self.assertNumQueries(1):
+            absence_index = Absence.build_index()
+
+        for member in self.members:
+            for day in self.dates:
+                self.assertEqual(absence_index.contains(member.pk, day), Absence.objects.filter(
+                    member=member, start_date__lte=day, end_date__gte=day, deleted=False).exists(), (member.name, day))
+
+    def test_overlaps_matches_queries(self):
+        absence_index = Absence.build_index()
+
+        for member in self.members:
+            for start_index, start_date in enumerate(self.dates):
+                for end_date in self.dates[start_index:start_index + 4]:
+                    self.assertEqual(absence_index.overlaps(member.pk, start_date, end_date), Absence.objects.filter(
+                        member=member, start_date__lte=end_date, end_date__gte=start_date, deleted=False).exists(),
+                        (member.name, start_date, end_date))
+
+    def test_given_absences(self):
+        absence_index = Absence.build_index(Absence.objects.filter(start_date__gte=date(2017, 3, 1)))
+
+        self.assertFalse(absence_index.contains(self.members[2].pk, date(2017, 3, 4)))
+        self.assertTrue(absence_index.contains(self.members[2].pk, date(2017, 3, 5)))
+        # Deleted absences are only left out by the default queryset.
+        self.assertTrue(absence_index.contains(self.members[3].pk, date(2017, 3, 5)))
+
+
+class AbsenceStatusTests(TestCase):
+    def setUp(self):
+        rank = Rank.objects.create(name="Gnt")
+        absence_type = AbsenceType.objects.create(name="LOA")
+        today = timezone.now().date()
+
+        self.members = []
+        for name, absence_dates, absence_fields in [
+                ("Active", (today - timedelta(days=3), today + timedelta(days=3)), {}),
+                ("Starting today", (today, today + timedelta(days=3)), {}),
+                ("Ending today", (today - timedelta(days=3), today), {}),
+                ("Expired", (today - timedelta(days=10), today - timedelta(days=1)), {}),
+                ("Upcoming", (today + timedelta(days=1), today + timedelta(days=10)), {}),
+                ("Deleted", (today - timedelta(days=3), today + timedelta(days=3)), {"deleted": True}),
+                ("Concluded", (today - timedelta(days=3), today + timedelta(days=3)), {"concluded": True}),
+                ("Never absent", None, {})]:
+            member = Member.objects.create(name=name, rank=rank, join_date=date(2017, 1, 1))
+            self.members.append(member)
+
+            if absence_dates is not None:
+                Absence.objects.create(member=member, absence_type=absence_type, start_date=absence_dates[0],
+                                       end_date=absence_dates[1], **absence_fields)
+
+        # An expired absence does not hide an active one of the same member.
+        Absence.objects.create(member=self.members[0], absence_type=absence_type,
+                               start_date=today - timedelta(days=30), end_date=today - timedelta(days=20))
+
+    def test_flags(self):
+        with self.assertNumQueries(1):
+            Member.attach_absence_status(self.members)
+
+        self.assertEqual([member.name for member in self.members if member.is_absent()],
+                         ["Active", "Starting today", "Ending today"])
+
+        for member in self.members:
+            self.assertEqual(member.currently_absent, Member.objects.get(pk=member.pk).is_absent(), member.name)
+
+
+class AttendanceMatrixTests(TestCase):
+    """The matrix must agree with Attendance.get_attendance_ratio and Attendance.was_adequate on every attendance.
+
+    """
+
+    def setUp(self):
+        rank = Rank.objects.create(name="Gnt")
+        event_types = [create_event_type("Training", 0.5), create_event_type("Campaign", 0.75),
+                       create_event_type("Social", 0.0)]
+
+        self.members = [Member.objects.create(name="Member%s" % (index,), rank=rank, join_date=date(2017, 1, 1))
+                        for index in range(4)]
+
+        start_dt = timezone.make_aware(datetime(2017, 3, 7, 20, 0), timezone.get_default_timezone())
+        self.events = []
+        for index, duration in enumerate([timedelta(hours=2), timedelta(hours=3), timedelta(), timedelta(hours=1)]):
+            event_start_dt = start_dt + timedelta(days=index)
+            self.events.append(Event.objects.create(
+                name="Event%s" % (index,), event_type=event_types[index % len(event_types)], start_dt=event_start_dt,
+                end_dt=event_start_dt + duration, duration_minutes=duration.total_seconds() / 60))
+
+        # Ratios around the minimums, beyond the event duration, zero and missing attendances.
+        attendance_seconds = [[3600, 8100, 600, None],
+                              [3601, 10800, 0, 0],
+                              [None, 20000, None, 60],
+                              [7200, None, 3600, 3600]]
+        for member, member_attendance_seconds in zip(self.members, attendance_seconds):
+            for event, seconds in zip(self.events, member_attendance_seconds):
+                if seconds is not None:
+                    Attendance.objects.create(member=member, event=event, attendance_seconds=seconds)
+
+        self.matrix = AttendanceMatrix(self.members, Event.objects.filter(
+            pk__in=[event.pk for event in self.events]).order_by("start_dt").select_related("event_type"))
+
+    def test_ratios_and_adequacy_match(self):
+        attendance_ratios = self.matrix.get_attendance_ratios()
+        adequacy = self.matrix.get_adequacy()
+
+        attendances = Attendance.objects.filter(member__in=self.members).select_related("event__event_type")
+        self.assertEqual(int(self.matrix.attended.sum()), attendances.count())
+
+        for attendance in attendances:
+            member_index = self.matrix.member_indices[attendance.member_id]
+            event_index = self.matrix.event_indices[attendance.event_id]
+
+            self.assertAlmostEqual(attendance_ratios[member_index, event_index], attendance.get_attendance_ratio())
+            self.assertEqual(bool(adequacy[member_index, event_index]), attendance.was_adequate())
+            self.assertEqual(bool(adequacy[member_index, event_index]), attendance.adequate)
+
+    def test_counts_match(self):
+        for member, adequate_count, attended_count in zip(self.members, self.matrix.get_adequate_counts(),
+                                                          self.matrix.get_attended_counts()):
+            self.assertEqual(adequate_count, Attendance.objects.filter(member=member, adequate=True).count())
+            self.assertEqual(attended_count, Attendance.objects.filter(member=member).count())
+            self.assertEqual(self.matrix.get_adequate_count(member), adequate_count)
+
+        for event, attendance_count, average_ratio in zip(self.events, self.matrix.get_event_attendance_counts(),
+                                                          self.matrix.get_event_average_ratios()):
+            attendances = list(Attendance.objects.filter(event=event))
+            self.assertEqual(attendance_count, len(attendances))
+            self.assertAlmostEqual(average_ratio, sum(attendance.get_attendance_ratio()
+                                                      for attendance in attendances) / len(attendances))
+
+    def test_adequate_counts_within_periods(self):
+        first_event, second_event, _, last_event = self.events
+        periods = [(first_event.start_dt, first_event.start_dt), (second_event.start_dt, last_event.start_dt),
+                   (first_event.start_dt, last_event.start_dt - timedelta(seconds=1)),
+                   (last_event.start_dt, last_event.start_dt)]
+
+        adequate_counts = self.matrix.get_adequate_counts_within(*zip(*periods))
+
+        for member, adequate_count, (start_dt, end_dt) in zip(self.members, adequate_counts, periods):
+            self.assertEqual(adequate_count, Attendance.objects.filter(
+                member=member, adequate=True, event__start_dt__gte=start_dt, event__start_dt__lte=end_dt).count())
+
+
+class PeriodAdequacyTests(TestCase):
+    """Attendance.was_adequate_for_period_batch must give the results of was_adequate_for_period for every member.
+
+    """
+
+    def setUp(self):
+        timezone_info = timezone.get_default_timezone()
+        self.start_dt = timezone.make_aware(datetime(2017, 3, 1), timezone_info)
+        self.end_dt = timezone.make_aware(datetime(2017, 3, 31, 23, 59), timezone_info)
+
+        training_event_type = create_event_type("Training", 0.5)
+        campaign_event_type = create_event_type("Campaign", 0.5)
+        self.rank = Rank.objects.create(name="Gnt")
+        self.absence_type = AbsenceType.objects.create(name="LOA")
+
+        for index in range(8):
+            event_start_dt = self.start_dt + timedelta(days=3 * index, hours=20)
+            Event.objects.create(name="Event%s" % (index,), event_type=[training_event_type, campaign_event_type][
+                index % 2], start_dt=event_start_dt, end_dt=event_start_dt + timedelta(hours=2), duration_minutes=120)
+
+        self.events = Event.all_for_time_period(self.start_dt, self.end_dt)
+
+    def create_member(self, name, adequate_event_count, inadequate_event_count=0, join_date=date(2017, 1, 1),
+                      absence_dates=None, absence_deleted=False):
+        member = Member.objects.create(name=name, rank=self.rank, join_date=join_date)
+
+        events = list(self.events.order_by("start_dt"))
+        for event in events[:adequate_event_count]:
+            Attendance.objects.create(member=member, event=event, attendance_seconds=7200)
+        for event in events[adequate_event_count:adequate_event_count + inadequate_event_count]:
+            Attendance.objects.create(member=member, event=event, attendance_seconds=0)
+
+        if absence_dates is not None:
+            Absence.objects.create(member=member, absence_type=self.absence_type, start_date=absence_dates[0],
+                                   end_date=absence_dates[1], deleted=absence_deleted)
+
+        return member
+
+    def create_roster(self, name_prefix=""):
+        return [
+            self.create_member(name_prefix + "Regular", 4),
+            self.create_member(name_prefix + "Once", 1),
+            self.create_member(name_prefix + "Mostly inadequate", 1, 3),
+            self.create_member(name_prefix + "Zero attendance", 0, 3),
+            self.create_member(name_prefix + "Never attended", 0),
+            self.create_member(name_prefix + "New", 0, join_date=date(2017, 3, 15)),
+            self.create_member(name_prefix + "Absent over start", 0,
+                               absence_dates=(date(2017, 2, 20), date(2017, 3, 2))),
+            self.create_member(name_prefix + "Absent over end", 0, absence_dates=(date(2017, 3, 30), date(2017, 4, 5))),
+            self.create_member(name_prefix + "Absent inside", 0, absence_dates=(date(2017, 3, 10), date(2017, 3, 12))),
+            self.create_member(name_prefix + "Absent throughout", 0,
+                               absence_dates=(date(2017, 2, 1), date(2017, 4, 30))),
+            self.create_member(name_prefix + "Absence deleted", 0, absence_dates=(date(2017, 3, 10), date(2017, 3, 12)),
+                               absence_deleted=True),
+            self.create_member(name_prefix + "Absent before", 0, absence_dates=(date(2017, 2, 1), date(2017, 2, 27))),
+        ]
+
+    def test_batch_matches_per_member(self):
+        members = self.create_roster()
+
+        for min_total_events in [0, 1, 3, 5]:
+            for adequate_if_absent in [False, True]:
+                results = Attendance.was_adequate_for_period_batch(members, self.events, self.start_dt, self.end_dt,
+                                                                   min_total_events=min_total_events,
+                                                                   adequate_if_absent=adequate_if_absent)
+
+                self.assertEqual(set(results), set(member.pk for member in members))
+                for member in members:
+                    self.assertEqual(results[member.pk], Attendance.was_adequate_for_period(
+                        member, self.events, self.start_dt, self.end_dt, min_total_events=min_total_events,
+                        adequate_if_absent=adequate_if_absent), (member.name, min_total_events, adequate_if_absent))
+
+        # Every reason shows up.
+        reasons = set(reason for _, reason in Attendance.was_adequate_for_period_batch(
+            members, self.events, self.start_dt, self.end_dt, min_total_events=3, adequate_if_absent=True).values())
+        self.assertEqual(len(reasons), 4)
+
+    def test_query_count_is_constant(self):
+        few_members = self.create_roster("A ")
+        many_members = few_members + self.create_roster("B ") + self.create_roster("C ")
+
+        for adequate_if_absent in [False, True]:
+            with CaptureQueriesContext(connection) as few_members_queries:
+                Attendance.was_adequate_for_period_batch(few_members, self.events, self.start_dt, self.end_dt,
+                                                         adequate_if_absent=adequate_if_absent)
+
+            with self.assertNumQueries(len(few_members_queries)):
+                Attendance.was_adequate_for_period_batch(many_members, self.events, self.start_dt, self.end_dt,
+                                                         adequate_if_absent=adequate_if_absent)
+
+    def test_no_members(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(Attendance.was_adequate_for_period_batch([], self.events, self.start_dt, self.end_dt,
+                                                                      adequate_if_absent=True), {})
+
+
+class AttendanceReportTests(TestCase):
+    """AttendanceReport must give the context of the former member by member and event by event report.
+
+    """
+
+    def setUp(self):
+        timezone_info = timezone.get_default_timezone()
+        self.start_dt = timezone.make_aware(datetime(2017, 3, 1), timezone_info)
+        self.end_dt = timezone.make_aware(datetime(2017, 3, 31, 23, 59, 59), timezone_info)
+
+        self.recruit_rank = Rank.objects.create(name="Rct")
+        self.rank = Rank.objects.create(name="Gnt")
+        self.groups = [MemberGroup.objects.create(name=name) for name in ["Bravo", "Alpha", "Charlie"]]
+        self.absence_type = AbsenceType.objects.create(name="LOA")
+
+        # Events at midnight and late in the evening fall on another date in UTC, some of them in another month.
+        event_types = [create_event_type("Training", 0.5), create_event_type("Campaign", 0.75)]
+        self.events = []
+        for index, event_start_dt in enumerate([
+                datetime(2017, 2, 28, 23, 30), datetime(2017, 3, 1, 0, 0), datetime(2017, 3, 4, 20, 0),
+                datetime(2017, 3, 10, 20, 0), datetime(2017, 3, 11, 0, 30), datetime(2017, 3, 18, 20, 0),
+                datetime(2017, 3, 25, 20, 0), datetime(2017, 3, 31, 23, 30), datetime(2017, 4, 1, 0, 30)]):
+            event_start_dt = timezone.make_aware(event_start_dt, timezone_info)
+            self.events.append(Event.objects.create(
+                name="Event%s" % (index,), event_type=event_types[index % 2], start_dt=event_start_dt,
+                end_dt=event_start_dt + timedelta(hours=2), duration_minutes=120))
+
+    def create_member(self, name, group_index=0, attendance_seconds=(), rank=None, join_date=date(2017, 1, 1),
+                      absences=(), **member_fields):
+        """
+
+        :param attendance_seconds: seconds attended of the events in order, None for events not attended.
+        :param absences: (start date, end date, deleted) of the absences.
+        :return:
+        """
+        member = Member.objects.create(
+            name=name, rank=rank or self.rank, join_date=join_date,
+            member_group=self.groups[group_index] if group_index is not None else None, **member_fields)
+
+        for event, seconds in zip(self.events, attendance_seconds):
+            if seconds is not None:
+                Attendance.objects.create(member=member, event=event, attendance_seconds=seconds)
+
+        for start_date, end_date, deleted in absences:
+            Absence.objects.create(member=member, absence_type=self.absence_type, start_date=start_date,
+                                   end_date=end_date, deleted=deleted)
+
+        return member
+
+    def create_roster(self, name_prefix=""):
+        attended = [7200] * 9
+        partly_attended = [7200, 3000, None, 7200, 0, 4000, None, 7200, 5400]
+        self.create_member(name_prefix + "Regular", 0, attended)
+        self.create_member(name_prefix + "Partly", 1, partly_attended)
+        self.create_member(name_prefix + "Never", 1)
+        self.create_member(name_prefix + "Joined late", 0, partly_attended, join_date=date(2017, 3, 11))
+        self.create_member(name_prefix + "Recruit", 0, partly_attended, rank=self.recruit_rank)
+        self.create_member(name_prefix + "Assessed recruit", 1, partly_attended, rank=self.recruit_rank,
+                           mods_assessed=True)
+        self.create_member(name_prefix + "Absent", 0, partly_attended, absences=[
+            (date(2017, 2, 20), date(2017, 3, 1), False), (date(2017, 3, 10), date(2017, 3, 10), False),
+            (date(2017, 3, 18), date(2017, 3, 20), True), (date(2017, 3, 31), date(2017, 4, 10), False)])
+        self.create_member(name_prefix + "Absent throughout", 1, absences=[
+            (date(2017, 2, 1), date(2017, 4, 30), False)])
+        self.create_member(name_prefix + "Deleted", 0, attended, deleted=True)
+        self.create_member(name_prefix + "Discharged", 1, attended, discharged=True, discharge_date=date(2017, 3, 5))
+        self.create_member(name_prefix + "Without group", None, attended)
+
+    def test_context_matches_per_member_report(self):
+        self.create_roster()
+
+        context = AttendanceReport(self.start_dt, self.end_dt).get_context()
+        self.assertEqual(context, get_report_context_per_member(self.start_dt, self.end_dt))
+
+        self.assertEqual(context["event_count"], 7)
+        self.assertEqual(context["group_names"], ["Alpha", "Bravo"])
+        self.assertEqual(sorted(context["attendances"]["Bravo"]),
+                         ["Absent", "Joined late", "Recruit", "Regular"])
+        self.assertEqual(set(context["attendances"]["Bravo"]["Absent"]["attendances"]),
+                         set(["LOA X", "LOA ?", "?", " "]))
+
+    def test_query_count_is_constant(self):
+        self.create_roster("A ")
+        with CaptureQueriesContext(connection) as few_members_queries:
+            AttendanceReport(self.start_dt, self.end_dt).get_context()
+
+        self.create_roster("B ")
+        self.create_roster("C ")
+        with self.assertNumQueries(len(few_members_queries)):
+            context = AttendanceReport(self.start_dt, self.end_dt).get_context()
+
+        self.assertEqual(len(context["group_members"]["Alpha"]), 3 * 4)
+        self.assertEqual(context, get_report_context_per_member(self.start_dt, self.end_dt))
+
+    def test_no_events(self):
+        self.create_roster()
+        Event.objects.all().delete()
+
+        self.assertEqual(AttendanceReport(self.start_dt, self.end_dt).get_context(),
+                         get_report_context_per_member(self.start_dt, self.end_dt))
+
+
+class RecruitStatusTests(TestCase):
+    """Member.with_recruit_status must give the recruit list the values the member methods query for.
+
+    """
+
+    def setUp(self):
+        self.recruit_rank = Rank.objects.create(name="Rct")
+        self.rank = Rank.objects.create(name="Gnt")
+        self.absence_type = AbsenceType.objects.create(name="LOA")
+
+        event_type = create_event_type()
+        self.events = []
+        for index in range(8):
+            event_start_dt = timezone.make_aware(datetime(2017, 3, 1, 20, 0) + timedelta(days=3 * index),
+                                                 timezone.get_default_timezone())
+            self.events.append(Event.objects.create(name="Event%s" % (index,), event_type=event_type,
+                                                    start_dt=event_start_dt,
+                                                    end_dt=event_start_dt + timedelta(hours=2), duration_minutes=120))
+        self.member_count = 0
+
+    def create_recruits(self, count):
+        for _ in range(count):
+            index = self.member_count
+            self.member_count += 1
+
+            recruit = Member.objects.create(name="Recruit%03d" % (index,), rank=self.recruit_rank,
+                                            join_date=date(2017, 2, 1) + timedelta(days=index),
+                                            mods_assessed=index % 3 == 0, bqf_assessed=index % 2 == 0)
+
+            # Inadequate attendances do not count, deleted absences do.
+            for event_index, event in enumerate(self.events[:index % 8]):
+                Attendance.objects.create(member=recruit, event=event,
+                                          attendance_seconds=600 if event_index % 4 == 3 else 7200)
+            for absence_index in range(index % 3):
+                start_date = date(2017, 2, 10) + timedelta(days=10 * absence_index)
+                Absence.objects.create(member=recruit, absence_type=self.absence_type, start_date=start_date,
+                                       end_date=start_date + timedelta(days=index % 5), deleted=absence_index == 1)
+
+        Member.objects.create(name="Grunt%03d" % (self.member_count,), rank=self.rank, join_date=date(2017, 1, 1))
+
+    def get_recruit_list_values(self, recruit):
+        return (recruit.name, recruit.events_attended(), recruit.get_total_days_absent(),
+                recruit.get_recruit_event_attendance_deadline_and_count(), recruit.get_rqf_deadline_date(),
+                recruit.get_mod_assessment_deadline_date(), recruit.rqf_due_days(), recruit.mod_due_days(),
+                recruit.ready_for_promotion())
+
+    def get_recruits_with_status(self):
+        return Member.with_recruit_status(Member.recruits().order_by("name").select_related("rank"))
+
+    def test_values_match_member_methods(self):
+        self.create_recruits(12)
+
+        recruits = self.get_recruits_with_status()
+        self.assertEqual([recruit.name for recruit in recruits],
+                         ["Recruit%03d" % (index,) for index in range(12)])
+
+        with self.assertNumQueries(0):
+            values = [self.get_recruit_list_values(recruit) for recruit in recruits]
+
+        self.assertEqual(values, [self.get_recruit_list_values(Member.objects.get(pk=recruit.pk))
+                                  for recruit in recruits])
+        # Both outcomes are covered.
+        self.assertEqual(set(recruit.ready_for_promotion() for recruit in recruits), set([True, False]))
+
+    def test_query_count_is_constant(self):
+        self.create_recruits(4)
+        with CaptureQueriesContext(connection) as few_recruits_queries:
+            self.get_recruits_with_status()
+
+        self.create_recruits(20)
+        with self.assertNumQueries(len(few_recruits_queries)):
+            recruits = self.get_recruits_with_status()
+
+        self.assertEqual(len(recruits), 24)
+
+
+class PermissionTests(TestCase):
+    def setUp(self):
+        officer_group = Group.objects.create(name="Officer")
+        officer_group.permissions.add(*Permission.objects.filter(codename__in=["cnto_edit_members",
+                                                                                "cnto_view_absentees"]))
+
+        User.objects.create_user("officer", "officer@example.com", "password").groups.add(officer_group)
+        User.objects.create_user("member", "member@example.com", "password")
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+
+    def test_permissions_are_queried_once_per_user(self):
+        for username, expected_permissions in [("officer", [True, True, False]), ("member", [False, False, False]),
+                                               ("admin", [True, True, True])]:
+            # A fresh user object, like the one of every request.
+            user = User.objects.get(username=username)
+
+            with self.assertNumQueries(0 if user.is_superuser else 1):
+                for _ in range(3):
+                    self.assertEqual([has_permission(user, permission_name) for permission_name in [
+                        "cnto_edit_members", "cnto_view_absentees", "cnto_edit_groups"]], expected_permissions,
+                        username)
+
+    def test_anonymous_user_has_no_permissions(self):
+        user = AnonymousUser()
+
+        with self.assertNumQueries(0):
+            self.assertFalse(has_permission(user, "cnto_edit_members"))
+            self.assertFalse(has_permission(user, "cnto_view_absentees"))
+
+
+class ManageMemberListTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+
+        self.ranks = [Rank.objects.create(name="Rct"), Rank.objects.create(name="Gnt")]
+        self.groups = [MemberGroup.objects.create(name="Alpha"), MemberGroup.objects.create(name="Bravo")]
+        self.absence_type = AbsenceType.objects.create(name="LOA")
+        self.contribution_type = ContributionType.objects.create(name="Supporter")
+        self.member_count = 0
+
+    def create_members(self, count):
+        today = timezone.now().date()
+
+        for _ in range(count):
+            index = self.member_count
+            self.member_count += 1
+
+            member = Member.objects.create(name="Member%03d" % (index,), rank=self.ranks[index % 2],
+                                           member_group=self.groups[index % 2], discharged=index % 5 == 0,
+                                           mods_assessed=index % 3 != 0, join_date=today - timedelta(days=index))
+
+            Note.objects.create(member=member, message="Note %s " % (index,) * (index % 20), active=index % 2 == 0)
+            Contribution.objects.create(member=member, type=self.contribution_type, start_date=today,
+                                        end_date=today + timedelta(days=index % 3 - 1))
+            Absence.objects.create(member=member, absence_type=self.absence_type, start_date=today,
+                                   end_date=today + timedelta(days=index % 4))
+
+    def test_query_count_is_constant(self):
+        self.create_members(5)
+        with CaptureQueriesContext(connection) as few_members_queries:
+            response = self.client.get(reverse("manage"))
+        self.assertContains(response, "Member004")
+
+        self.create_members(25)
+        with self.assertNumQueries(len(few_members_queries)):
+            response = self.client.get(reverse("manage"))
+        self.assertContains(response, "Member029")
+
+    def test_annotations_match_filters(self):
+        self.create_members(12)
+
+        members = list(Member.objects.all())
+        attach_member_list_annotations(members)
+
+        for member in members:
+            self.assertEqual(member.active_note_excerpt, active_note_message(Member.objects.get(pk=member.pk)))
+            self.assertEqual(member.contribution_type_name, contribution_level(Member.objects.get(pk=member.pk)))
+
+    def test_latest_active_note_is_shown(self):
+        member = Member.objects.create(name="Spartak", rank=self.ranks[1], join_date=date(2017, 1, 1))
+        now = timezone.now()
+        Note.objects.create(member=member, message="Latest", dt=now - timedelta(days=1))
+        Note.objects.create(member=member, message="Older", dt=now - timedelta(days=2))
+        Note.objects.create(member=member, message="Inactive", dt=now, active=False)
+
+        attach_member_list_annotations([member])
+        self.assertEqual(member.active_note_excerpt, "Latest")
+        self.assertEqual(active_note_message(Member.objects.get(pk=member.pk)), "Latest")
+
+        # On equal dates the last created note is shown.
+        Note.objects.create(member=member, message="Latest created", dt=now - timedelta(days=1))
+
+        attach_member_list_annotations([member])
+        self.assertEqual(member.active_note_excerpt, "Latest created")
+        self.assertEqual(active_note_message(Member.objects.get(pk=member.pk)), "Latest created")
@@ -32,10 +32,12 @@ urlpatterns = [
     url(r'^login/', login_user.login_user, name='login'),
 
     url(r'^event-browser/', event.event_browser, name='event-browser'),
+    url(r'^event-calendar-data/$', event.get_calendar_events_for_window, name='event-calendar-data'),
     url(
         r'^scrape-event/(?P<event_type_name>\w+)/(?P<dt_string>\w{4}-\w{2}-\w{2})/(?P<start_time_string>[0-9]{2}h[0-9]{2})/('
         r'?P<end_time_string>[0-9]{2}h[0-9]{2})/$',
         scrape.scrape, name='scrape-event'),
+    url(r'^scrape-job-status/(?P<job_pk>\d+)/$', scrape.scrape_job_status, name='scrape-job-status'),
     url(
         r'^save-event/(?P<event_type_name>\w+)/(?P<dt_string>\w{4}-\w{2}-\w{2})/(?P<start_time_string>[0-9]{2}h[0-9]{2})/('
         r'?P<end_time_string>[0-9]{2}h[0-9]{2})/$',
@@ -71,11 +73,14 @@ urlpatterns = [
         name='download-month-csv'),
     url(r'^download-group-month-csv/(?P<dt_string>\w{4}-\w{2}-\w{2})/(?P<group_pk>\d+)/$',
         report.download_report_for_month, name='download-group-month-csv'),
+    url(r'^download-month-zip/(?P<dt_string>\w{4}-\w{2}-\w{2})/$', report.download_reports_for_month,
+        name='download-month-zip'),
 
     url(r'^report-main/$', report.report_main, name='report-main'),
     url(r'^get-report-body-for-month/(?P<month_string>\w{4}-\w{2})/$', report.get_report_body_for_month,
         name='get-report-body-for-month'),
     url(r'^get-summary-data/$', report.get_summary_data, name='get-summary-data'),
+    url(r'^get-report-cache-stats/$', report.get_report_cache_stats, name='get-report-cache-stats'),
 
     url(r'^notes/', include(note_urls)),
     url(r'^users/', include(user_urls)),
@@ -1,7 +1,5 @@
-import json
 import traceback
 
-from django.db import models
 from django.utils import timezone
 from django.utils.timezone import datetime
 from django.http.response import JsonResponse
@@ -11,6 +9,7 @@ from django.template.context_processors import csrf
 from datetime import timedelta
 from cnto_warnings.models import MemberWarning
 from ..models import Event, Attendance, MemberGroup, EventType
+from ..reports import get_calendar_events
 from cnto.templatetags.cnto_tags import has_permission
 from ..forms import EventTypeForm
 from utils.date_utils import calculate_dt_from_strings
@@ -127,12 +126,11 @@ def view_event(request, year_string, month_string, day_string):
     try:
         event = Event.objects.get(start_dt__year=selected_dt.year, start_dt__month=selected_dt.month,
                                   start_dt__day=selected_dt.day)
-        attendances = Attendance.objects.filter(event=event, member__deleted=False)
+        attendances = Attendance.objects.filter(event=event, member__deleted=False).select_related("member")
 
         for attendance in attendances:
             attendance_values.append(
-                (attendance.member.name, "%.2f" % (attendance.get_attendance_ratio() * 100.0,),
-                 not attendance.was_adequate()))
+                (attendance.member.name, "%.2f" % (attendance.attendance_ratio * 100.0,), not attendance.adequate))
 
         attendance_values.sort(key=lambda x: x[0])
 
@@ -160,32 +158,34 @@ def event_browser(request):
 
     context = {}
 
-    event_data = {}
-    for event in Event.objects.all().select_related(
-        'event_type',
-    ).prefetch_related(
-        models.Prefetch('attendees', queryset=Attendance.objects.all()),
-    ):
-        stats = event.get_stats()
-
-        start_dt = event.start_dt
-        end_dt = event.end_dt
-
-        event_data[start_dt.astimezone(timezone.get_default_timezone()).strftime("%Y-%m-%d %H:%M")] = {
-            "title": "\n%s minutes\n%.2f %% attendance\n%s players" % (
-                event.duration_minutes, stats["average_attendance"] * 100.0, stats["player_count"]),
-            "end_dt_string": end_dt.astimezone(timezone.get_default_timezone()).strftime("%Y-%m-%d %H:%M"),
-            "css_class_name": event.event_type.css_class_name,
-        }
-
-    event_data = json.dumps(event_data)
-    context["event_data"] = event_data
     context["groups"] = MemberGroup.objects.all()
     context["warning_count"] = MemberWarning.objects.filter(acknowledged=False).count()
 
     return render(request, 'cnto/event/browser.html', context)
 
 
+def get_calendar_events_for_window(request):
+    """Return the event browser calendar entries of the window requested by the calendar.
+
+    :param request: GET start and end as local dates, end exclusive.
+    :return:
+    """
+    if not request.user.is_authenticated():
+        return redirect("login")
+    elif not has_permission(request.user, "cnto_view_events"):
+        return redirect("manage")
+
+    try:
+        start_dt = timezone.make_aware(datetime.strptime(request.GET["start"], "%Y-%m-%d"),
+                                       timezone.get_default_timezone())
+        end_dt = timezone.make_aware(datetime.strptime(request.GET["end"], "%Y-%m-%d"),
+                                     timezone.get_default_timezone())
+    except (KeyError, ValueError):
+        raise Http404("Calendar window start and end dates required.")
+
+    return JsonResponse(get_calendar_events(start_dt, end_dt), safe=False)
+
+
 def save_event(request, event_type_name, dt_string, start_time_string, end_time_string):
     """Return the daily process main overview page.
     """
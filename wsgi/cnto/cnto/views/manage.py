@@ -1,11 +1,37 @@
-from django.db import models
 from django.shortcuts import render, redirect
 from django.utils import timezone
-from cnto.templatetags.cnto_tags import has_permission
+from cnto.templatetags.cnto_tags import get_note_excerpt, has_permission
 from cnto_contributions.models import Contribution
-from cnto_warnings.models import MemberWarning
 from cnto_notes.models import Note
-from ..models import Member, MemberGroup, EventType, Absence, Attendance
+from cnto_warnings.models import MemberWarning
+from ..models import Member, MemberGroup, EventType, Absence
+
+
+def attach_member_list_annotations(members):
+    """Attach the active note excerpt and the current contribution type of every member with two queries, for the
+    active_note_message and contribution_level filters to read.
+
+    Of several active notes of a member the latest one by note date is shown, the last created one on equal dates.
+
+    :param members: list of members.
+    :return:
+    """
+    member_pks = [member.pk for member in members]
+
+    active_note_messages = {}
+    for member_pk, note_message in Note.objects.filter(member__in=member_pks, active=True).order_by(
+            "dt", "id").values_list("member_id", "message"):
+        active_note_messages[member_pk] = note_message
+
+    contribution_type_names = {}
+    for member_pk, contribution_type_name in Contribution.objects.filter(
+            member__in=member_pks, end_date__gte=timezone.now().date()).order_by("id").values_list(
+            "member_id", "type__name"):
+        contribution_type_names.setdefault(member_pk, contribution_type_name)
+
+    for member in members:
+        member.active_note_excerpt = get_note_excerpt(active_note_messages.get(member.pk, ""))
+        member.contribution_type_name = contribution_type_names.get(member.pk, "")
 
 
 def management(request):
@@ -18,31 +44,24 @@ def management(request):
     if not has_permission(request.user, "cnto_edit_members") and not has_permission(request.user, "cnto_view_absentees"):
         return redirect("report-main")
 
-    recruits = Member.recruits().order_by('name').select_related(
+    recruits = Member.with_recruit_status(Member.recruits().order_by('name').select_related(
             'rank',
             'member_group',
-    ).prefetch_related(
-            models.Prefetch('attendances', queryset=Attendance.objects.all().select_related(
-                'event',
-                'event__event_type',
-            )),
-            models.Prefetch('notes', queryset=Note.objects.order_by('-id')),
-    )
-    discharges = Member.objects.all().filter(discharged=True, deleted=False).order_by('name').select_related(
+    ))
+    discharges = list(Member.objects.all().filter(discharged=True, deleted=False).order_by('name').select_related(
             'rank',
             'member_group',
-    ).prefetch_related(
-            models.Prefetch('notes', queryset=Note.objects.order_by('-id')),
-    )
+    ))
 
     members = []
     if has_permission(request.user, "cnto_edit_members"):
-        members = Member.active_members().order_by('name').select_related(
+        members = list(Member.active_members().order_by('name').select_related(
             'rank',
             'member_group',
-        ).prefetch_related(
-            models.Prefetch('notes', queryset=Note.objects.order_by('-id')),
-        )
+        ))
+
+    attach_member_list_annotations(members + recruits + discharges)
+    Member.attach_absence_status(members + recruits)
 
     absentees = []
     if has_permission(request.user, "cnto_view_absentees"):
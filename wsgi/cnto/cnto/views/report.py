@@ -1,17 +1,19 @@
 import csv
-import calendar
+import io
+import itertools
 import traceback
+import zipfile
 
 from django.utils.timezone import datetime, timedelta
 from django.http.response import JsonResponse
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect, render
 
-from django.db.models import Max, Min
-
 from cnto.templatetags.cnto_tags import has_permission
 from cnto_warnings.models import MemberWarning
+from ..reports import get_cached_report_context, get_report_cache_counters, \
+    get_report_context_for_month, get_weekly_attendance_summary
 from ..models import MemberGroup, Event, Member, Attendance, Absence, AbsenceType
 
 
@@ -21,40 +23,21 @@ def get_summary_data(request):
     elif not has_permission(request.user, "cnto_view_reports"):
         return redirect("manage")
 
-    first_event_dt = Event.objects.all().aggregate(Min('start_dt'))["start_dt__min"]
-    last_event_dt = Event.objects.all().aggregate(Max('start_dt'))["start_dt__max"]
-
-    first_event_sunday = first_event_dt
-
-    while first_event_sunday.weekday() != 6:
-        first_event_sunday = first_event_sunday - timedelta(days=1)
-
-    week_start_dt = first_event_sunday
-    week_end_dt = first_event_sunday + timedelta(days=7)
-
-    event_data = []
-
-    while week_start_dt < last_event_dt:
-        week_events = Event.objects.filter(start_dt__gte=week_start_dt, end_dt__lt=week_end_dt)
-
-        week_event_count = len(week_events)
-        total_attendances = 0
-        max_attendance = 0
-        for event in week_events:
-            event_attendances = Attendance.objects.filter(event=event, member__deleted=False)
-            event_attendance_count = len(event_attendances)
-            total_attendances += event_attendance_count
-            max_attendance = max(max_attendance, event_attendance_count)
+    try:
+        from_dt = None
+        if "from" in request.GET:
+            from_dt = timezone.make_aware(datetime.strptime(request.GET["from"], "%Y-%m-%d"),
+                                          timezone.get_default_timezone())
 
-        event_data.append({
-            "week_start_dt": week_start_dt.strftime("%Y-%m-%d"),
-            "week_end_dt": week_end_dt.strftime("%Y-%m-%d"),
-            "week_max": max_attendance,
-            "week_avg": float(total_attendances) / week_event_count if week_event_count > 0 else 0
-        })
+        to_dt = None
+        if "to" in request.GET:
+            # Up to and including the given day.
+            to_dt = timezone.make_aware(datetime.strptime(request.GET["to"], "%Y-%m-%d") + timedelta(days=1),
+                                        timezone.get_default_timezone())
+    except ValueError:
+        return JsonResponse({"success": False, "error": "Dates must be given as YYYY-MM-DD."}, status=400)
 
-        week_start_dt = week_end_dt
-        week_end_dt += timedelta(days=7)
+    event_data = get_weekly_attendance_summary(from_dt, to_dt)
 
     return JsonResponse({
         "event-data": event_data,
@@ -92,73 +75,7 @@ def report_main(request):
 
 def get_report_context_for_date_range(start_dt, end_dt):
     try:
-        context = {}
-
-        events = Event.all_for_time_period(start_dt, end_dt).order_by("start_dt")
-        context["event_count"] = events.count()
-
-        events_dict = {
-            "start_dates": [event.start_dt.strftime("%Y-%m-%d") for event in events],
-            "css_classes": [event.event_type.css_class_name for event in events]
-        }
-        context["events"] = events_dict
-
-        groups = MemberGroup.objects.all().order_by("name")
-        all_members = Member.active_members()
-
-        attendance_dict = {}
-        group_members = {}
-        for group in groups:
-            attendance_dict[group.name] = {}
-            members = all_members.filter(member_group=group).order_by("name")
-            for member in members:
-                # print "Reporting member %s..." % (member, )
-                period_attendance_adequate, reason = Attendance.was_adequate_for_period(member, events, start_dt,
-                                                                                        end_dt, adequate_if_absent=True)
-                attendance_dict[group.name][member.name] = {
-                    "attendance_adequate": period_attendance_adequate,
-                    "attendances": []
-                }
-                if group.name not in group_members:
-                    group_members[group.name] = []
-
-                group_members[group.name].append(member.name)
-
-                for event in events:
-                    try:
-                        if member.is_recruit() and not member.mods_assessed:
-                            absence_type = "-"
-                        else:
-                            if member.join_date > event.start_dt.date():
-                                absence_type = "-"
-                            else:
-                                Absence.get_absence_for_event(event, member)
-                                absence_type = "LOA"
-                    except Absence.DoesNotExist:
-                        absence_type = None
-
-                    try:
-                        attendance = Attendance.objects.get(member=member, event=event)
-                        was_adequate = attendance.was_adequate()
-                        if was_adequate:
-                            presence_marker = "X"
-                        else:
-                            presence_marker = "?"
-
-                    except Attendance.DoesNotExist:
-                        presence_marker = " "
-
-                    if absence_type is not None:
-                        presence_marker = absence_type + " " + presence_marker
-
-                    attendance_dict[group.name][member.name]["attendances"].append(presence_marker)
-
-        context["attendances"] = attendance_dict
-
-        context["group_names"] = sorted(group_members.keys())
-        context["group_members"] = group_members
-        context["start_dt"] = start_dt.strftime("%Y-%m-%d")
-        context["end_dt"] = end_dt.strftime("%Y-%m-%d")
+        context = get_cached_report_context(start_dt, end_dt)
     except Exception:
         print(str(traceback.format_exc()))
         raise
@@ -176,59 +93,179 @@ def get_report_body_for_month(request, month_string):
 
     month_dt = datetime.strptime(month_string, "%Y-%m")
 
-    context = get_report_context_for_date_range(
-        timezone.make_aware(datetime(month_dt.year, month_dt.month, 1, 0, 0), timezone.get_default_timezone()),
-        timezone.make_aware(datetime(month_dt.year, month_dt.month,
-                                     calendar.monthrange(month_dt.year, month_dt.month)[1], 23, 59),
-                            timezone.get_default_timezone()))
+    try:
+        context = get_report_context_for_month(month_dt.year, month_dt.month)
+    except Exception:
+        print(str(traceback.format_exc()))
+        raise
 
     return JsonResponse(context)
 
 
-def download_report_for_month(request, dt_string, group_pk=None):
+def get_report_cache_stats(request):
     if not request.user.is_authenticated():
         return redirect("login")
     elif not has_permission(request.user, "cnto_view_reports"):
         return redirect("manage")
 
-    group = MemberGroup.objects.get(pk=group_pk)
-    dt = datetime.strptime(dt_string, "%Y-%m-%d")
+    return JsonResponse(get_report_cache_counters())
 
-    events = Event.objects.filter(start_dt__year=dt.year, start_dt__month=dt.month).order_by("start_dt")
 
-    members = Member.objects.filter(member_group=group).order_by("name")
+class EchoBuffer(object):
+    """File-like object that hands written data back instead of storing it, to stream what a writer produces.
 
-    filename = "%s-%s.csv" % (dt.strftime("%Y-%m"), group.name.lower())
+    """
 
-    # Create the HttpResponse object with the appropriate CSV header.
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % (filename,)
-    writer = csv.writer(response)
+    def write(self, data):
+        return data
+
+
+class ChunkBuffer(object):
+    """Write-only file-like object collecting written data until it is taken out.
 
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_month_events(dt):
+    return Event.objects.filter(start_dt__year=dt.year, start_dt__month=dt.month).order_by("start_dt")
+
+
+def get_adequate_attendance_keys(events, attendances):
+    """
+
+    :param events:
+    :param attendances: attendances queryset to look in.
+    :return: set of (member pk, event pk) of the adequate attendances to the events.
+    """
+    return set(attendances.filter(event__in=[event.pk for event in events], adequate=True).values_list(
+        "member_id", "event_id").iterator())
+
+
+def iterate_month_report_rows(events, members, adequate_attendance_keys):
+    """
+
+    :param events:
+    :param members: iterable of the members to report, in order.
+    :param adequate_attendance_keys:
+    :return: generator of CSV rows.
+    """
     header_columns = ["Member"]
     for event in events:
         header_columns.append(event.start_dt.strftime("%Y-%m-%d"))
-    writer.writerow(header_columns)
+    yield header_columns
 
     for member in members:
         member_columns = [member.name]
 
         for event in events:
-            was_adequate = False
-            try:
-                attendance = Attendance.objects.get(member=member, event=event)
-                was_adequate = attendance.was_adequate()
-            except Attendance.DoesNotExist:
-                pass
-
-            if was_adequate:
+            if (member.pk, event.pk) in adequate_attendance_keys:
                 member_columns.append("X")
             else:
                 member_columns.append(" ")
 
-        writer.writerow(member_columns)
+        yield member_columns
+
+    yield []
+    yield ["X = attended"]
+
 
-    writer.writerow([])
-    writer.writerow(["X = attended"])
+def download_report_for_month(request, dt_string, group_pk=None):
+    if not request.user.is_authenticated():
+        return redirect("login")
+    elif not has_permission(request.user, "cnto_view_reports"):
+        return redirect("manage")
+
+    group = MemberGroup.objects.get(pk=group_pk)
+    dt = datetime.strptime(dt_string, "%Y-%m-%d")
+
+    events = list(get_month_events(dt))
+    adequate_attendance_keys = get_adequate_attendance_keys(events,
+                                                            Attendance.objects.filter(member__member_group=group))
+
+    members = Member.objects.filter(member_group=group).order_by("name").only("pk", "name").iterator()
+
+    filename = "%s-%s.csv" % (dt.strftime("%Y-%m"), group.name.lower())
+
+    # Rows are written to the response as they are produced.
+    writer = csv.writer(EchoBuffer())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in iterate_month_report_rows(events, members, adequate_attendance_keys)),
+        content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (filename,)
+
+    return response
+
+
+def iterate_month_report_zip(dt, groups, events, adequate_attendance_keys):
+    """
+
+    :param dt:
+    :param groups: groups ordered by name.
+    :param events:
+    :param adequate_attendance_keys:
+    :return: generator of the chunks of a zip file with the CSV report of every group.
+    """
+    zip_buffer = ChunkBuffer()
+    zip_file = zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED)
+
+    # All members are read in a single pass, grouped in the order of the groups.
+    members_by_group_pk = itertools.groupby(
+        Member.objects.filter(member_group__isnull=False).order_by("member_group__name", "name").only(
+            "pk", "name", "member_group").iterator(),
+        key=lambda member: member.member_group_id)
+    group_pk, group_members = next(members_by_group_pk, (None, iter([])))
+
+    for group in groups:
+        members = group_members if group.pk == group_pk else []
+
+        csv_file = io.StringIO()
+        writer = csv.writer(csv_file)
+        for row in iterate_month_report_rows(events, members, adequate_attendance_keys):
+            writer.writerow(row)
+
+        zip_file.writestr("%s-%s.csv" % (dt.strftime("%Y-%m"), group.name.lower()), csv_file.getvalue())
+        yield zip_buffer.take()
+
+        if group.pk == group_pk:
+            # Only advance once the members of the group have been read.
+            group_pk, group_members = next(members_by_group_pk, (None, iter([])))
+
+    zip_file.close()
+    yield zip_buffer.take()
+
+
+def download_reports_for_month(request, dt_string):
+    if not request.user.is_authenticated():
+        return redirect("login")
+    elif not has_permission(request.user, "cnto_view_reports"):
+        return redirect("manage")
+
+    dt = datetime.strptime(dt_string, "%Y-%m-%d")
+
+    groups = list(MemberGroup.objects.all().order_by("name"))
+    events = list(get_month_events(dt))
+    adequate_attendance_keys = get_adequate_attendance_keys(
+        events, Attendance.objects.filter(member__member_group__isnull=False))
+
+    filename = "%s-all-groups.zip" % (dt.strftime("%Y-%m"),)
+
+    response = StreamingHttpResponse(iterate_month_report_zip(dt, groups, events, adequate_attendance_keys),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (filename,)
 
     return response
@@ -1,11 +1,14 @@
+import json
 import traceback
 
 import valve.source.a2s
-from django.core.exceptions import MultipleObjectsReturned
 import pytz
 from django.utils import timezone
 from django.utils.timezone import datetime, timedelta
 from django.http.response import JsonResponse
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
 from django.shortcuts import redirect
 from cnto import RECRUIT_RANK
 from cnto.templatetags.cnto_tags import has_permission
@@ -16,7 +19,8 @@ try:
 except ImportError:
     ARMA3_SERVER_MONITOR = ("localhost", 2303)
 from utils.attendance_scraper import get_all_event_attendances_between
-from ..models import Event, Member, Rank, Attendance, EventType
+from ..models import Event, Member, MemberAlias, Rank, Attendance, EventType, ScrapeJob
+from ..reports import invalidate_all_reports, invalidate_reports_for_dt
 
 
 def interpret_raw_username(raw_username):
@@ -35,8 +39,103 @@ def interpret_raw_username(raw_username):
     return username
 
 
+def get_or_create_recruit_rank():
+    """
+
+    :return:
+    """
+    try:
+        return Rank.objects.get(name__iexact=RECRUIT_RANK)
+    except Rank.DoesNotExist:
+        rank = Rank(name=RECRUIT_RANK)
+        rank.save()
+        return rank
+
+
+def resolve_members_for_raw_usernames(raw_usernames):
+    """Find the active member for every raw username, creating recruits for unknown names.
+
+    Names are looked up in the alias index first. Names without an alias pointing to an active member are matched
+    case insensitively against the names of active members in a single query, missing recruits are created with a
+    single bulk insert and the aliases of all newly resolved names are recorded.
+
+    :param raw_usernames:
+    :return: dict of raw username to member, raw usernames without a usable name are left out.
+    """
+    usernames = {}
+    for raw_username in raw_usernames:
+        if len(raw_username.strip()) == 0:
+            continue
+
+        username = interpret_raw_username(raw_username)
+
+        if len(username) == 0:
+            continue
+
+        usernames[raw_username] = username
+
+    if len(usernames) == 0:
+        return {}
+
+    requested_keys = set(MemberAlias.key_for_name(username) for username in usernames.values())
+
+    members_by_key = {}
+    stale_aliases = {}
+    for alias in MemberAlias.objects.filter(key__in=requested_keys).select_related("member"):
+        if alias.member.discharged or alias.member.deleted:
+            stale_aliases[alias.key] = alias
+        else:
+            members_by_key[alias.key] = alias.member
+
+    unaliased_keys = requested_keys - set(members_by_key)
+
+    if len(unaliased_keys) > 0:
+        name_matched_members = {}
+        unaliased_usernames = [username for username in usernames.values()
+                               if MemberAlias.key_for_name(username) in unaliased_keys]
+        for member in Member.active_members_named(unaliased_usernames):
+            key = MemberAlias.key_for_name(member.name)
+            if key not in unaliased_keys:
+                continue
+
+            if key in name_matched_members:
+                raise ValueError("Multiple users found with name %s!" % (member.name,))
+
+            name_matched_members[key] = member
+
+        members_by_key.update(name_matched_members)
+
+        missing_usernames = {}
+        for username in usernames.values():
+            key = MemberAlias.key_for_name(username)
+            if key not in members_by_key:
+                missing_usernames.setdefault(key, username)
+
+        if len(missing_usernames) > 0:
+            rank = get_or_create_recruit_rank()
+            Member.objects.bulk_create([Member(name=username, rank=rank) for username in missing_usernames.values()])
+            # Bulk inserts send no signals, new members show up in every report.
+            invalidate_all_reports()
+
+            for member in Member.objects.filter(name__in=list(missing_usernames.values()), rank=rank,
+                                                discharged=False, deleted=False):
+                members_by_key[MemberAlias.key_for_name(member.name)] = member
+
+        for key in unaliased_keys & set(stale_aliases):
+            stale_alias = stale_aliases[key]
+            stale_alias.member = members_by_key[key]
+            stale_alias.save()
+
+        MemberAlias.objects.bulk_create([
+            MemberAlias(member=members_by_key[key], key=key) for key in unaliased_keys - set(stale_aliases)
+        ])
+
+    return {raw_username: members_by_key[MemberAlias.key_for_name(username)]
+            for raw_username, username in usernames.items()}
+
+
 def scrape(request, event_type_name, dt_string, start_time_string, end_time_string):
-    """Return the daily process main overview page.
+    """Queue a scrape of the server stats site, the scrape worker picks it up.
     """
 
     try:
@@ -53,176 +152,258 @@ def scrape(request, event_type_name, dt_string, start_time_string, end_time_stri
         if end_dt < start_dt:
             end_dt += timedelta(hours=24)
 
+        job = ScrapeJob(event_type=event_type, start_dt=start_dt, end_dt=end_dt)
+        job.save()
+
+        return JsonResponse({"success": True, "job_id": job.pk,
+                             "status_url": reverse("scrape-job-status", kwargs={"job_pk": job.pk})})
+    except Exception as e:
+        return JsonResponse({"success": False, "error": traceback.format_exc()})
+
+
+def scrape_job_status(request, job_pk):
+    """Return the progress of a scrape job, and its attendances and stats once finished.
+    """
+
+    try:
+        if not request.user.is_authenticated():
+            return redirect("login")
+        elif not has_permission(request.user, "cnto_edit_events"):
+            return redirect("manage")
+
+        job = ScrapeJob.objects.get(pk=job_pk)
+
+        status = {
+            "success": job.status != ScrapeJob.FAILED,
+            "job_id": job.pk,
+            "status": job.status,
+            "done": job.is_done(),
+            "events_done": job.events_done,
+            "events_total": job.events_total,
+            "error": job.error,
+        }
+
+        if job.status == ScrapeJob.FINISHED:
+            status.update(json.loads(job.result))
+
+        return JsonResponse(status)
+    except Exception as e:
+        return JsonResponse({"success": False, "error": traceback.format_exc()})
+
+
+def run_scrape_job(job):
+    """Scrape the server stats site for a claimed job and store the attendances.
+
+    :param job: a running ScrapeJob.
+    :return:
+    """
+
+    def report_progress(events_done, events_total):
+        job.update_progress(events_done, events_total)
+
+    try:
+        start_dt = job.start_dt.astimezone(timezone.get_default_timezone())
+        end_dt = job.end_dt.astimezone(timezone.get_default_timezone())
+
         try:
             scrape_result, scrape_stats = get_all_event_attendances_between(start_dt.astimezone(pytz.utc),
-                                                                            end_dt.astimezone(pytz.utc))
+                                                                            end_dt.astimezone(pytz.utc),
+                                                                            progress_callback=report_progress)
         except ValueError:
             traceback.print_exc()
             scrape_result = {}
             scrape_stats = {'average_attendance': 0, 'minutes': 0, "success": True}
 
-        # scrape_result = {u'Spartak [CNTO - Gnt]': 1.0, u'Chypsa [CNTO - Gnt]': 1.0, u'Guilly': 0.42857142857142855,
-        # u'Hellfire [CNTO - SPC]': 1.0, u'Cody [CNTO - Gnt]': 1.0,
-        # u'Ozzie [CNTO - SPC]': 0.7142857142857143, u'Skywalker': 0.6397515527950312,
-        # u'Obi [CNTO - JrNCO]': 0.7142857142857143, u'Zero': 1.0,
-        # u'Chris [CNTO - SPC]': 0.14285714285714285, u'Hateborder [CNTO - Gnt]': 1.0,
-        # u'Dusky [CNTO - Gnt]': 0.7142857142857143}
-        # scrape_stats = {'average_attendance': 0.7795031055900622, 'minutes': 56.0}
+        import_scraped_attendances(job.event_type, start_dt, end_dt, scrape_result, scrape_stats)
 
-        try:
-            event = Event.objects.get(start_dt__year=start_dt.year, start_dt__month=start_dt.month,
-                                      start_dt__day=start_dt.day)
-
-            event.start_dt = start_dt
-            event.end_dt = end_dt
-
-            event.event_type = event_type
-            event.duration_minutes = scrape_stats["minutes"]
-            event.save()
-        except Event.DoesNotExist:
-            event = Event(start_dt=start_dt, end_dt=end_dt,
-                          duration_minutes=scrape_stats["minutes"], event_type=event_type)
-            event.save()
-
-        if len(scrape_result) > 0:
-            # Only do something when data was collected.
-
-            previous_attendances = Attendance.objects.filter(event=event)
-            previous_attendances.delete()
-            for raw_username in scrape_result:
-                if len(raw_username.strip()) == 0:
-                    continue
-
-                username = interpret_raw_username(raw_username)
-
-                if len(username) == 0:
-                    continue
-
-                attendance_value = scrape_result[raw_username]
-
-                try:
-                    member = Member.objects.get(name__iexact=username, discharged=False, deleted=False)
-                except Member.DoesNotExist:
-                    rank_str = RECRUIT_RANK
-                    try:
-                        rank = Rank.objects.get(name__iexact=rank_str)
-                    except Rank.DoesNotExist:
-                        rank = Rank(name=rank_str)
-                        rank.save()
-
-                    member = Member(name=username, rank=rank)
-                    member.save()
-                except MultipleObjectsReturned:
-                    raise ValueError("Multiple users found with name %s!" % (username,))
-
-                attendance_seconds = (attendance_value * event.duration_minutes) * 60
-                try:
-                    attendance = Attendance.objects.get(event=event, member=member)
-                    attendance.attendance_seconds = attendance_seconds
-                    attendance.save()
-                except Attendance.DoesNotExist:
-                    attendance = Attendance(event=event, member=member,
-                                            attendance_seconds=attendance_seconds)
-                    attendance.save()
-        return JsonResponse({"attendance": scrape_result, "stats": scrape_stats, "success": True})
-    except Exception as e:
-        return JsonResponse({"success": False, "error": traceback.format_exc()})
+        job.result = json.dumps({"attendance": scrape_result, "stats": scrape_stats})
+        job.status = ScrapeJob.FINISHED
+    except Exception:
+        job.error = traceback.format_exc()
+        job.status = ScrapeJob.FAILED
 
+    job.save()
 
-def update_attendance_for_current_event(update_interval_seconds=300, event_type_name="Unknown", event_start_hour=20):
-    """None
 
-    :return:
+def import_scraped_attendances(event_type, start_dt, end_dt, scrape_result, scrape_stats):
+    """Create or update the event of the scraped period and replace its attendances.
+
+    :param event_type:
+    :param start_dt:
+    :param end_dt:
+    :param scrape_result: attendance ratio per raw username.
+    :param scrape_stats:
+    :return: the event.
     """
+    with transaction.atomic():
+        event = _import_scraped_attendances(event_type, start_dt, end_dt, scrape_result, scrape_stats)
+
+    # The bulk insert sends no signals, and reports computed before the commit may hold the old attendances.
+    invalidate_reports_for_dt(event.start_dt)
+
+    return event
+
+
+def _import_scraped_attendances(event_type, start_dt, end_dt, scrape_result, scrape_stats):
     try:
+        event = Event.objects.get(start_dt__year=start_dt.year, start_dt__month=start_dt.month,
+                                  start_dt__day=start_dt.day)
+
+        event.start_dt = start_dt
+        event.end_dt = end_dt
+
+        event.event_type = event_type
+        event.duration_minutes = scrape_stats["minutes"]
+        event.save()
+    except Event.DoesNotExist:
+        event = Event(start_dt=start_dt, end_dt=end_dt,
+                      duration_minutes=scrape_stats["minutes"], event_type=event_type)
+        event.save()
+
+    if len(scrape_result) > 0:
+        # Only do something when data was collected.
+        members = resolve_members_for_raw_usernames(scrape_result)
+
+        attendance_seconds_by_member = {}
+        for raw_username, member in members.items():
+            attendance_value = scrape_result[raw_username]
+            attendance_seconds_by_member[member] = (attendance_value * event.duration_minutes) * 60
+
+        previous_attendances = Attendance.objects.filter(event=event)
+        previous_attendances.delete()
+
+        attendances = [
+            Attendance(event=event, member=member, attendance_seconds=attendance_seconds)
+            for member, attendance_seconds in attendance_seconds_by_member.items()
+        ]
+        # Bulk inserts bypass save(), which keeps the stored ratios up to date.
+        for attendance in attendances:
+            attendance.update_attendance_ratio()
+
+        Attendance.objects.bulk_create(attendances)
+
+    return event
+
+
+def update_current_event(extend_seconds, event_type_name="Unknown", event_start_hour=20, dt=None):
+    """Create the event of the day if needed and make it run from the event start hour up to extend_seconds after dt.
+
+    :param extend_seconds:
+    :param event_type_name: type of the event when it has to be created.
+    :param event_start_hour:
+    :param dt: naive local time of the last presence sample, now if not given.
+    :return: the event.
+    """
+    if dt is None:
         dt = datetime.now()
 
-        start_dt = timezone.make_aware(datetime(dt.year, dt.month, dt.day, event_start_hour, 00, 00),
-                                       timezone.get_default_timezone())
-
-        current_dt = timezone.make_aware(dt, timezone.get_default_timezone())
-        # pytz.timezone("Europe/Stockholm")
-        #
-        # if int(end_hour) >= 24:
-        #     end_dt = timezone.make_aware(datetime(dt.year, dt.month, dt.day, 0, 0, 0),
-        #                                  timezone.get_default_timezone())
-        #     end_dt += timedelta(days=1, hours=int(end_hour) - 24)
-        # else:
-        #     end_dt = timezone.make_aware(datetime(dt.year, dt.month, dt.day, int(end_hour), 00, 00),
-        #                                  timezone.get_default_timezone())
-        #
-        # if end_dt < start_dt:
-        #     end_dt += timedelta(hours=240)
-        #
-        # event_duration_minutes = (end_dt - start_dt).total_seconds() / 60.0
-
-        end_dt = current_dt + timedelta(seconds=update_interval_seconds)
-        duration_minutes = (end_dt - start_dt).total_seconds() / 60.0
+    start_dt = timezone.make_aware(datetime(dt.year, dt.month, dt.day, event_start_hour, 00, 00),
+                                   timezone.get_default_timezone())
 
-        try:
-            event = Event.objects.get(start_dt__year=start_dt.year, start_dt__month=start_dt.month,
-                                      start_dt__day=start_dt.day)
-            end_dt = max(event.end_dt, end_dt)
+    current_dt = timezone.make_aware(dt, timezone.get_default_timezone())
 
-        except Event.DoesNotExist:
-            event_type = EventType.objects.get(name__iexact=event_type_name)
+    end_dt = current_dt + timedelta(seconds=extend_seconds)
 
-            event = Event(start_dt=start_dt, end_dt=end_dt, duration_minutes=duration_minutes, event_type=event_type)
+    try:
+        event = Event.objects.get(start_dt__year=start_dt.year, start_dt__month=start_dt.month,
+                                  start_dt__day=start_dt.day)
+        end_dt = max(event.end_dt, end_dt)
 
-        if event is None:
-            raise ValueError("Could find appropriate event starting at %s", start_dt)
+    except Event.DoesNotExist:
+        event_type = EventType.objects.get(name__iexact=event_type_name)
 
-        event.start_dt = start_dt
-        event.end_dt = end_dt
+        event = Event(start_dt=start_dt, end_dt=end_dt, event_type=event_type)
 
-        event.duration_minutes = duration_minutes
+    if event is None:
+        raise ValueError("Could find appropriate event starting at %s", start_dt)
 
-        event.save()
+    event.start_dt = start_dt
+    event.end_dt = end_dt
 
-        current_players = list_present_players_on_server()
-        for raw_username in current_players:
-            if len(raw_username.strip()) == 0:
-                continue
+    # Measured to the extended end, so a late flush of an earlier sample does not shorten the event.
+    event.duration_minutes = (end_dt - start_dt).total_seconds() / 60.0
 
-            username = interpret_raw_username(raw_username)
+    event.save()
 
-            if len(username) == 0:
-                continue
+    return event
+
+
+def add_attendance_seconds(event, attendance_seconds_by_raw_username):
+    """Add presence time to the attendances of an event, creating attendances for players new to the event.
+
+    Existing attendances are incremented by a single UPDATE and new ones are added with a single bulk insert. The
+    event row stays locked until the transaction commits, so overlapping updates of the same event are serialized
+    instead of losing increments or inserting the same attendance twice.
+
+    :param event:
+    :param attendance_seconds_by_raw_username: seconds of presence to add per raw username.
+    :return:
+    """
+    with transaction.atomic():
+        if not connection.features.has_select_for_update:
+            # SQLite ignores row locks and fails a transaction that reads before it writes while another one is
+            # writing, writing first makes it wait for the database write lock instead.
+            Event.objects.filter(pk=event.pk).update(end_dt=F("end_dt"))
+
+        # Locked and read again, the stored ratios are computed from the current event times and type.
+        event = Event.objects.select_for_update().select_related("event_type").get(pk=event.pk)
+
+        members = resolve_members_for_raw_usernames(attendance_seconds_by_raw_username)
+
+        added_seconds_by_member_pk = {}
+        for raw_username, member in members.items():
+            added_seconds_by_member_pk[member.pk] = (added_seconds_by_member_pk.get(member.pk, 0) +
+                                                     attendance_seconds_by_raw_username[raw_username])
+
+        if len(added_seconds_by_member_pk) == 0:
+            return
+
+        event_attendances = Attendance.objects.filter(event=event, member__in=list(added_seconds_by_member_pk))
+
+        event_attendances.update(attendance_seconds=F("attendance_seconds") + Case(
+            *[When(member_id=member_pk, then=Value(int(added_seconds)))
+              for member_pk, added_seconds in added_seconds_by_member_pk.items()],
+            default=Value(0), output_field=IntegerField()))
+
+        recorded_member_pks = set(event_attendances.values_list("member_id", flat=True))
+
+        Attendance.objects.bulk_create([
+            Attendance(event=event, member_id=member_pk, attendance_seconds=added_seconds)
+            for member_pk, added_seconds in added_seconds_by_member_pk.items()
+            if member_pk not in recorded_member_pks
+        ])
+
+        Attendance.update_attendance_ratios_for_event(event)
+
+    # Bulk updates and inserts send no signals.
+    invalidate_reports_for_dt(event.start_dt)
+
+
+def update_attendance_for_current_event(update_interval_seconds=300, event_type_name="Unknown", event_start_hour=20):
+    """None
+
+    :return:
+    """
+    try:
+        event = update_current_event(update_interval_seconds, event_type_name=event_type_name,
+                                     event_start_hour=event_start_hour)
+
+        current_players = list_present_players_on_server()
+        add_attendance_seconds(event, {raw_username: update_interval_seconds for raw_username in current_players})
 
-            try:
-                member = Member.objects.get(name__iexact=username, discharged=False, deleted=False)
-            except Member.DoesNotExist:
-                rank_str = RECRUIT_RANK
-                try:
-                    rank = Rank.objects.get(name__iexact=rank_str)
-                except Rank.DoesNotExist:
-                    rank = Rank(name=rank_str)
-                    rank.save()
-
-                member = Member(name=username, rank=rank)
-                member.save()
-            except MultipleObjectsReturned:
-                raise ValueError("Multiple users found with name %s!" % (username,))
-
-            try:
-                attendance = Attendance.objects.get(event=event, member=member)
-                attendance.attendance_seconds += update_interval_seconds
-                attendance.save()
-            except Attendance.DoesNotExist:
-                attendance = Attendance(event=event, member=member,
-                                        attendance_seconds=update_interval_seconds)
-                attendance.save()
         return JsonResponse({"success": True, "error": None})
     except Exception as e:
         return JsonResponse({"success": False, "error": traceback.format_exc()})
 
 
-def list_present_players_on_server():
+def list_present_players_on_server(server=None):
     """
 
+    :param server: optional ServerQuerier to reuse, a new one is opened otherwise.
     :return:
     """
-    server = valve.source.a2s.ServerQuerier(ARMA3_SERVER_MONITOR)
+    if server is None:
+        server = valve.source.a2s.ServerQuerier(ARMA3_SERVER_MONITOR)
     response = server.get_players()
     players = [player["name"] for player in response["players"]]
 
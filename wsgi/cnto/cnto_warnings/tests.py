@@ -1,3 +1,210 @@
+from datetime import date
+
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.timezone import datetime, timedelta
+
+from cnto.models import Absence, AbsenceType, Attendance, Event, EventType, Member, Rank
+from cnto_warnings.models import MemberWarning, MemberWarningType
+from cnto_warnings.warning_utils import allocate_ranks_and_add_warnings_for_cycle, \
+    iterate_low_recruit_attendance_checks, iterate_rank_allocation_checks_for_cycle, reconcile_warnings
+
+
+def create_event(event_type, start_dt, duration=timedelta(hours=2)):
+    return Event.objects.create(name=event_type.name, event_type=event_type, start_dt=start_dt,
+                                end_dt=start_dt + duration, duration_minutes=duration.total_seconds() / 60)
+
+
+class RecruitAttendanceWarningTests(TestCase):
+    def setUp(self):
+        self.recruit_rank = Rank.objects.create(name="Rct")
+        self.training_event_type = EventType.objects.create(name="Training", default_start_hour=20,
+                                                            default_end_hour=23,
+                                                            minimum_required_attendance_ratio=0.5,
+                                                            css_class_name="training")
+        MemberWarningType.objects.create(name="Low Attendance (Recruit)")
+
+    def test_checks_match_period_adequacy(self):
+        timezone_info = timezone.get_default_timezone()
+        absence_type = AbsenceType.objects.create(name="LOA")
+
+        # Events every third day, at midnight and in the evening, so some fall on the period boundaries.
+        events = []
+        for index in range(40):
+            hour = 0 if index % 2 == 0 else 20
+            events.append(create_event(self.training_event_type, timezone.make_aware(
+                datetime(2017, 1, 1, hour, 0) + timedelta(days=3 * index), timezone_info)))
+
+        recruits = []
+        for index in range(12):
+            recruit = Member.objects.create(name="Recruit%s" % (index,), rank=self.recruit_rank,
+                                            join_date=date(2017, 1, 1) + timedelta(days=5 * index))
+            recruits.append(recruit)
+
+            if index % 3 == 0:
+                Absence.objects.create(member=recruit, absence_type=absence_type, start_date=recruit.join_date,
+                                       end_date=recruit.join_date + timedelta(days=index + 3))
+
+            for event_index, event in enumerate(events):
+                if (event_index + index) % (index % 4 + 2) == 0:
+                    # Every third attendance is too short to be adequate.
+                    attendance_seconds = 600 if event_index % 3 == 0 else 5400
+                    Attendance.objects.create(member=recruit, event=event, attendance_seconds=attendance_seconds)
+
+        checks = list(iterate_low_recruit_attendance_checks())
+        self.assertEqual([member.pk for member, _, _, _ in checks], [recruit.pk for recruit in recruits])
+
+        warned = set()
+        for member, warning_type, is_warning, message in checks:
+            start_dt = member.join_date
+            end_dt, event_count = member.get_recruit_event_attendance_deadline_and_count()
+            adequate, expected_message = Attendance.was_adequate_for_period(
+                member, Event.all_for_time_period(start_dt, end_dt), start_dt, end_dt, adequate_if_absent=False,
+                min_total_events=event_count)
+
+            self.assertEqual(warning_type.name, "Low Attendance (Recruit)")
+            self.assertEqual((is_warning, message), (not adequate, expected_message), member.name)
+
+            if is_warning:
+                warned.add(member.pk)
+
+        # Both outcomes are covered.
+        self.assertTrue(0 < len(warned) < len(recruits))
+
+    def test_period_boundaries(self):
+        timezone_info = timezone.get_default_timezone()
+        recruit = Member.objects.create(name="Recruit", rank=self.recruit_rank, join_date=date(2017, 1, 1))
+        deadline_date, event_count = recruit.get_recruit_event_attendance_deadline_and_count()
+
+        # Events at midnight of the join date and the deadline count, events later on the deadline day do not.
+        start_dts = [datetime(2017, 1, 1, 0, 0), datetime(2017, 1, 10, 20, 0), datetime(2017, 2, 10, 20, 0),
+                     datetime(deadline_date.year, deadline_date.month, deadline_date.day, 0, 0),
+                     datetime(deadline_date.year, deadline_date.month, deadline_date.day, 20, 0)]
+        for start_dt in start_dts:
+            event = create_event(self.training_event_type, timezone.make_aware(start_dt, timezone_info))
+            Attendance.objects.create(member=recruit, event=event, attendance_seconds=7200)
+
+        self.assertEqual(event_count, len(start_dts))
+        self.assertEqual(list(iterate_low_recruit_attendance_checks()), [(
+            recruit, MemberWarningType.objects.get(), True,
+            "Did not attend enough events between 2017-01-01 and %s." % (deadline_date.strftime("%Y-%m-%d"),))])
+
+    def test_no_recruits(self):
+        Member.objects.create(name="Spartak", rank=Rank.objects.create(name="Gnt"))
+
+        self.assertEqual(list(iterate_low_recruit_attendance_checks()), [])
+
+
+class ReconcileWarningsTests(TestCase):
+    def setUp(self):
+        rank = Rank.objects.create(name="Gnt")
+        self.members = [Member.objects.create(name="Member%s" % (index,), rank=rank) for index in range(3)]
+        self.warning_type = MemberWarningType.objects.create(name="Mod Assessment Due")
+        self.other_warning_type = MemberWarningType.objects.create(name="Grunt Qualification Due")
+
+    def create_warning(self, member, message, warning_type=None):
+        if warning_type is None:
+            warning_type = self.warning_type
+
+        return MemberWarning.objects.create(member=member, warning_type=warning_type, message=message)
+
+    def get_stored_warnings(self):
+        return sorted(MemberWarning.objects.values_list("member__name", "warning_type__name", "message"))
+
+    def test_counts(self):
+        first_member, second_member, third_member = self.members
+        self.create_warning(first_member, "Kept")
+        self.create_warning(first_member, "Kept twice")
+        self.create_warning(first_member, "Kept twice")
+        self.create_warning(second_member, "Removed")
+        self.create_warning(third_member, "Not checked")
+
+        counts = reconcile_warnings([
+            (first_member, self.warning_type, True, "Kept"),
+            (first_member, self.warning_type, True, "Kept twice"),
+            (second_member, self.warning_type, True, "Removed"),
+            (second_member, self.warning_type, False, "Removed"),
+            (second_member, self.warning_type, True, "Added"),
+            (third_member, self.warning_type, False, "Never stored"),
+            (third_member, self.other_warning_type, True, "Added"),
+        ])
+
+        self.assertEqual(counts, {"added": 2, "kept": 3, "removed": 1})
+        self.assertEqual(self.get_stored_warnings(), [
+            ("Member0", "Mod Assessment Due", "Kept"),
+            ("Member0", "Mod Assessment Due", "Kept twice"),
+            ("Member0", "Mod Assessment Due", "Kept twice"),
+            ("Member1", "Mod Assessment Due", "Added"),
+            ("Member2", "Grunt Qualification Due", "Added"),
+            ("Member2", "Mod Assessment Due", "Not checked"),
+        ])
+
+        # Nothing changes when the same checks run again.
+        counts = reconcile_warnings([(first_member, self.warning_type, True, "Kept"),
+                                     (second_member, self.warning_type, True, "Added")])
+        self.assertEqual(counts, {"added": 0, "kept": 2, "removed": 0})
+
+    def test_retraction_deletes_only_matching_warnings(self):
+        first_member, second_member, _ = self.members
+        retracted_warning = self.create_warning(first_member, "Retracted")
+        self.create_warning(first_member, "Other message")
+        self.create_warning(first_member, "Retracted", self.other_warning_type)
+        self.create_warning(second_member, "Retracted")
+
+        counts = reconcile_warnings([(first_member, self.warning_type, False, "Retracted")])
+
+        self.assertEqual(counts, {"added": 0, "kept": 0, "removed": 1})
+        self.assertFalse(MemberWarning.objects.filter(pk=retracted_warning.pk).exists())
+        self.assertEqual(self.get_stored_warnings(), [
+            ("Member0", "Grunt Qualification Due", "Retracted"),
+            ("Member0", "Mod Assessment Due", "Other message"),
+            ("Member1", "Mod Assessment Due", "Retracted"),
+        ])
+
+
+class RankAllocationTests(TestCase):
+    def setUp(self):
+        Rank.objects.create(name="Rct")
+        self.gnt_rank = Rank.objects.create(name="Gnt")
+        self.res_rank = Rank.objects.create(name="Res")
+        training_event_type = EventType.objects.create(name="Training", default_start_hour=20, default_end_hour=23,
+                                                       minimum_required_attendance_ratio=0.5,
+                                                       css_class_name="training")
+        MemberWarningType.objects.create(name="Grunt Demoted")
+        MemberWarningType.objects.create(name="Reservist Promoted")
+
+        self.cycle_start_dt = datetime(2017, 3, 1)
+        self.active_reservist = Member.objects.create(name="Active", rank=self.res_rank, join_date=date(2017, 1, 1))
+        self.inactive_grunt = Member.objects.create(name="Inactive", rank=self.gnt_rank, join_date=date(2017, 1, 1))
+
+        for index in range(6):
+            event = create_event(training_event_type, timezone.make_aware(
+                datetime(2017, 3, 2, 20, 0) + timedelta(days=7 * index), timezone.get_default_timezone()))
+            Attendance.objects.create(member=self.active_reservist, event=event, attendance_seconds=7200)
+
+    def get_ranks(self):
+        return [Member.objects.get(pk=member.pk).rank_id for member in [self.active_reservist, self.inactive_grunt]]
+
+    def test_ranks_allocated_once(self):
+        self.assertEqual(allocate_ranks_and_add_warnings_for_cycle(self.cycle_start_dt),
+                         {"added": 2, "kept": 0, "removed": 0})
+        self.assertEqual(self.get_ranks(), [self.gnt_rank.pk, self.res_rank.pk])
+
+        # Ranks changed by hand afterwards are not allocated again for the same cycle.
+        Member.objects.filter(pk=self.active_reservist.pk).update(rank=self.res_rank)
+        self.assertEqual(allocate_ranks_and_add_warnings_for_cycle(self.cycle_start_dt),
+                         {"added": 0, "kept": 1, "removed": 0})
+        self.assertEqual(self.get_ranks(), [self.res_rank.pk, self.res_rank.pk])
+
+    def test_failed_run_keeps_ranks(self):
+        def failing_checks():
+            for warning_check in iterate_rank_allocation_checks_for_cycle(self.cycle_start_dt):
+                yield warning_check
+
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            reconcile_warnings(failing_checks())
 
-# Create your tests here.
+        self.assertEqual(self.get_ranks(), [self.res_rank.pk, self.gnt_rank.pk])
+        self.assertEqual(MemberWarning.objects.count(), 0)
@@ -2,11 +2,13 @@ import calendar
 from datetime import timedelta
 
 from django.contrib.auth.models import User
+from django.db import transaction
 
 from django.utils.timezone import datetime
 
 from django.utils import timezone
 
+from cnto.analytics import AttendanceMatrix
 from cnto.models import Member, Event, Attendance, Absence, Rank
 from cnto_contributions.models import Contribution
 from cnto_warnings.models import MemberWarning, MemberWarningType
@@ -28,48 +30,92 @@ def send_exception_email(exception_message):
                          exception_message)
 
 
-def warning_exists(member, warning_type, message):
-    """
+WARNING_COUNTER_NAMES = ["added", "kept", "removed"]
 
-    :return:
-    """
-    try:
-        MemberWarning.objects.get(member=member, warning_type=warning_type, message=message)
-        return True
-    except MemberWarning.DoesNotExist:
-        return False
 
-
-def create_or_update_warning(member, warning_type, warning_active, message):
+def get_existing_warnings(warning_type, member_pks):
     """
 
-    :param member:
     :param warning_type:
-    :param warning_active:
-    :param message:
-    :return:
+    :param member_pks:
+    :return: dict of the warning pks of the type per (member pk, message), in a single query.
     """
-    if warning_exists(member, warning_type, message):
-        warning = MemberWarning.objects.get(member=member, warning_type=warning_type, message=message)
-        if not warning_active:
-            warning.delete()
-    else:
-        if warning_active:
-            warning = MemberWarning(member=member, warning_type=warning_type, message=message)
-            warning.save()
+    existing_warnings = {}
+    for warning_pk, member_pk, message in MemberWarning.objects.filter(
+            warning_type=warning_type, member__in=member_pks).values_list("pk", "member_id", "message"):
+        existing_warnings.setdefault((member_pk, message), []).append(warning_pk)
 
+    return existing_warnings
 
-def add_and_update_mod_assessment_due():
+
+def reconcile_warnings(warning_checks):
+    """Bring the stored warnings in line with the outcome of a warning check run.
+
+    Active checks without a stored warning are created and inactive checks with one are deleted. Stored warnings
+    that were not checked are left alone, they record past cycles and events. Existing warnings are loaded with one
+    query per warning type and the changes are applied with bulk queries, in the transaction the checks run in.
+
+    :param warning_checks: iterable of (member, warning type, warning active, message) tuples, a later check of the
+    same warning overrides an earlier one.
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    counts = {counter_name: 0 for counter_name in WARNING_COUNTER_NAMES}
+    new_warnings = []
+    removed_warning_pks = []
+    # The checks are run inside the transaction, so changes they make, like the rank allocation, are committed or
+    # rolled back together with the warnings that record them.
+    with transaction.atomic():
+        warning_types = {}
+        checks_by_type_pk = {}
+        for member, warning_type, warning_active, message in warning_checks:
+            warning_types[warning_type.pk] = warning_type
+            checks_by_type_pk.setdefault(warning_type.pk, {})[(member.pk, message)] = warning_active
+
+        for warning_type_pk, checks in checks_by_type_pk.items():
+            existing_warnings = get_existing_warnings(warning_types[warning_type_pk],
+                                                      set(member_pk for member_pk, _ in checks))
+
+            for (member_pk, message), warning_active in checks.items():
+                warning_pks = existing_warnings.get((member_pk, message), [])
+                if warning_active and len(warning_pks) > 0:
+                    counts["kept"] += len(warning_pks)
+                elif warning_active:
+                    new_warnings.append(MemberWarning(member_id=member_pk, warning_type_id=warning_type_pk,
+                                                      message=message))
+                else:
+                    removed_warning_pks.extend(warning_pks)
+
+        if len(removed_warning_pks) > 0:
+            MemberWarning.objects.filter(pk__in=removed_warning_pks).delete()
+
+        if len(new_warnings) > 0:
+            MemberWarning.objects.bulk_create(new_warnings)
+
+    counts["added"] = len(new_warnings)
+    counts["removed"] = len(removed_warning_pks)
+
+    return counts
+
+
+def iterate_mod_assessment_due_checks():
     """
 
-    :return:
+    :return: warning checks for reconcile_warnings.
     """
     mod_assessment_due_warning_type = MemberWarningType.objects.get(name__iexact="Mod Assessment Due")
     recruits = Member.recruits()
 
     for member in recruits:
         mod_assessment_due, message = member.is_mod_assessment_due()
-        create_or_update_warning(member, mod_assessment_due_warning_type, mod_assessment_due, message)
+        yield member, mod_assessment_due_warning_type, mod_assessment_due, message
+
+
+def add_and_update_mod_assessment_due():
+    """
+
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    return reconcile_warnings(iterate_mod_assessment_due_checks())
 
 
 def send_warning_emails():
@@ -101,115 +147,179 @@ def send_warning_emails():
         warning.save()
 
 
-def add_and_update_grunt_qualification_due():
+def iterate_grunt_qualification_due_checks():
     """
 
-    :return:
+    :return: warning checks for reconcile_warnings.
     """
     grunt_qualification_due_warning_type = MemberWarningType.objects.get(name__iexact="Grunt Qualification Due")
     recruits = Member.recruits()
 
     for member in recruits:
         grunt_qualification_due, message = member.is_grunt_qualification_due()
-        create_or_update_warning(member, grunt_qualification_due_warning_type, grunt_qualification_due, message)
+        yield member, grunt_qualification_due_warning_type, grunt_qualification_due, message
 
 
-def add_absence_monitoring_warnings():
+def add_and_update_grunt_qualification_due():
     """
 
-    :return:
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    return reconcile_warnings(iterate_grunt_qualification_due_checks())
+
+
+def iterate_absence_monitoring_checks():
+    """
+
+    :return: warning checks for reconcile_warnings.
     """
     absence_starting_type = MemberWarningType.objects.get(name__iexact="Absence Starting")
     absence_ending_type = MemberWarningType.objects.get(name__iexact="Absence Ending")
     absence_violated_type = MemberWarningType.objects.get(name__iexact="Absence Violated")
 
-    absences = Absence.objects.filter(concluded=False, deleted=False)
+    absences = Absence.objects.filter(concluded=False, deleted=False).select_related("member")
     for absence in absences:
         # If the absence doesn't begin that day, it would be useful if notification would appear on warning tab and
         # email on the date when the absence actually begin; i.e. absence start date, with text:
         # "NAME's abesence begin today, please assign him the appropriate tag."
         if absence.start_date == timezone.now().date():
-            create_or_update_warning(absence.member, absence_starting_type,
-                                     True, "%s's absence begins on %s, please assign him the appropriate tag." % (
-                                         absence.member.name, absence.start_date.strftime("%Y-%m-%d")))
+            yield (absence.member, absence_starting_type,
+                   True, "%s's absence begins on %s, please assign him the appropriate tag." % (
+                       absence.member.name, absence.start_date.strftime("%Y-%m-%d")))
 
         # It would be very useful if we could have notification appear on the warning tab, a day after user's absence
         #  has ended, along with the email with the text:
         # "NAME's absence tag has ended on "DATE. Send him the stationary PM."
         if absence.end_date == (timezone.now() - timedelta(days=1)).date():
-            create_or_update_warning(absence.member, absence_ending_type,
-                                     True, "%s's absence tag has ended on %s. Send him the stationary PM." % (
-                                         absence.member.name, absence.end_date.strftime("%Y-%m-%d")))
+            yield (absence.member, absence_ending_type,
+                   True, "%s's absence tag has ended on %s. Send him the stationary PM." % (
+                       absence.member.name, absence.end_date.strftime("%Y-%m-%d")))
 
         # If the absence hasn't been concluded within 15 days of the expiration date, a new notification should
         # appear on the warning tab along with email with the text:
         # "NAME didn't reply to the stationary PM within two weeks of the PM."
         if absence.end_date == (timezone.now() - timedelta(days=15)).date():
-            create_or_update_warning(absence.member, absence_violated_type,
-                                     True,
-                                     "%s didn't reply to the stationary PM within two weeks of the ending date %s." % (
-                                         absence.member.name, absence.end_date.strftime("%Y-%m-%d")))
+            yield (absence.member, absence_violated_type,
+                   True,
+                   "%s didn't reply to the stationary PM within two weeks of the ending date %s." % (
+                       absence.member.name, absence.end_date.strftime("%Y-%m-%d")))
 
 
-def add_and_update_contribution_about_to_expire():
+def add_absence_monitoring_warnings():
     """
 
-    :return:
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    return reconcile_warnings(iterate_absence_monitoring_checks())
+
+
+def iterate_contribution_about_to_expire_checks():
+    """
+
+    :return: warning checks for reconcile_warnings.
     """
     relevant_expiry_date = timezone.now() + timedelta(days=14)
     contribution_expiry_warning_type = MemberWarningType.objects.get(name__iexact="Contribution Expiring")
-    expiring_contributions = Contribution.objects.filter(end_date=relevant_expiry_date)
+    expiring_contributions = Contribution.objects.filter(end_date=relevant_expiry_date).select_related("member",
+                                                                                                       "type")
 
     for contribution in expiring_contributions:
-        create_or_update_warning(contribution.member, contribution_expiry_warning_type,
-                                 True, "%s's %s contributor tag will run out at %s. Send him the stationary PM." % (
-                                     contribution.member.name, contribution.type.name,
-                                     contribution.end_date.strftime("%Y-%m-%d")))
+        yield (contribution.member, contribution_expiry_warning_type,
+               True, "%s's %s contributor tag will run out at %s. Send him the stationary PM." % (
+                   contribution.member.name, contribution.type.name,
+                   contribution.end_date.strftime("%Y-%m-%d")))
 
 
-def add_and_update_low_member_attendances_for_cycle(cycle_start_dt):
+def add_and_update_contribution_about_to_expire():
     """
 
-    :param month_dt:
-    :return:
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    return reconcile_warnings(iterate_contribution_about_to_expire_checks())
+
+
+def iterate_low_member_attendance_checks_for_cycle(cycle_start_dt):
+    """
+
+    :param cycle_start_dt:
+    :return: warning checks for reconcile_warnings.
     """
     low_attendance_warning_type = MemberWarningType.objects.get(name__iexact="Low Attendance")
     start_dt, end_dt = calculate_start_and_end_dt_for_cycle(cycle_start_dt)
 
     events = Event.all_for_time_period(start_dt, end_dt)
 
-    members = Member.active_members(include_recruits=False)
+    members = list(Member.active_members(include_recruits=False))
+    period_adequacy = Attendance.was_adequate_for_period_batch(members, events, start_dt, end_dt,
+                                                               adequate_if_absent=True)
 
     for member in members:
-        adequate, message = Attendance.was_adequate_for_period(member, events, start_dt, end_dt,
-                                                               adequate_if_absent=True)
+        adequate, message = period_adequacy[member.pk]
 
-        create_or_update_warning(member, low_attendance_warning_type, not adequate, message)
+        yield member, low_attendance_warning_type, not adequate, message
 
 
-def add_and_update_low_recruit_attendances():
+def add_and_update_low_member_attendances_for_cycle(cycle_start_dt):
     """
 
-    :param month_dt:
-    :return:
+    :param cycle_start_dt:
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    return reconcile_warnings(iterate_low_member_attendance_checks_for_cycle(cycle_start_dt))
+
+
+def iterate_low_recruit_attendance_checks():
+    """
+
+    :return: warning checks for reconcile_warnings.
     """
     low_attendance_warning_type = MemberWarningType.objects.get(name__iexact="Low Attendance (Recruit)")
 
-    members = Member.recruits()
+    # The absent days that push the deadlines back are summed in a single query.
+    members = Member.with_recruit_status(Member.recruits())
+    if len(members) == 0:
+        return
 
+    start_dts = []
+    end_dts = []
+    event_counts = []
     for member in members:
-        start_dt = member.join_date
-        end_dt, event_count = member.get_recruit_event_attendance_deadline_and_count()
+        end_date, event_count = member.get_recruit_event_attendance_deadline_and_count()
 
-        events = Event.all_for_time_period(start_dt, end_dt)
-        adequate, message = Attendance.was_adequate_for_period(member, events, start_dt, end_dt,
-                                                               adequate_if_absent=False,
-                                                               min_total_events=event_count)
+        # From midnight of the join date to midnight of the deadline, as when filtering events by the dates.
+        start_dts.append(timezone.make_aware(datetime(member.join_date.year, member.join_date.month,
+                                                      member.join_date.day), timezone.get_default_timezone()))
+        end_dts.append(timezone.make_aware(datetime(end_date.year, end_date.month, end_date.day),
+                                           timezone.get_default_timezone()))
+        event_counts.append(event_count)
 
-        create_or_update_warning(member, low_attendance_warning_type, not adequate, message)
+    events = Event.all_for_time_period(min(start_dts), max(end_dts)).select_related("event_type")
+    adequate_counts = AttendanceMatrix(members, events).get_adequate_counts_within(start_dts, end_dts)
 
+    for member, end_dt, event_count, adequate_count in zip(members, end_dts, event_counts, adequate_counts):
+        # Same outcome and messages as Attendance.was_adequate_for_period of the member's period, without absences.
+        if adequate_count < event_count:
+            message = "Did not attend enough events between %s and %s." % (member.join_date.strftime("%Y-%m-%d"),
+                                                                           end_dt.strftime("%Y-%m-%d"))
+            yield member, low_attendance_warning_type, True, message
+        else:
+            yield member, low_attendance_warning_type, False, "No attendance issues."
 
-def allocate_ranks_and_add_warnings_for_cycle(cycle_start_dt):
+
+def add_and_update_low_recruit_attendances():
+    """
+
+    :return: dict of the numbers of warnings added, kept and removed.
+    """
+    return reconcile_warnings(iterate_low_recruit_attendance_checks())
+
+
+def iterate_rank_allocation_checks_for_cycle(cycle_start_dt):
+    """Promote and demote members by their attendance in the cycle, unless the warning of the change exists already.
+
+    :param cycle_start_dt:
+    :return: warning checks for reconcile_warnings.
+    """
     start_dt, end_dt = calculate_start_and_end_dt_for_cycle(cycle_start_dt)
 
     gnt_demoted_warning_type = MemberWarningType.objects.get(name__iexact="Grunt Demoted")
@@ -219,56 +329,58 @@ def allocate_ranks_and_add_warnings_for_cycle(cycle_start_dt):
     event_count = events.count()
     min_gnt_event_count = round(float(event_count) / 3.0)
 
-    members = Member.active_members(include_recruits=False)
     gnt_rank = Rank.objects.get(name__iexact="gnt")
     res_rank = Rank.objects.get(name__iexact="res")
+    # Other ranks are not subject to attendance restrictions
+    members = list(Member.active_members(include_recruits=False).filter(rank__in=[gnt_rank, res_rank]).select_related(
+        "rank"))
+
+    period_adequacy = Attendance.was_adequate_for_period_batch(members, events, start_dt, end_dt,
+                                                               min_total_events=min_gnt_event_count,
+                                                               adequate_if_absent=False)
+
+    member_pks = [member.pk for member in members]
+    promoted_warnings = get_existing_warnings(res_promoted_warning_type, member_pks)
+    demoted_warnings = get_existing_warnings(gnt_demoted_warning_type, member_pks)
 
     for member in members:
         member_rank = member.rank
 
-        if member_rank != gnt_rank and member_rank != res_rank:
-            # Other ranks are not subject to attendance restrictions
-            continue
-
-        gnt_adequate, message = Attendance.was_adequate_for_period(member, events, start_dt, end_dt,
-                                                                   min_total_events=min_gnt_event_count,
-                                                                   adequate_if_absent=False)
+        gnt_adequate, message = period_adequacy[member.pk]
 
         if member_rank == res_rank and gnt_adequate:
             rank_message = "%s has been promoted to Grunt due to attending at least %s events between %s and %s." % (
                 member.name, min_gnt_event_count, start_dt.strftime("%Y-%m-%d"),
                 end_dt.strftime("%Y-%m-%d"))
 
-            if warning_exists(member, res_promoted_warning_type, rank_message):
-                continue
+            if (member.pk, rank_message) not in promoted_warnings:
+                # Promote to grunt
+                member.rank = gnt_rank
+                member.save()
 
-            # Promote to grunt
-            member.rank = gnt_rank
-            member.save()
-
-            create_or_update_warning(member, res_promoted_warning_type, True,
-                                     rank_message)
+            yield member, res_promoted_warning_type, True, rank_message
 
         elif member_rank == gnt_rank and not gnt_adequate:
             rank_message = "%s has been demoted to Reservist due to attending less than %s events between %s and %s." \
                            % (member.name, min_gnt_event_count, start_dt.strftime("%Y-%m-%d"),
                               end_dt.strftime("%Y-%m-%d"))
 
-            if warning_exists(member, gnt_demoted_warning_type, rank_message):
-                continue
+            if (member.pk, rank_message) not in demoted_warnings:
+                # Demote to reservist
+                member.rank = res_rank
+                member.save()
+
+            yield member, gnt_demoted_warning_type, True, rank_message
 
-            # Demote to reservist
-            member.rank = res_rank
-            member.save()
 
-            create_or_update_warning(member, gnt_demoted_warning_type, True,
-                                     rank_message)
+def allocate_ranks_and_add_warnings_for_cycle(cycle_start_dt):
+    return reconcile_warnings(iterate_rank_allocation_checks_for_cycle(cycle_start_dt))
 
 
 def allocate_ranks_and_add_warnings_for_previous_cycle():
     previous_cycle_start_dt = calculate_previous_cycle_start_dt()
 
-    allocate_ranks_and_add_warnings_for_cycle(previous_cycle_start_dt)
+    return allocate_ranks_and_add_warnings_for_cycle(previous_cycle_start_dt)
 
 
 def calculate_previous_cycle_start_dt():
@@ -301,8 +413,8 @@ def calculate_start_and_end_dt_for_cycle(month_dt):
 def add_and_update_low_attendance_for_previous_cycle():
     """
 
-    :return:
+    :return: dict of the numbers of warnings added, kept and removed.
     """
     previous_cycle_start_dt = calculate_previous_cycle_start_dt()
 
-    add_and_update_low_member_attendances_for_cycle(previous_cycle_start_dt)
+    return add_and_update_low_member_attendances_for_cycle(previous_cycle_start_dt)
@@ -18,38 +18,34 @@ if 'OPENSHIFT_REPO_DIR' in os.environ:
     os.environ['PYTHON_EGG_CACHE'] = get_python_lib()
 
 import django
-from cnto_warnings.models import MemberWarning
 from cnto_warnings.warning_utils import add_and_update_low_attendance_for_previous_cycle, \
     add_and_update_mod_assessment_due, \
     add_and_update_grunt_qualification_due, send_warning_emails, add_and_update_contribution_about_to_expire, \
-    send_exception_email, add_absence_monitoring_warnings, allocate_ranks_and_add_warnings_for_previous_cycle
+    send_exception_email, add_absence_monitoring_warnings, allocate_ranks_and_add_warnings_for_previous_cycle, \
+    WARNING_COUNTER_NAMES
 
 if __name__ == "__main__":
 
     django.setup()
 
-    start_count = MemberWarning.objects.all().count()
+    counts = {counter_name: 0 for counter_name in WARNING_COUNTER_NAMES}
 
     print("Adding and updating warnings...")
     try:
-        allocate_ranks_and_add_warnings_for_previous_cycle()
-        add_and_update_low_attendance_for_previous_cycle()
-        add_and_update_mod_assessment_due()
-        add_and_update_grunt_qualification_due()
-        add_and_update_contribution_about_to_expire()
-        add_absence_monitoring_warnings()
+        for add_and_update_warnings in [allocate_ranks_and_add_warnings_for_previous_cycle,
+                                        add_and_update_low_attendance_for_previous_cycle,
+                                        add_and_update_mod_assessment_due,
+                                        add_and_update_grunt_qualification_due,
+                                        add_and_update_contribution_about_to_expire,
+                                        add_absence_monitoring_warnings]:
+            warning_counts = add_and_update_warnings()
+            for counter_name in WARNING_COUNTER_NAMES:
+                counts[counter_name] += warning_counts[counter_name]
     except Exception as e:
         send_exception_email(str(traceback.format_exc()))
         raise
 
-    end_count = MemberWarning.objects.all().count()
-
-    if start_count < end_count:
-        print("Added %s warnings!" % (end_count - start_count))
-    elif end_count < start_count:
-        print("Removed %s warnings!" % (start_count - end_count))
-    else:
-        print("No change to warnings!")
+    print("Added %s, kept %s and removed %s warnings!" % (counts["added"], counts["kept"], counts["removed"]))
 
     try:
         print("Sending emails...")
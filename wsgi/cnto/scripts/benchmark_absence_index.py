@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Benchmark absence lookups through Absence.build_index against one query per member and event.
+
+For every roster size a synthetic roster is created inside a transaction that is rolled back afterwards. Every
+member is then checked for an absence on the day of every event, once with Absence.get_absence_for_event and once
+with the interval index, which must agree on every check.
+
+    python scripts/benchmark_absence_index.py --members 20 80 320
+"""
+
+import argparse
+import collections
+import os
+import sys
+import time
+
+## GETTING-STARTED: make sure the next line points to your settings.py:
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'cnto.settings'
+
+## GETTING-STARTED: make sure the next line points to your django project dir:
+if 'OPENSHIFT_REPO_DIR' in os.environ:
+    sys.path.append(os.path.join(os.environ['OPENSHIFT_REPO_DIR'], 'libs'))
+    sys.path.append(os.path.join(os.environ['OPENSHIFT_REPO_DIR'], 'wsgi', 'cnto'))
+
+    from distutils.sysconfig import get_python_lib
+
+    os.environ['PYTHON_EGG_CACHE'] = get_python_lib()
+
+import django
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+class RollBack(Exception):
+    pass
+
+
+def check_absences_per_query(members, events):
+    """
+
+    :param members:
+    :param events:
+    :return: set of the (member pk, event pk) pairs where the member was absent.
+    """
+    from cnto.models import Absence
+
+    absences = set()
+    for member in members:
+        for event in events:
+            try:
+                Absence.get_absence_for_event(event, member)
+                absences.add((member.pk, event.pk))
+            except Absence.DoesNotExist:
+                pass
+
+    return absences
+
+
+def check_absences_with_index(members, events):
+    """
+
+    :param members:
+    :param events:
+    :return: set of the (member pk, event pk) pairs where the member was absent.
+    """
+    from cnto.models import Absence
+
+    absence_index = Absence.build_index()
+
+    absences = set()
+    for member in members:
+        for event in events:
+            if absence_index.contains(member.pk, event.start_dt.date()):
+                absences.add((member.pk, event.pk))
+
+    return absences
+
+
+def measure(check_absences, members, events, repeat):
+    """
+
+    :param check_absences:
+    :param members:
+    :param events:
+    :param repeat:
+    :return: absences, query count and best duration in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start_time = time.time()
+            absences = check_absences(members, events)
+            durations.append(time.time() - start_time)
+
+    return absences, len(queries), min(durations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark absence lookups on synthetic rosters.")
+    parser.add_argument("--members", type=int, nargs="+", default=[20, 80, 320],
+                        help="Roster sizes to benchmark.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    arguments = parser.parse_args()
+
+    django.setup()
+
+    from synthetic_roster import build_roster
+
+    # One query per check exceeds the number of queries the connection logs by default.
+    connection.queries_log = collections.deque(maxlen=1000000)
+
+    for member_count in arguments.members:
+        try:
+            with transaction.atomic():
+                members, events = build_roster(member_count, seed=arguments.seed)
+
+                index_absences, index_query_count, index_duration = measure(
+                    check_absences_with_index, members, events, arguments.repeat)
+                query_absences, query_count, query_duration = measure(
+                    check_absences_per_query, members, events, arguments.repeat)
+
+                if index_absences != query_absences:
+                    raise ValueError("Absences of %s members found through the index differ from the queried ones!" %
+                                     (member_count,))
+
+                print("%s checks, %s absent: index %s queries / %.3f s, per check %s queries / %.3f s" % (
+                    len(members) * len(events), len(index_absences), index_query_count, index_duration, query_count,
+                    query_duration))
+
+                raise RollBack()
+        except RollBack:
+            pass
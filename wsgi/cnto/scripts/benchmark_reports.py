@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Benchmark the monthly report matrix on synthetic rosters.
+
+For every roster size a synthetic roster is created inside a transaction that is rolled back afterwards. The report
+of March 2017 is then built with AttendanceReport and with the former member by member and event by event queries of
+cnto.tests.get_report_context_per_member, which must give the same context. The query count of AttendanceReport must
+not grow with the roster.
+
+    python scripts/benchmark_reports.py --members 20 80 320
+"""
+
+import argparse
+import collections
+import os
+import sys
+import time
+
+## GETTING-STARTED: make sure the next line points to your settings.py:
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'cnto.settings'
+
+## GETTING-STARTED: make sure the next line points to your django project dir:
+if 'OPENSHIFT_REPO_DIR' in os.environ:
+    sys.path.append(os.path.join(os.environ['OPENSHIFT_REPO_DIR'], 'libs'))
+    sys.path.append(os.path.join(os.environ['OPENSHIFT_REPO_DIR'], 'wsgi', 'cnto'))
+
+    from distutils.sysconfig import get_python_lib
+
+    os.environ['PYTHON_EGG_CACHE'] = get_python_lib()
+
+import django
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.timezone import datetime
+
+
+class RollBack(Exception):
+    pass
+
+
+def measure(build_context, repeat):
+    """
+
+    :param build_context:
+    :param repeat:
+    :return: context, query count and best duration in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start_time = time.time()
+            context = build_context()
+            durations.append(time.time() - start_time)
+
+    return context, len(queries), min(durations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the monthly report on synthetic rosters.")
+    parser.add_argument("--members", type=int, nargs="+", default=[20, 80, 320],
+                        help="Roster sizes to benchmark.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    arguments = parser.parse_args()
+
+    django.setup()
+
+    from cnto.reports import AttendanceReport
+    from cnto.tests import get_report_context_per_member
+    from synthetic_roster import build_roster
+
+    timezone_info = timezone.get_default_timezone()
+    start_dt = timezone.make_aware(datetime(2017, 3, 1), timezone_info)
+    end_dt = timezone.make_aware(datetime(2017, 3, 31, 23, 59, 59), timezone_info)
+
+    # The per member report of large rosters runs more queries than the connection logs by default.
+    connection.queries_log = collections.deque(maxlen=1000000)
+
+    report_query_counts = set()
+    for member_count in arguments.members:
+        try:
+            with transaction.atomic():
+                build_roster(member_count, seed=arguments.seed)
+
+                context, query_count, duration = measure(lambda: AttendanceReport(start_dt, end_dt).get_context(),
+                                                         arguments.repeat)
+                per_member_context, per_member_query_count, per_member_duration = measure(
+                    lambda: get_report_context_per_member(start_dt, end_dt), arguments.repeat)
+
+                if context != per_member_context:
+                    raise ValueError("Report of %s members differs from the per member report!" % (member_count,))
+
+                report_query_counts.add(query_count)
+                print("%s members, %s events: AttendanceReport %s queries / %.3f s, per member %s queries / %.3f s" % (
+                    member_count, context["event_count"], query_count, duration, per_member_query_count,
+                    per_member_duration))
+
+                raise RollBack()
+        except RollBack:
+            pass
+
+    if len(report_query_counts) > 1:
+        raise ValueError("AttendanceReport query count depends on the roster size: %s" % (
+            sorted(report_query_counts),))
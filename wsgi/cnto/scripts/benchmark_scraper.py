@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Benchmark the concurrent event page fetching of the attendance scraper against recorded stats pages.
+
+The recorded pages in cnto/test_data/stats_pages are served by a local HTTP server that delays every response to
+model the remote stats site. The scrape is run one page at a time and with every requested concurrency limit, and
+each run must produce the same attendances and stats as the sequential one.
+
+    python scripts/benchmark_scraper.py --latency 0.3 --concurrency 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+## GETTING-STARTED: make sure the next line points to your settings.py:
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'cnto.settings'
+
+## GETTING-STARTED: make sure the next line points to your django project dir:
+if 'OPENSHIFT_REPO_DIR' in os.environ:
+    sys.path.append(os.path.join(os.environ['OPENSHIFT_REPO_DIR'], 'libs'))
+    sys.path.append(os.path.join(os.environ['OPENSHIFT_REPO_DIR'], 'wsgi', 'cnto'))
+
+    from distutils.sysconfig import get_python_lib
+
+    os.environ['PYTHON_EGG_CACHE'] = get_python_lib()
+
+import django
+import pytz
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.timezone import datetime
+
+STATS_PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cnto", "test_data",
+                               "stats_pages")
+
+# The recorded game history reaches back beyond this, so the scraper stops paging before the last recorded page.
+SCRAPE_START_DT = timezone.make_aware(datetime(2017, 3, 5, 12, 0), pytz.utc)
+SCRAPE_END_DT = timezone.make_aware(datetime(2017, 3, 13, 0, 0), pytz.utc)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def get_recorded_page_path(url_path, query):
+    """
+
+    :param url_path:
+    :param query:
+    :return: path of the recorded page for a stats site URL, or None.
+    """
+    if url_path.startswith("/server/data/"):
+        return os.path.join(STATS_PAGES_DIR, "game-history-%s.html" % (int(query.get("page", ["1"])[0]),))
+    elif url_path.startswith("/server/event/"):
+        return os.path.join(STATS_PAGES_DIR, "event-%s.html" % (int(url_path.rsplit("/", 1)[1]),))
+
+    return None
+
+
+def create_recorded_page_handler(latency_seconds):
+    class RecordedPageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency_seconds)
+
+            url = urlparse(self.path)
+            page_path = get_recorded_page_path(url.path, parse_qs(url.query))
+            if page_path is None or not os.path.exists(page_path):
+                self.send_error(404)
+                return
+
+            with open(page_path, "rb") as page_file:
+                page_content = page_file.read()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page_content)))
+            self.end_headers()
+            self.wfile.write(page_content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RecordedPageHandler
+
+
+def run_scrape(max_concurrent_page_loads):
+    """
+
+    :param max_concurrent_page_loads:
+    :return: scraped attendances, stats and duration of the scrape in seconds.
+    """
+    from utils.attendance_scraper import get_all_event_attendances_between
+
+    start_time = time.time()
+    overall_attendances, stats = get_all_event_attendances_between(
+        SCRAPE_START_DT, SCRAPE_END_DT, max_concurrent_page_loads=max_concurrent_page_loads)
+
+    return overall_attendances, stats, time.time() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent event page fetching on recorded pages.")
+    parser.add_argument("--latency", type=float, default=0.25,
+                        help="Seconds the local server waits before answering a request.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[2, 4, 8],
+                        help="Concurrency limits to compare with fetching one page at a time.")
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    django.setup()
+
+    from utils import attendance_scraper
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), create_recorded_page_handler(arguments.latency))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    attendance_scraper.BASE_SERVER_SCRAPE_URL = "http://127.0.0.1:%s" % (server.server_address[1],)
+    attendance_scraper.CNTO_SERVER_SCRAPE_URL = attendance_scraper.BASE_SERVER_SCRAPE_URL + "/server/data/375393"
+
+    try:
+        # Without a cache directory every run loads all pages from the server.
+        with override_settings(SCRAPER_CACHE_DIR=None):
+            sequential_attendances, sequential_stats, _ = run_scrape(1)
+
+            for max_concurrent_page_loads in [1] + arguments.concurrency:
+                durations = []
+                for _ in range(arguments.repeat):
+                    overall_attendances, stats, duration = run_scrape(max_concurrent_page_loads)
+                    if overall_attendances != sequential_attendances or stats != sequential_stats:
+                        raise ValueError("Scrape with %s concurrent page loads differs from the sequential scrape!" %
+                                         (max_concurrent_page_loads,))
+
+                    durations.append(duration)
+
+                print("%s concurrent page loads: best %.3f s, mean %.3f s over %s runs, %s players" % (
+                    max_concurrent_page_loads, min(durations), sum(durations) / len(durations), len(durations),
+                    len(overall_attendances)))
+    finally:
+        server.shutdown()
@@ -0,0 +1,86 @@
+"""Synthetic roster shared by the benchmark scripts, import it after django.setup().
+
+"""
+
+import random
+from datetime import date
+
+from django.utils import timezone
+from django.utils.timezone import datetime, timedelta
+
+from cnto.models import Absence, AbsenceType, Attendance, Event, EventType, Member, MemberGroup, Rank
+
+# Events are created around March 2017 on the usual event weekdays, at hours that put some of them on the other side
+# of a month boundary in UTC.
+ROSTER_START_DATE = date(2017, 2, 25)
+ROSTER_END_DATE = date(2017, 4, 3)
+EVENT_WEEKDAYS = (1, 4, 5)
+EVENT_START_HOURS = (0, 20, 23)
+
+
+def build_roster(member_count, seed=1):
+    """Create events, members, attendances and absences, randomized from the seed.
+
+    Around one member in twenty is deleted or discharged, most others are in a group, and about a third of the
+    absences are deleted.
+
+    :param member_count:
+    :param seed:
+    :return: created members and events.
+    """
+    random_generator = random.Random(seed)
+    timezone_info = timezone.get_default_timezone()
+
+    ranks = [Rank.objects.get_or_create(name=rank_name)[0] for rank_name in ("Rct", "Gnt", "Spc")]
+    groups = [MemberGroup.objects.get_or_create(name=group_name)[0] for group_name in ("Alpha", "Bravo", "Charlie")]
+    event_types = [EventType.objects.get_or_create(name=event_type_name, defaults={
+        "default_start_hour": 20, "default_end_hour": 23, "minimum_required_attendance_ratio": ratio,
+        "css_class_name": event_type_name.lower()})[0] for event_type_name, ratio in (("Training", 0.5),
+                                                                                       ("Campaign", 0.6))]
+    absence_type = AbsenceType.objects.get_or_create(name="LOA")[0]
+
+    events = []
+    event_date = ROSTER_START_DATE
+    while event_date < ROSTER_END_DATE:
+        if event_date.weekday() in EVENT_WEEKDAYS:
+            start_dt = timezone.make_aware(datetime(event_date.year, event_date.month, event_date.day,
+                                                    random_generator.choice(EVENT_START_HOURS), 30), timezone_info)
+            events.append(Event.objects.create(name="Synthetic event", event_type=random_generator.choice(event_types),
+                                               start_dt=start_dt, end_dt=start_dt + timedelta(hours=3),
+                                               duration_minutes=180))
+
+        event_date += timedelta(days=1)
+
+    members = []
+    absences = []
+    attendances = []
+    for index in range(member_count):
+        member = Member.objects.create(
+            name="Member%04d" % (index,), bi_name="Member%04d" % (index,), rank=random_generator.choice(ranks),
+            member_group=random_generator.choice(groups + [None]),
+            join_date=date(2017, 3, 1) + timedelta(days=random_generator.randint(-60, 20)),
+            mods_assessed=random_generator.random() < 0.7, deleted=random_generator.random() < 0.05,
+            discharged=random_generator.random() < 0.05)
+        members.append(member)
+
+        # Absences of a member do not overlap, Absence.get_absence_for_event expects at most one per day.
+        start_date = date(2017, 2, 10)
+        for _ in range(random_generator.randint(0, 2)):
+            start_date += timedelta(days=random_generator.randint(0, 25))
+            end_date = start_date + timedelta(days=random_generator.randint(0, 10))
+            absences.append(Absence(member=member, absence_type=absence_type, start_date=start_date,
+                                    end_date=end_date, deleted=random_generator.random() < 0.3))
+            start_date = end_date + timedelta(days=1)
+
+        for event in events:
+            if random_generator.random() < 0.6:
+                attendances.append(Attendance(member=member, event=event,
+                                              attendance_seconds=random_generator.randint(0, 4 * 3600)))
+
+    Absence.objects.bulk_create(absences)
+    Attendance.objects.bulk_create(attendances)
+
+    for event in events:
+        Attendance.update_attendance_ratios_for_event(event)
+
+    return members, events